@@ -0,0 +1,219 @@
+"""
+Admission control podle odhadované paměťové špičky úlohy
+
+Před spuštěním dávky se odhadne špička paměti zařízení (váhy modelu,
+aktivace UNetu podle rozlišení a velikosti dávky, dekódování VAE, naučený
+upscaler) a hostitele (načítání vah, výsledné obrázky po upscalingu). Dávka se spustí jen pokud se
+vejde do rozpočtu; jinak čeká ve frontě, případně se zmenší počet vzorků
+v jednom volání pipeline. Úloha, která se nevejde nikdy, je odmítnuta hned.
+
+Upscaling běží ve vlastním stupni až po odšumování. Jeho část odhadu
+(estimate['stage']) zůstává rezervovaná, dokud stupeň neskončí. Slot
+dávky se ale uvolní hned, takže další dávka může odšumovat souběžně,
+pokud se vejde vedle rozpracovaného upscalingu.
+
+Koeficienty jsou hrubé odhady pro SDXL v fp16 s attention/VAE slicingem
+a lze je doladit přes environment variables.
+"""
+
+import os
+import threading
+from typing import Optional
+
+import psutil
+import torch
+
+from config import ENABLE_CPU_OFFLOAD, MAX_MEMORY_GB
+from esrgan import ESRGAN_TILE, ESRGAN_TILE_BATCH, is_resident
+
+# Podíl paměti zařízení a hostitele, který smí úlohy využít
+DEVICE_MEMORY_FRACTION = float(os.getenv('DEVICE_MEMORY_FRACTION', '0.9'))
+HOST_MEMORY_FRACTION = float(os.getenv('HOST_MEMORY_FRACTION', '0.8'))
+# Aktivace UNetu na jeden vzorek dávky (včetně CFG větve) na megapixel
+ACTIVATION_GB_PER_MP = float(os.getenv('ACTIVATION_GB_PER_MP', '1.5'))
+# Špička dekódování VAE na megapixel (VAE slicing = jeden obrázek najednou)
+VAE_DECODE_GB_PER_MP = float(os.getenv('VAE_DECODE_GB_PER_MP', '2.5'))
+# Váhy SDXL base (UNet + oba text encodery + VAE) v fp16
+SDXL_WEIGHTS_GB = float(os.getenv('SDXL_WEIGHTS_GB', '7.0'))
+# Největší submodel (UNet) - s CPU offloadem je na zařízení jen ten
+UNET_WEIGHTS_GB = float(os.getenv('UNET_WEIGHTS_GB', '5.0'))
+# Aktivace naučeného upscaleru na megapixel výstupní dlaždice
+ESRGAN_GB_PER_MP = float(os.getenv('ESRGAN_GB_PER_MP', '0.5'))
+# Počet současně běžících dávek na jednom zařízení
+MAX_CONCURRENT_PER_DEVICE = int(os.getenv('MAX_CONCURRENT_PER_DEVICE', '1'))
+
+_GB = 1024 ** 3
+
+
+def model_weights_gb(model_path: str, model_type: str, device: str) -> float:
+    """
+    Odhad velikosti vah pipeline v paměti. ONNX backend drží UNet a VAE jen
+    v sessions (eager váhy uvolní), takže i tam je v ustáleném stavu jedna
+    kopie; dvojí kopii během exportu a vytváření sessions kryje podíl
+    načítání v estimate_memory.
+    """
+    file_gb = os.path.getsize(model_path) / _GB if os.path.isfile(model_path) else 0.0
+    weights = SDXL_WEIGHTS_GB + file_gb if model_type == "lora" else max(file_gb, SDXL_WEIGHTS_GB)
+    # Na CPU běží pipeline ve float32
+    return weights * 2 if device == "cpu" else weights
+
+
+def uses_cpu_offload(device: str) -> bool:
+    """Stejné rozhodnutí o CPU offloadu jako v load_pipeline."""
+    if device == "cpu":
+        return False
+    if ENABLE_CPU_OFFLOAD == 'auto':
+        return torch.cuda.get_device_properties(torch.device(device)).total_memory < MAX_MEMORY_GB * _GB
+    return ENABLE_CPU_OFFLOAD.lower() == 'true'
+
+
+def upscaler_memory_gb(path: str, device: str) -> float:
+    """
+    Špička naučeného upscaleru - váhy (pokud ještě nejsou rezidentní)
+    a aktivace jedné dávky dlaždic. Síť zvětšuje nejvýš 4x.
+    """
+    weights = 0.0
+    if not is_resident(path, device) and os.path.isfile(path):
+        weights = os.path.getsize(path) / _GB
+    tile_mp = (ESRGAN_TILE * 4) ** 2 / float(1024 * 1024)
+    activations = ESRGAN_TILE_BATCH * tile_mp * ESRGAN_GB_PER_MP
+    # Na CPU běží síť ve float32, na GPU ve float16
+    return (weights + activations) * 2 if device == "cpu" else weights + activations
+
+
+def estimate_memory(params: dict, resolution, total_samples: int, chunk: int, device: str, resident: bool) -> dict:
+    """
+    Odhad špičky paměti dávky v GB.
+
+    resolution je bucket (šířka, výška), chunk počet vzorků v jednom volání
+    pipeline, resident říká, zda jsou váhy modelu už načtené.
+    """
+    # Hires fix - druhý průchod (a dekódování VAE) běží ve zvětšeném rozlišení
+    megapixels = resolution[0] * resolution[1] / float(1024 * 1024) * max(1.0, params.get('hires_scale', 1.0)) ** 2
+    weights = model_weights_gb(params['model_path'], params['model_type'], device)
+    cfg_branches = 2 if params.get('guidance_scale', 7.5) > 1.0 else 1
+    activations = chunk * cfg_branches * ACTIVATION_GB_PER_MP * megapixels + VAE_DECODE_GB_PER_MP * megapixels
+    if device == "cpu":
+        activations *= 2
+
+    upscale = max(1, int(params.get('upscale_factor', 1)))
+    # RGB výsledky po upscalingu + pracovní kopie při resize a kódování PNG
+    outputs = total_samples * megapixels * 1024 * 1024 * 3 * upscale ** 2 * 3 / _GB
+    # Načítání nového modelu prochází přes RAM hostitele
+    loading = 0.0 if resident else weights
+    # S CPU offloadem drží váhy hostitel a na zařízení je vždy jen aktivní submodel
+    offload = uses_cpu_offload(device)
+    device_weights = min(weights, UNET_WEIGHTS_GB) if offload else (0.0 if resident else weights)
+    if offload and resident:
+        loading = 0.0
+
+    device_gb = device_weights + activations
+    host_gb = outputs + loading
+    if device == "cpu":
+        # Zařízení je hostitel - vše jde z jednoho rozpočtu
+        host_gb += device_gb
+        device_gb = 0.0
+    # Podíl stupně upscalingu - drží se až do jeho dokončení
+    stage = {'device_gb': 0.0, 'host_gb': outputs if upscale > 1 else 0.0}
+    if upscale > 1 and params.get('upscaler'):
+        # Síť běží na zařízení workeru - na CPU jde z rozpočtu hostitele
+        model_gb = upscaler_memory_gb(params['upscaler'], device)
+        if device == "cpu":
+            stage['host_gb'] += model_gb
+            host_gb += model_gb
+        else:
+            stage['device_gb'] += model_gb
+            device_gb += model_gb
+    return {'device_gb': device_gb, 'host_gb': host_gb, 'chunk': chunk, 'weights_gb': weights, 'stage': stage}
+
+
+class AdmissionController:
+    """Rozpočet paměti jednoho zařízení a rezervace běžících dávek."""
+
+    def __init__(self, device: str = "cpu"):
+        self.device = device
+        self._condition = threading.Condition()
+        self._running = 0
+        self._reserved_device_gb = 0.0
+        self._reserved_host_gb = 0.0
+        # Klouzavý průměr sekund na vzorek pro odhad čekání
+        self.seconds_per_sample = None
+
+    def device_budget_gb(self) -> float:
+        if self.device == "cpu":
+            return 0.0
+        return torch.cuda.get_device_properties(torch.device(self.device)).total_memory / _GB * DEVICE_MEMORY_FRACTION
+
+    def host_budget_gb(self) -> float:
+        return psutil.virtual_memory().total / _GB * HOST_MEMORY_FRACTION
+
+    def device_in_use_gb(self) -> float:
+        """Paměť zařízení držená živými tensory (rezidentní váhy)."""
+        if self.device == "cpu":
+            return 0.0
+        return torch.cuda.memory_allocated(torch.device(self.device)) / _GB
+
+    def host_available_gb(self) -> float:
+        used_by_others = psutil.virtual_memory().total - psutil.virtual_memory().available
+        return max(0.0, self.host_budget_gb() - used_by_others / _GB)
+
+    def can_ever_fit(self, estimate: dict) -> bool:
+        """Vejde se úloha alespoň do prázdného zařízení a hostitele?"""
+        return estimate['device_gb'] <= self.device_budget_gb() and estimate['host_gb'] <= self.host_budget_gb()
+
+    def fits_now(self, estimate: dict) -> bool:
+        device_free = self.device_budget_gb() - self.device_in_use_gb() - self._reserved_device_gb
+        host_free = self.host_available_gb() - self._reserved_host_gb
+        return (
+            self._running < MAX_CONCURRENT_PER_DEVICE
+            and estimate['device_gb'] <= device_free
+            and estimate['host_gb'] <= host_free
+        )
+
+    def choose_chunk(self, estimate_fn, max_chunk: int):
+        """Největší počet vzorků v jednom volání pipeline, který se vejde do rozpočtu zařízení."""
+        for chunk in range(max(1, max_chunk), 0, -1):
+            estimate = estimate_fn(chunk)
+            if self.can_ever_fit(estimate):
+                return estimate
+        return None
+
+    def acquire(self, estimate: dict, on_wait=None):
+        """Blokuje, dokud se dávka nevejde do rozpočtu, pak ji rezervuje."""
+        with self._condition:
+            while not self.fits_now(estimate):
+                if on_wait:
+                    on_wait()
+                # Paměť hostitele mohou uvolnit i jiné procesy - kontrolujeme periodicky
+                self._condition.wait(timeout=1.0)
+            self._running += 1
+            self._reserved_device_gb += estimate['device_gb']
+            self._reserved_host_gb += estimate['host_gb']
+
+    def release(self, estimate: dict, samples: int = 0, elapsed: float = 0.0, keep: Optional[dict] = None):
+        """
+        Uvolní slot dávky a její rezervaci. Část keep (podíl stupně upscalingu)
+        zůstane rezervovaná až do release_stage.
+        """
+        keep = keep or {'device_gb': 0.0, 'host_gb': 0.0}
+        with self._condition:
+            self._running -= 1
+            self._reserved_device_gb -= estimate['device_gb'] - keep['device_gb']
+            self._reserved_host_gb -= estimate['host_gb'] - keep['host_gb']
+            if samples and elapsed:
+                rate = elapsed / samples
+                self.seconds_per_sample = rate if self.seconds_per_sample is None else 0.8 * self.seconds_per_sample + 0.2 * rate
+            self._condition.notify_all()
+
+    def release_stage(self, stage: dict):
+        """Uvolní rezervaci stupně upscalingu ponechanou při release(keep=...)."""
+        with self._condition:
+            self._reserved_device_gb -= stage['device_gb']
+            self._reserved_host_gb -= stage['host_gb']
+            self._condition.notify_all()
+
+    def estimated_wait(self, samples_ahead: int) -> float:
+        """Odhad čekání na zpracování vzorků před úlohou (None bez historie)."""
+        if self.seconds_per_sample is None:
+            return None
+        return samples_ahead * self.seconds_per_sample
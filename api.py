@@ -0,0 +1,246 @@
+"""
+HTTP job API pro dávkové klienty bez prohlížeče
+
+Běží uvnitř procesu inference enginu, takže sdílí rezidentní pipeline
+i frontu úloh s UI. Úloha se odešle jedním POST a hned vrátí id; stav,
+progress, časy a výsledky se čtou samostatnými endpointy.
+
+    POST   /jobs                      multipart: image + parametry apply_style
+    GET    /jobs/<id>                 stav, progress, časy, report
+    GET    /jobs/<id>/result/<index>  výsledek, ?format=png|webp|jpeg (výchozí png), ?size= náhled z pyramidy
+    GET    /jobs/<id>/archive         ZIP všech variant s manifest.json (streamovaně, chunked)
+    POST   /jobs/<id>/cancel          zrušení čekající nebo běžící úlohy
+    DELETE /jobs/<id>                 zrušení (pokud neskončila) a uvolnění výsledků
+
+    POST   /uploads                   JSON: filename, size, sha256, [model_type]
+    GET    /uploads/<id>              přijaté a chybějící chunky (navázání)
+    PUT    /uploads/<id>/chunks/<i>   tělo = chunk, volitelně hlavička X-Chunk-SHA256
+    POST   /uploads/<id>/complete     ověření SHA-256 a publikace do katalogu modelů
+    GET    /health
+"""
+
+import io
+import os
+import threading
+import ipaddress
+
+from flask import Flask, Response, jsonify, request, send_file
+from werkzeug.serving import make_server
+
+from archive import stream_zip, variant_entries
+from config import API_HOST, API_PORT, API_TOKEN, DEFAULT_PARAMS, FULL_MODELS_PATH, LORA_MODELS_PATH, UPSCALER_MODELS_PATH
+from encoding import FORMATS, get_encoder, pyramid_level
+from preprocess import decode_image
+from uploads import UploadManager
+
+# Parametry, které API přijímá (ostatní pole formuláře se ignorují)
+API_PARAMS = dict(DEFAULT_PARAMS, model_path="", model_type="")
+
+
+def parse_params(form) -> dict:
+    """Převede pole formuláře na parametry úlohy podle typů výchozích hodnot."""
+    params = {}
+    for key, default in API_PARAMS.items():
+        if key not in form:
+            continue
+        value = form[key].strip()
+        if value == "" or value.lower() == "none":
+            params[key] = default
+        elif isinstance(default, bool):
+            params[key] = value.lower() in ('1', 'true', 'yes', 'on')
+        elif isinstance(default, int) or key in ('seed', 'variance_seed'):
+            params[key] = int(value)
+        elif isinstance(default, float):
+            params[key] = float(value)
+        else:
+            params[key] = value
+    return params
+
+
+def within(path: str, roots) -> bool:
+    """Leží cesta (po rozvinutí symlinků) uvnitř některé z povolených složek?"""
+    real = os.path.realpath(path)
+    for root in roots:
+        root = os.path.realpath(root)
+        if os.path.commonpath([real, root]) == root:
+            return True
+    return False
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def create_app(engine) -> Flask:
+    """Flask aplikace nad běžícím enginem."""
+    app = Flask(__name__)
+    uploads = UploadManager()
+
+    @app.before_request
+    def check_token():
+        if API_TOKEN and request.path != "/health":
+            if request.headers.get("Authorization") != f"Bearer {API_TOKEN}":
+                return jsonify({'error': "Neplatný token"}), 401
+
+    @app.errorhandler(KeyError)
+    def unknown_job(e):
+        # Neznámá úloha nebo nahrávání (i zrušené či dokončené během zápisu chunku)
+        return jsonify({'error': e.args[0] if e.args else str(e)}), 404
+
+    @app.get("/health")
+    def health():
+        info = engine.op_system_info()
+        return jsonify({'status': "ok", 'device': info['device_reason'], 'queue_length': info['queue_length']})
+
+    @app.post("/jobs")
+    def submit_job():
+        if 'image' not in request.files:
+            return jsonify({'error': "Chybí soubor image"}), 400
+        try:
+            params = parse_params(request.form)
+        except ValueError as e:
+            return jsonify({'error': f"Neplatný parametr: {e}"}), 400
+
+        # Jen modely z katalogu - API nesmí načíst libovolný soubor ze serveru
+        model_path = params.get('model_path')
+        if not model_path or not within(model_path, (LORA_MODELS_PATH, FULL_MODELS_PATH)) or not os.path.isfile(model_path):
+            return jsonify({'error': f"Model nenalezen v katalogu: {model_path}"}), 400
+        upscaler = params.get('upscaler')
+        if upscaler and (not within(upscaler, (UPSCALER_MODELS_PATH,)) or not os.path.isfile(upscaler)):
+            return jsonify({'error': f"Upscaler nenalezen v {UPSCALER_MODELS_PATH}: {upscaler}"}), 400
+        if not params.get('model_type'):
+            params['model_type'] = engine.op_detect_model_type(model_path)
+
+        try:
+            image = decode_image(request.files['image'].stream)
+        except Exception as e:
+            return jsonify({'error': f"Nelze načíst obrázek: {e}"}), 400
+
+        job_id = engine.submit_style(image, params)
+        return jsonify({'job_id': job_id, 'status_url': f"/jobs/{job_id}"}), 202
+
+    @app.get("/jobs/<job_id>")
+    def job_status(job_id):
+        state = engine.op_status(job_id)
+        job = engine.get_job(job_id)
+        if not job.future.done() or job.future.exception() is not None:
+            return jsonify(state)
+        result = job.future.result()
+        if state['kind'] == "grid":
+            # Grid (spuštěný z UI) má kontaktní arch a buňky na disku, ne varianty
+            state['grid'] = {
+                'contact_sheet_path': result['contact_sheet_path'],
+                'output_dir': result['output_dir'],
+                'cells': [{k: v for k, v in cell.items() if k != 'image'} for cell in result['cells']],
+            }
+        else:
+            state['results'] = [f"/jobs/{job_id}/result/{i}" for i in range(len(result))]
+            state['archive'] = f"/jobs/{job_id}/archive"
+        return jsonify(state)
+
+    def variants_error(job_id: str):
+        """Chybová odpověď, pokud úloha nemá (nebo ještě nemá) varianty ke stažení."""
+        job = engine.get_job(job_id)
+        if not job.future.done():
+            return jsonify({'error': "Úloha ještě neskončila", 'status': job.status}), 409
+        if job.status == "cancelled":
+            return jsonify({'error': "Úloha byla zrušena", 'status': job.status}), 409
+        if job.future.exception() is not None:
+            return jsonify({'error': str(job.future.exception())}), 500
+        if engine.op_status(job_id)['kind'] == "grid":
+            return jsonify({'error': "Grid úloha nemá varianty, viz pole grid ve stavu úlohy"}), 409
+        return None
+
+    @app.get("/jobs/<job_id>/result/<int:index>")
+    def job_result(job_id, index):
+        error = variants_error(job_id)
+        if error is not None:
+            return error
+        job = engine.get_job(job_id)
+        images = job.future.result()
+        if not 0 <= index < len(images):
+            return jsonify({'error': "Výsledek s tímto indexem neexistuje"}), 404
+        fmt = request.args.get('format', "png").lower()
+        if fmt not in FORMATS:
+            return jsonify({'error': f"Neznámý formát: {fmt}"}), 400
+
+        size = request.args.get('size', type=int)
+
+        # Stejné bajty, jaké engine zakódoval pro úložiště - opakované stažení nekóduje znovu
+        data = get_encoder().get(f"{job_id}_{index}", images[index], fmt, max_size=pyramid_level(size) if size else None)
+        return send_file(io.BytesIO(data), mimetype=FORMATS[fmt]['mime'],
+                         download_name=f"{job_id}_{index}.{FORMATS[fmt]['ext']}")
+
+    @app.get("/jobs/<job_id>/archive")
+    def job_archive(job_id):
+        error = variants_error(job_id)
+        if error is not None:
+            return error
+        job = engine.get_job(job_id)
+        record = engine.store.get(job_id)
+        entries = variant_entries(job_id, job.future.result(), job.params, job.report.get('seeds', []),
+                                  record['outputs'] if record else None)
+        # Bez Content-Length - server posílá archiv po blocích (chunked)
+        return Response(stream_zip(entries), mimetype="application/zip",
+                        headers={'Content-Disposition': f'attachment; filename="{job_id}.zip"'})
+
+    @app.post("/jobs/<job_id>/cancel")
+    def cancel_job(job_id):
+        cancelled = engine.cancel_job(job_id, "Zrušeno přes API")
+        return jsonify({'job_id': job_id, 'cancelled': cancelled, 'status': engine.get_job(job_id).status})
+
+    @app.post("/uploads")
+    def create_upload():
+        body = request.get_json(silent=True) or request.form
+        try:
+            status = uploads.create(body.get('filename'), int(body.get('size', 0)), body.get('sha256'), body.get('model_type') or None)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(status), 200 if status['status'] == "done" else 201
+
+    @app.get("/uploads/<upload_id>")
+    def upload_status(upload_id):
+        return jsonify(uploads.status(upload_id))
+
+    @app.put("/uploads/<upload_id>/chunks/<int:index>")
+    def upload_chunk(upload_id, index):
+        try:
+            # Tělo se čte po blocích přímo ze socketu do souboru
+            status = uploads.write_chunk(upload_id, index, request.stream, request.headers.get("X-Chunk-SHA256"))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({k: v for k, v in status.items() if k != 'missing'})
+
+    @app.post("/uploads/<upload_id>/complete")
+    def complete_upload(upload_id):
+        try:
+            return jsonify(uploads.complete(upload_id, engine.op_detect_model_type))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+
+    @app.delete("/jobs/<job_id>")
+    def release_job(job_id):
+        try:
+            engine.cancel_job(job_id, "Zrušeno přes API")
+        except KeyError:
+            pass
+        engine.op_release(job_id)
+        return jsonify({'released': job_id})
+
+    return app
+
+
+def start_api(engine, host: str = API_HOST, port: int = API_PORT):
+    """Spustí HTTP server v samostatném vlákně enginu (bez tokenu jen na loopbacku)."""
+    if not API_TOKEN and not is_loopback(host):
+        print(f"❌ HTTP API na {host} bez API_TOKEN odmítnuto - nastavte API_TOKEN nebo API_HOST=127.0.0.1")
+        return None
+    server = make_server(host, port, create_app(engine), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True, name="http-api").start()
+    print(f"✅ HTTP API naslouchá na {host}:{port}")
+    return server
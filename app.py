@@ -1,36 +1,19 @@
 import streamlit as st
-import torch
 from PIL import Image
 import os
 import io
-from diffusers import StableDiffusionXLImg2ImgPipeline
-from diffusers.utils import load_image
-from diffusers import (
-    DPMSolverMultistepScheduler,
-    EulerDiscreteScheduler,
-    EulerAncestralDiscreteScheduler,
-    DDIMScheduler,
-    LMSDiscreteScheduler,
-    PNDMScheduler
-)
-from safetensors.torch import load_file
 import time
-import gc
 from pathlib import Path
-import platform
-import psutil
 from typing import Optional
 
-# Environment variables pro konfiguraci
-FORCE_CPU = os.getenv('FORCE_CPU', 'false').lower() == 'true'
-MAX_MEMORY_GB = float(os.getenv('MAX_MEMORY_GB', '8'))
-# BASE_MODEL - nepoužíváme base modely, pouze uživatelské full a LoRA modely
-ENABLE_ATTENTION_SLICING = os.getenv('ENABLE_ATTENTION_SLICING', 'true').lower() == 'true'
-ENABLE_CPU_OFFLOAD = os.getenv('ENABLE_CPU_OFFLOAD', 'auto')
-LORA_MODELS_PATH = os.getenv('LORA_MODELS_PATH', '/data/loras')
-FULL_MODELS_PATH = os.getenv('FULL_MODELS_PATH', '/data/models')
-HF_HOME = os.getenv('HF_HOME', '/root/.cache/huggingface')
-BASE_MODEL = os.getenv('BASE_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0')
+from archive import prune_exports, variant_entries, write_zip
+from config import LORA_MODELS_PATH, FULL_MODELS_PATH, GUIDANCE_MODES, BACKENDS, EXPORTS_PATH, UPSCALER_MODELS_PATH
+from encoding import FORMATS, THUMBNAIL_SIZES, get_encoder, pyramid_level
+from grid import parse_value_list
+from engine_client import EngineError, JobCancelled, ensure_engine
+from preprocess import prepare_upload
+from result_store import get_result_store
+from uploads import UploadManager
 
 # Nastavení stránky
 st.set_page_config(page_title="AI Stylový Přenos", page_icon="🎨", layout="wide")
@@ -449,24 +432,6 @@ h3 { font-size: 1.25rem; }
 </style>
 """, unsafe_allow_html=True)
 
-# Vytvoření adresářů - s fallback pro lokální vývoj
-try:
-    os.makedirs(LORA_MODELS_PATH, exist_ok=True)
-    os.makedirs(FULL_MODELS_PATH, exist_ok=True)
-except OSError:
-    # Fallback pro lokální vývoj - použij lokální složky
-    LORA_MODELS_PATH = './lora_models'
-    FULL_MODELS_PATH = './models'
-    os.makedirs(LORA_MODELS_PATH, exist_ok=True)
-    os.makedirs(FULL_MODELS_PATH, exist_ok=True)
-
-try:
-    os.makedirs(HF_HOME, exist_ok=True)
-except OSError:
-    # Fallback pro HuggingFace cache
-    HF_HOME = os.path.expanduser('~/.cache/huggingface')
-    os.makedirs(HF_HOME, exist_ok=True)
-
 def detect_runpod_paths():
     """Detekuje dostupné RunPod cesty pro modely."""
     possible_paths = {
@@ -551,40 +516,222 @@ def get_full_models_list():
     
     return sorted(models, key=lambda x: x['name'])
 
-# Funkce pro detekci hardware
-def get_system_info():
-    """Získá informace o systému a dostupném hardware"""
-    info = {
-        'platform': platform.system(),
-        'cpu_count': psutil.cpu_count(),
-        'memory_gb': psutil.virtual_memory().total / (1024**3),
-        'cuda_available': torch.cuda.is_available(),
-        'cuda_device_count': torch.cuda.device_count() if torch.cuda.is_available() else 0,
-        'cuda_device_name': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
-        'cuda_memory_gb': torch.cuda.get_device_properties(0).total_memory / (1024**3) if torch.cuda.is_available() else 0
-    }
-    return info
+def get_upscaler_models_list():
+    """Cesty k naučeným upscalerům (ESRGAN) v UPSCALER_MODELS_PATH."""
+    upscalers = []
+    if os.path.exists(UPSCALER_MODELS_PATH):
+        for root, dirs, files in os.walk(UPSCALER_MODELS_PATH):
+            for file in files:
+                if file.endswith((".safetensors", ".pth")):
+                    upscalers.append(os.path.join(root, file))
+    return sorted(upscalers)
+
+def resolve_model_path():
+    """Vrátí cestu k vybranému modelu - nahraný model už leží publikovaný v katalogu."""
+    return st.session_state.current_upload_path or st.session_state.current_model_path
+
+def wait_for_job(engine, job_id: str, progress_fn):
+    """
+    Čeká na úlohu v enginu. Když Streamlit skript přeruší (změna parametrů,
+    tlačítko Zrušit, zavření záložky), úloha se v enginu zruší.
+    """
+    finished = False
+    try:
+        result = engine.wait(job_id, progress_fn)
+        finished = True
+        return result
+    except EngineError:
+        # Úloha v enginu skončila sama (chyba nebo zrušení jinde)
+        finished = True
+        raise
+    finally:
+        if not finished:
+            engine.cancel(job_id, "Zrušeno z UI")
+
+def show_results(results: dict, output_placeholder, preview_format: str) -> None:
+    """
+    Zobrazí výsledky stylu (náhled, galerie variant, stažení). Každá varianta
+    se do formátu kóduje jednou - rerun a výběr varianty berou bajty z cache.
+    """
+    job_id, images = results['job_id'], results['images']
+    encoder = get_encoder()
+    
+    def preview(index: int, width: int) -> bytes:
+        # Úroveň pyramidy podle zobrazené šířky - do prohlížeče nejde víc pixelů, než je vidět
+        return encoder.get(f"{job_id}_{index}", images[index], preview_format, max_size=pyramid_level(width))
+    
+    def png(index: int) -> bytes:
+        return encoder.get(f"{job_id}_{index}", images[index], "png")
+    
+    output_placeholder.empty()
+    
+    if len(images) == 1:
+        with output_placeholder.container():
+            st.image(preview(0, int(400 * 0.84)), width=int(400 * 0.84))
+            
+            # Tlačítko pro stažení
+            st.download_button(
+                label="📥 Stáhnout",
+                data=png(0),
+                file_name="result.png",
+                mime="image/png",
+                use_container_width=True
+            )
+        return
+    
+    # Pro více variant zobrazíme info v col2 a mřížku pod sloupci
+    with output_placeholder.container():
+        st.markdown(f"### 🖼️ {len(images)} variant")
+        st.markdown("*Mřížka níže*")
+    
+    # Galerie variant s velkým náhledem a miniaturami
+    st.markdown("---")
+    st.markdown('<div class="variant-gallery">', unsafe_allow_html=True)
+    st.markdown(f"### 🖼️ Galerie variant ({len(images)})")
+    
+    selected = min(st.session_state.get('selected_variant', 0), len(images) - 1)
+    
+    # Hlavní náhled
+    st.markdown('<div class="variant-main-preview">', unsafe_allow_html=True)
+    st.markdown(f"**Varianta {selected + 1} - Hlavní náhled**")
+    st.image(preview(selected, 1024), use_column_width=True)
+    
+    # Tlačítko pro stažení vybrané varianty
+    st.download_button(
+        label=f"📥 Stáhnout variantu {selected + 1}",
+        data=png(selected),
+        file_name=f"result_variant_{selected + 1}.png",
+        mime="image/png",
+        key="download_selected_variant",
+        use_container_width=True
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Miniatury variant
+    st.markdown("**Vyberte variantu:**")
+    st.markdown('<div class="variant-thumbnails">', unsafe_allow_html=True)
+    
+    # Vytvoření sloupců pro miniatury (max 4 na řádek)
+    cols_per_row = min(4, len(images))
+    rows = (len(images) + cols_per_row - 1) // cols_per_row
+    
+    for row in range(rows):
+        thumbnail_cols = st.columns(cols_per_row)
+        for col_idx in range(cols_per_row):
+            img_idx = row * cols_per_row + col_idx
+            if img_idx < len(images):
+                with thumbnail_cols[col_idx]:
+                    # CSS třída pro vybranou miniaturu
+                    thumbnail_class = "selected" if img_idx == selected else ""
+                    
+                    # Tlačítko pro výběr varianty
+                    if st.button(
+                        f"Varianta {img_idx + 1}",
+                        key=f"select_variant_{img_idx}",
+                        use_container_width=True
+                    ):
+                        st.session_state.selected_variant = img_idx
+                        st.rerun()
+                    
+                    # Miniatura obrázku
+                    st.markdown(f'<div class="variant-thumbnail {thumbnail_class}">', unsafe_allow_html=True)
+                    st.image(preview(img_idx, 150), width=150)
+                    st.markdown('</div>', unsafe_allow_html=True)
+                    
+                    # Individuální tlačítko pro stažení
+                    st.download_button(
+                        label="📥",
+                        data=png(img_idx),
+                        file_name=f"variant_{img_idx + 1}.png",
+                        mime="image/png",
+                        key=f"download_thumb_{img_idx}",
+                        help=f"Stáhnout variantu {img_idx + 1}"
+                    )
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Stažení všech variant - ZIP se streamuje na disk po blocích, ne v paměti.
+    # Do paměti Streamlitu se načte jen po vyžádání a po stažení se zase zahodí,
+    # ne při každém rerunu stránky.
+    archive_path = os.path.join(EXPORTS_PATH, f"{job_id}.zip")
+    # Export mohla mezitím smazat retence (EXPORTS_MAX_AGE_H)
+    if st.session_state.get('export_ready') != job_id or not os.path.exists(archive_path):
+        if st.button("📦 Připravit ZIP všech variant", use_container_width=True):
+            if not os.path.exists(archive_path):
+                with st.spinner("Balím varianty..."):
+                    prune_exports(EXPORTS_PATH)
+                    write_zip(variant_entries(job_id, images, results['params'], results['seeds']), archive_path)
+            st.session_state.export_ready = job_id
+            st.rerun()
+    else:
+        with open(archive_path, "rb") as f:
+            st.download_button(
+                label="📦 Stáhnout všechny varianty",
+                data=f,
+                file_name=f"varianty_{job_id[:8]}.zip",
+                mime="application/zip",
+                key="download_all_variants",
+                on_click=lambda: st.session_state.pop('export_ready', None),
+                use_container_width=True
+            )
+    
+    st.markdown('</div>', unsafe_allow_html=True)
 
-def get_optimal_device():
-    """Určí optimální zařízení pro inference s fallback pro CUDA chyby"""
-    if FORCE_CPU:
-        return "cpu", "Vynuceno CPU"
+def show_history(page_size: int = 12) -> None:
+    """
+    Historie výsledků po stránkách - čte jen index a miniatury, plný
+    obrázek až po otevření konkrétního výsledku.
+    """
+    store = get_result_store()
+    total = store.count()
+    if total == 0:
+        st.caption("Zatím žádné uložené výsledky")
+        return
     
-    if not torch.cuda.is_available():
-        return "cpu", "CUDA není dostupná"
+    # Kurzory stránek (id, pod kterým stránka začíná) - další stránka je jeden skok po indexu
+    cursors = st.session_state.setdefault('history_cursors', [None])
+    records = store.page(cursors[-1], page_size)
+    st.caption(f"{total} výsledků · stránka {len(cursors)} z {(total + page_size - 1) // page_size}")
     
-    try:
-        # Test CUDA funkčnosti s RTX 5090 fallback
-        test_tensor = torch.randn(10, device='cuda')
-        _ = test_tensor + 1  # Jednoduchý test operace
-        gpu_memory = torch.cuda.get_device_properties(0).total_memory / (1024**3)
-        if gpu_memory < 4:
-            return "cpu", f"Nedostatek GPU paměti ({gpu_memory:.1f} GB < 4 GB)"
-        
-        return "cuda", f"GPU: {torch.cuda.get_device_name(0)} ({gpu_memory:.1f} GB)"
-    except Exception as e:
-        # Fallback na CPU při CUDA chybách (RTX 5090 kompatibilita)
-        return "cpu", f"CUDA chyba - fallback na CPU: {str(e)[:30]}..."
+    cols_per_row = 4
+    for row_start in range(0, len(records), cols_per_row):
+        cols = st.columns(cols_per_row)
+        for col, record in zip(cols, records[row_start:row_start + cols_per_row]):
+            with col:
+                st.image(store.thumbnail(record), width=150)
+                st.caption(
+                    f"{record['model_name']} · seed {record['seed']} · "
+                    f"{time.strftime('%d.%m. %H:%M', time.localtime(record['created_at']))}"
+                )
+                if st.button("📂 Otevřít", key=f"history_open_{record['id']}", use_container_width=True):
+                    st.session_state.history_selected = record
+    
+    nav_prev, nav_next = st.columns(2)
+    with nav_prev:
+        if len(cursors) > 1 and st.button("← Novější", key="history_prev", use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with nav_next:
+        if len(records) == page_size and st.button("Starší →", key="history_next", use_container_width=True):
+            cursors.append(records[-1]['id'])
+            st.rerun()
+    
+    selected = st.session_state.get('history_selected')
+    if selected:
+        st.markdown("---")
+        data = store.image_bytes(selected)
+        # Zobrazí se úroveň pyramidy, stáhne se původní PNG
+        image = Image.open(io.BytesIO(data))
+        st.image(get_encoder().get(selected['sha256'], image, "webp", max_size=pyramid_level(1024)), use_column_width=True)
+        st.download_button(
+            label="📥 Stáhnout",
+            data=data,
+            file_name=f"{selected['job_id'][:8]}_{selected['variant'] + 1}.png",
+            mime="image/png",
+            key="history_download",
+            use_container_width=True
+        )
+        st.json(selected['params'], expanded=False)
 
 def show_progress_bar(progress: float, text: str = "") -> None:
     """Zobrazí progress bar s textem"""
@@ -603,8 +750,14 @@ def update_progress(progress_bar, progress: float, text: str = "") -> None:
 # Odstraněno podle požadavku uživatele
 
 # Systémové informace přesunuty do sidebaru
-sys_info = get_system_info()
-device, device_reason = get_optimal_device()
+# Inference běží v samostatném procesu enginu - UI je jen klient
+try:
+    engine = ensure_engine()
+    sys_info = engine.system_info()
+except EngineError as e:
+    st.error(f"❌ {e}")
+    st.stop()
+device, device_reason = sys_info['device'], sys_info['device_reason']
 
 # Zobrazení varování při CUDA chybě
 if "chyba" in device_reason.lower():
@@ -612,264 +765,9 @@ if "chyba" in device_reason.lower():
 
 # Hlavní obsah bude přesunut do col_main
 
-# Funkce pro detekci typu modelu
-def detect_model_type(file_path):
-    """Detekuje zda je soubor LoRA model nebo full safetensors model"""
-    try:
-        # Načteme metadata ze safetensors souboru
-        state_dict = load_file(file_path)
-        
-        # Kontrola velikosti souboru
-        file_size = os.path.getsize(file_path) / (1024 * 1024 * 1024)  # GB
-        
-        # LoRA modely jsou obvykle menší (< 1GB) a obsahují specifické klíče
-        lora_keys = ['lora_unet', 'lora_te', 'alpha', 'rank']
-        has_lora_keys = any(any(lora_key in key for lora_key in lora_keys) for key in state_dict.keys())
-        
-        # Full modely jsou větší a obsahují kompletní váhy
-        full_model_keys = ['model.diffusion_model', 'first_stage_model', 'cond_stage_model']
-        has_full_keys = any(any(full_key in key for full_key in full_model_keys) for key in state_dict.keys())
-        
-        if has_lora_keys or file_size < 1.0:
-            return "lora"
-        elif has_full_keys or file_size > 2.0:
-            return "full_model"
-        else:
-            # Pokud nejsme si jisti, zkusíme podle velikosti
-            return "lora" if file_size < 1.0 else "full_model"
-            
-    except Exception as e:
-        st.warning(f"Nelze detekovat typ modelu: {e}")
-        return "unknown"
-
-# Funkce pro aplikaci stylu na vstupní obrázek
-def apply_style(input_image, model_path, model_type, strength, guidance_scale, num_inference_steps, progress_callback, clip_skip=2, seed=None, upscale_factor=1, num_images=1, sampler="DPMSolverMultistepScheduler", variance_seed=None, variance_strength=0.0):
-    # Použití optimální device detekce s fallback
-    device, device_reason = get_optimal_device()
-    torch_dtype = torch.float16 if device == "cuda" else torch.float32
-    
-    # Logování device informací
-    if "chyba" in device_reason.lower():
-        print(f"Warning: {device_reason}")
-    
-    # Progress tracking - začátek
-    progress_callback(0.1)
-    
-    # Pokročilé vyčištění paměti před načtením
-    if device == "cuda":
-        torch.cuda.empty_cache()
-        torch.cuda.synchronize()
-    gc.collect()
-    
-    # Nastavení memory efficient attention pro velké modely
-    os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:512"
-    
-    # Optimalizace pro velké modely na základě environment variables
-    enable_memory_efficient_attention = ENABLE_ATTENTION_SLICING
-    
-    if ENABLE_CPU_OFFLOAD == 'auto':
-        enable_cpu_offload = device == "cpu" or (torch.cuda.is_available() and torch.cuda.get_device_properties(0).total_memory < MAX_MEMORY_GB * 1024**3)
-    else:
-        enable_cpu_offload = ENABLE_CPU_OFFLOAD.lower() == 'true'
-    
-    try:
-        # Progress tracking - načítání modelu
-        progress_callback(0.2)
-        
-        if model_type == "lora":
-            # Robustnější CUDA handling pro RTX 5090
-            try:
-                # Načtení base modelu pro LoRA
-                pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-                    BASE_MODEL,
-                    torch_dtype=torch_dtype,
-                    variant="fp16" if device == "cuda" else None,
-                    use_safetensors=True,
-                    low_cpu_mem_usage=True,
-                    clip_skip=clip_skip
-                )
-            except RuntimeError as cuda_error:
-                if "CUDA" in str(cuda_error):
-                    # Fallback na CPU při CUDA chybě
-                    st.warning(f"⚠️ CUDA chyba při načítání modelu, přepínám na CPU: {str(cuda_error)[:50]}...")
-                    device = "cpu"
-                    torch_dtype = torch.float32
-                    pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-                        BASE_MODEL,
-                        torch_dtype=torch_dtype,
-                        use_safetensors=True,
-                        low_cpu_mem_usage=True,
-                        clip_skip=clip_skip
-                    )
-                else:
-                    raise cuda_error
-            
-            # Progress tracking - optimalizace
-            progress_callback(0.4)
-            
-            # Memory efficient optimizations
-            if enable_memory_efficient_attention:
-                pipe.enable_attention_slicing()
-                pipe.enable_vae_slicing()
-                
-            if enable_cpu_offload:
-                pipe.enable_model_cpu_offload()
-            else:
-                pipe = pipe.to(device)
-            
-            # Progress tracking - načítání LoRA
-            progress_callback(0.5)
-            
-            # Načtení LoRA modelu - robustnější přístup
-            try:
-                # Pokus o načtení jako adresář s adapter_config.json
-                if os.path.isdir(model_path):
-                    pipe.load_lora_weights(model_path)
-                else:
-                    # Načtení .safetensors souboru přímo
-                    pipe.load_lora_weights(model_path, adapter_name="lora_adapter")
-            except Exception as e:
-                try:
-                    # Fallback - načtení pomocí from_single_file
-                    pipe.load_lora_weights(model_path, weight_name=os.path.basename(model_path))
-                except Exception as e2:
-                    st.warning(f"Nelze načíst LoRA model: {e2}")
-                    # Pokračovat bez LoRA
-                    pass
-                
-        elif model_type == "full_model":
-            # Načtení full safetensors modelu
-            try:
-                pipe = StableDiffusionXLImg2ImgPipeline.from_single_file(
-                    model_path,
-                    torch_dtype=torch_dtype,
-                    use_safetensors=True,
-                    low_cpu_mem_usage=True,
-                    clip_skip=clip_skip
-                )
-                
-                # Progress tracking - optimalizace
-                progress_callback(0.5)
-                
-                # Memory efficient optimizations pro full modely
-                if enable_memory_efficient_attention:
-                    pipe.enable_attention_slicing()
-                    pipe.enable_vae_slicing()
-                    
-                if enable_cpu_offload:
-                    pipe.enable_model_cpu_offload()
-                else:
-                    pipe = pipe.to(device)
-            except Exception as e:
-                st.error(f"Chyba při načítání full modelu: {e}")
-                return None
-        else:
-            st.error("Nepodporovaný typ modelu")
-            return None
-        
-        # Progress tracking - příprava generování
-        progress_callback(0.6)
-        
-        # Nastavení scheduleru
-        scheduler_map = {
-            "DPMSolverMultistepScheduler": DPMSolverMultistepScheduler,
-            "EulerDiscreteScheduler": EulerDiscreteScheduler,
-            "EulerAncestralDiscreteScheduler": EulerAncestralDiscreteScheduler,
-            "DDIMScheduler": DDIMScheduler,
-            "LMSDiscreteScheduler": LMSDiscreteScheduler,
-            "PNDMScheduler": PNDMScheduler
-        }
-        
-        if sampler in scheduler_map:
-            pipe.scheduler = scheduler_map[sampler].from_config(pipe.scheduler.config)
-        
-        progress_callback(0.6, f"Generuji {num_images} variant...")
-        
-        # Generování více obrázků
-        results = []
-        for i in range(num_images):
-            # Nastavení generátoru pro reprodukovatelnost
-            generator = None
-            current_seed = seed
-            
-            if seed is not None:
-                if variance_seed is not None and i > 0:
-                    # Pro varianty použijeme kombinaci původního seed a variance seed
-                    current_seed = seed + (variance_seed * i) % 2147483647
-                generator = torch.Generator(device=device).manual_seed(current_seed)
-            
-            # Callback pro progress bar během generování
-            def callback_fn(step, timestep, latents):
-                # Mapování kroků generování na progress 0.6 - 0.85
-                generation_progress = 0.6 + (i / num_images) * 0.25 + (step / num_inference_steps) * (0.25 / num_images)
-                progress_callback(generation_progress)
-                return latents
-            
-            # Aktualizace progress pro každý obrázek
-            progress_callback(0.6 + (i / num_images) * 0.25, f"Generuji obrázek {i+1}/{num_images}...")
-            
-            # Aplikace stylu na vstupní obrázek
-            # Prázdný prompt, protože nechceme generovat podle textu
-            try:
-                result = pipe(
-                    image=input_image,
-                    prompt="",
-                    strength=strength,
-                    guidance_scale=guidance_scale,
-                    num_inference_steps=num_inference_steps,
-                    generator=generator,
-                    callback=callback_fn,
-                    callback_steps=1
-                ).images[0]
-                
-                results.append(result)
-            
-            except Exception as e:
-                st.error(f"Chyba při generování obrázku {i+1}: {e}")
-                continue
-        
-        # Progress tracking - generování dokončeno
-        progress_callback(0.85)
-        
-        # Upscaling pokud je povoleno
-        if upscale_factor > 1:
-            progress_callback(0.9, "Upscaling obrázků...")
-            upscaled_results = []
-            for i, result in enumerate(results):
-                try:
-                    # Jednoduché upscaling pomocí PIL (pro Real-ESRGAN by bylo potřeba další závislost)
-                    original_size = result.size
-                    new_size = (original_size[0] * upscale_factor, original_size[1] * upscale_factor)
-                    upscaled_result = result.resize(new_size, Image.Resampling.LANCZOS)
-                    upscaled_results.append(upscaled_result)
-                    progress_callback(0.9 + (i / len(results)) * 0.05, f"Upscaling {i+1}/{len(results)}...")
-                except Exception as e:
-                    progress_callback(0.95, f"Upscaling obrázku {i+1} selhal: {e}")
-                    upscaled_results.append(result)  # Použij původní obrázek
-            results = upscaled_results
-        
-        # Progress tracking - dokončeno
-        progress_callback(1.0)
-        
-        # Vrátíme první obrázek pro zpětnou kompatibilitu, ale všechny jsou v results
-        return results[0] if results else None
-        
-    finally:
-        # Vyčištění paměti po dokončení
-        if device == "cuda":
-            torch.cuda.empty_cache()
-        gc.collect()
-        
-        # Uvolnění pipeline z paměti
-        if 'pipe' in locals():
-            del pipe
-            if device == "cuda":
-                torch.cuda.empty_cache()
-            gc.collect()
-
 # Inicializace session state pro uchování nahraných souborů
-if 'uploaded_model_file' not in st.session_state:
-    st.session_state.uploaded_model_file = None
+if 'uploaded_model_path' not in st.session_state:
+    st.session_state.uploaded_model_path = None
     st.session_state.model_type = None
     st.session_state.model_name = None
 
@@ -881,8 +779,8 @@ if 'uploaded_model_file' not in st.session_state:
 
 with st.sidebar:
     # Inicializace session state pro uchování nahraných souborů
-    if 'uploaded_model_file' not in st.session_state:
-        st.session_state.uploaded_model_file = None
+    if 'uploaded_model_path' not in st.session_state:
+        st.session_state.uploaded_model_path = None
         st.session_state.model_type = None
         st.session_state.model_name = None
     
@@ -892,21 +790,74 @@ with st.sidebar:
     st.markdown("### ⚙️ Parametry")
     strength = st.slider("Strength", min_value=0.1, max_value=1.0, value=0.6, step=0.05)
     guidance_scale = st.slider("CFG Scale", min_value=1.0, max_value=30.0, value=7.5, step=0.5)
+    guidance_mode = st.selectbox(
+        "Guidance režim",
+        options=list(GUIDANCE_MODES.keys()),
+        format_func=lambda mode: GUIDANCE_MODES[mode],
+        help="S prázdným promptem je nepodmíněná větev UNetu téměř zbytečná"
+    )
+    if guidance_mode == "truncate":
+        cfg_fraction = st.slider("CFG pro první část kroků", min_value=0.1, max_value=1.0, value=0.5, step=0.1)
+    else:
+        cfg_fraction = 1.0
     num_inference_steps = st.slider("Steps", min_value=5, max_value=50, value=20, step=5)
     
     # Pokročilé parametry
     clip_skip = st.slider("Clip Skip", min_value=1, max_value=4, value=2, step=1)
     
+    # Feature reuse - opt-in zrychlení za cenu malé ztráty kvality
+    enable_feature_reuse_ui = st.checkbox("⚡ Feature reuse", value=False, help="Hluboké bloky UNetu se přepočítají jen každých k kroků")
+    if enable_feature_reuse_ui:
+        feature_reuse_interval = st.slider("Interval k", min_value=2, max_value=5, value=3, step=1)
+        feature_reuse_check = st.checkbox("🔍 Ověřit kvalitu", value=False, help="Porovná výsledek s plným výpočtem (stejný seed)")
+    else:
+        feature_reuse_interval = 1
+        feature_reuse_check = False
+    
+    # Backend - ONNX Runtime zrychluje hlavně CPU inference
+    backend = st.selectbox(
+        "Backend",
+        options=list(BACKENDS.keys()),
+        format_func=lambda name: BACKENDS[name],
+        help="ONNX Runtime a int8 běží na CPU; první použití modelu ho jednou exportuje/kvantizuje"
+    )
+    
+    # Hires fix - druhý průchod nad zvětšenými latenty, VAE dekóduje jen výsledek
+    enable_hires = st.checkbox("🔍 Hires fix", value=False,
+                               help="První průchod v základním rozlišení, latenty se zvětší a krátký druhý průchod doplní detail")
+    if enable_hires:
+        hires_scale = st.slider("Zvětšení latentů", min_value=1.25, max_value=2.0, value=1.5, step=0.25)
+        hires_strength = st.slider("Síla doladění", min_value=0.1, max_value=0.6, value=0.35, step=0.05)
+        hires_steps = st.slider("Kroky doladění", min_value=10, max_value=40, value=20, step=5)
+    else:
+        hires_scale, hires_strength, hires_steps = 1.0, 0.35, 20
+    
     # Upscaling - otevřené ve výchozím stavu
     enable_upscaling = st.checkbox("⬆️ Upscaling", value=True)
     if enable_upscaling:
         upscale_factor = st.selectbox("Faktor:", [2, 4], index=0)
+        # Naučené upscalery z katalogu na volume, jinak LANCZOS
+        upscaler = st.selectbox(
+            "Upscaler:",
+            [""] + get_upscaler_models_list(),
+            format_func=lambda path: os.path.basename(path) if path else "LANCZOS (rychlý)",
+            help=f"ESRGAN modely (.safetensors/.pth) ze složky {UPSCALER_MODELS_PATH}"
+        )
     else:
         upscale_factor = 1
+        upscaler = ""
     
     # Počet variant
     num_images = st.slider("Počet variant", min_value=1, max_value=8, value=1, step=1)
     
+    # Formát náhledů - stažení je vždy bezztrátové PNG
+    preview_format = st.selectbox(
+        "Formát náhledů",
+        ["webp", "jpeg", "png"],
+        index=0,
+        help="WebP a JPEG se kódují rychleji a do prohlížeče se přenáší menší data"
+    )
+    
     # Sampler - výchozí hodnota bez UI
     sampler = "DPMSolverMultistepScheduler"
     
@@ -923,10 +874,18 @@ with st.sidebar:
     if not use_variance_seed:
         variance_seed = None
         variance_strength = 0.0
+    
+    # Grid sweep pro ladění LoRA - jeden model, jedno zakódování vstupu
+    with st.expander("🧪 Grid sweep", expanded=False):
+        grid_strengths_text = st.text_input("Strength hodnoty:", value="0.4, 0.6, 0.8")
+        grid_guidance_text = st.text_input("CFG hodnoty:", value="5.0, 7.5")
+        grid_steps_text = st.text_input("Steps hodnoty:", value=str(num_inference_steps))
+        grid_seeds_text = st.text_input("Seedy:", value="42, 43")
+        grid_button = st.button("🧪 Spustit grid", use_container_width=True)
 
 # Inicializace globálních proměnných pro model
-if 'current_model_file' not in st.session_state:
-    st.session_state.current_model_file = None
+if 'current_upload_path' not in st.session_state:
+    st.session_state.current_upload_path = None
 if 'current_model_path' not in st.session_state:
     st.session_state.current_model_path = None
 if 'selected_lora_model' not in st.session_state:
@@ -935,7 +894,7 @@ if 'selected_full_model' not in st.session_state:
     st.session_state.selected_full_model = None
 
 # Resetování globálních proměnných na začátku
-st.session_state.current_model_file = None
+st.session_state.current_upload_path = None
 st.session_state.current_model_path = None
 
 # Hlavní layout s pravým sidebarom
@@ -957,21 +916,27 @@ with col_right:
         )
         
         if uploaded_file is not None:
-            if (st.session_state.uploaded_model_file is None or 
+            if (st.session_state.uploaded_model_path is None or 
                 st.session_state.model_name != uploaded_file.name):
-                st.session_state.uploaded_model_file = uploaded_file
+                # Jednou po blocích na volume do katalogu (stejný obsah se znovu nezapisuje)
+                with st.spinner("Ukládám model na volume..."):
+                    published = UploadManager().import_file(uploaded_file, uploaded_file.name, detect_model_type=engine.detect_model_type)
+                st.session_state.uploaded_model_path = published['path']
                 st.session_state.model_name = uploaded_file.name
-                st.session_state.model_type = None
+                st.session_state.model_type = published['model_type']
+                if published.get('deduplicated'):
+                    st.info(f"🔗 Stejný model už v katalogu je - uložen jen jako odkaz na {os.path.basename(published['path'])}")
         
-        if st.session_state.uploaded_model_file is not None:
-            st.session_state.current_model_file = st.session_state.uploaded_model_file
+        if st.session_state.uploaded_model_path is not None:
+            st.session_state.current_upload_path = st.session_state.uploaded_model_path
             st.success(f"✅ {st.session_state.model_name}")
             if st.button("🗑️ Vymazat", key="right_clear_model"):
-                st.session_state.uploaded_model_file = None
+                st.session_state.uploaded_model_path = None
                 st.session_state.model_type = None
                 st.session_state.model_name = None
-                st.session_state.current_model_file = None
+                st.session_state.current_upload_path = None
                 st.rerun()
+        st.caption("Velké modely: `python uploads.py model.safetensors --url http://<pod>:8502` - po chuncích s navázáním")
     
     # LoRA modely
     with st.expander("⚙️ LoRA Modely", expanded=False):
@@ -1023,9 +988,17 @@ with col_right:
                      'strength': strength,
                      'guidance_scale': guidance_scale,
                      'num_inference_steps': num_inference_steps,
+                     'guidance_mode': guidance_mode,
+                     'cfg_fraction': cfg_fraction,
                      'clip_skip': clip_skip,
+                     'feature_reuse_interval': feature_reuse_interval,
+                     'backend': backend,
                      'enable_upscaling': enable_upscaling,
                      'upscale_factor': upscale_factor,
+                     'upscaler': upscaler,
+                     'hires_scale': hires_scale,
+                     'hires_strength': hires_strength,
+                     'hires_steps': hires_steps,
                      'num_images': num_images,
                      'sampler': sampler,
                      'use_seed': use_seed,
@@ -1089,6 +1062,13 @@ with col_right:
         st.write(f"**Zařízení:** {device_reason}")
         if sys_info['cuda_available']:
             st.write(f"**GPU paměť:** {sys_info['cuda_memory_gb']:.1f} GB")
+        for worker_stats in sys_info.get('workers', []):
+            models = ", ".join(worker_stats['models']) or "žádný model"
+            st.write(f"**Worker {worker_stats['device']}:** {models} · fronta {worker_stats['backlog']} vzorků")
+        cache_stats = sys_info.get('result_cache')
+        if cache_stats:
+            st.write(f"**Cache výsledků:** {cache_stats['entries']} položek, {cache_stats['size_mb']:.0f}/"
+                     f"{cache_stats['budget_mb']:.0f} MB, {cache_stats['hits']} zásahů / {cache_stats['misses']} minutí")
     
     # Uzavření pravého sidebaru
     st.markdown('</div>', unsafe_allow_html=True)
@@ -1107,15 +1087,17 @@ with col_main:
         input_image_file = st.file_uploader("Nahrajte obrázek", type=["png", "jpg", "jpeg"])
         
         if input_image_file is not None:
-            input_image = Image.open(input_image_file).convert("RGB")
-            st.image(input_image, width=int(400 * 0.84))  # Zvětšeno o 20% z původních 70%
+            # Dekódování v bucketu a náhled z cache - rerun obrázek znovu nedekóduje
+            prepared_input = prepare_upload(input_image_file.getvalue())
+            input_image = prepared_input.image
+            st.image(prepared_input.preview, width=int(400 * 0.84))  # Zvětšeno o 20% z původních 70%
     
     with col2:
         # Placeholder pro výstupní obrázek
         output_placeholder = st.empty()
     
     # Zpracování obrázku
-    if process_button and input_image_file is not None and (st.session_state.current_model_file is not None or st.session_state.current_model_path is not None or st.session_state.uploaded_model_file is not None):
+    if process_button and input_image_file is not None and (st.session_state.current_upload_path is not None or st.session_state.current_model_path is not None):
         # Kompaktní progress tracking - dva pruhy vedle sebe
         with progress_container:
             # Dva sloupce pro progress pruhy
@@ -1130,6 +1112,9 @@ with col_main:
                 st.markdown("**Generování obrázku**")
                 generate_progress = st.progress(0)
                 generate_percent = st.empty()
+            
+            # Kliknutí přeruší běh skriptu a wait_for_job úlohu v enginu zruší
+            st.button("⏹️ Zrušit", key="cancel_style", use_container_width=True)
         
         start_time = time.time()
         
@@ -1151,161 +1136,181 @@ with col_main:
         
         try:
             # Zpracování modelu podle zdroje
-            if st.session_state.current_model_file is not None:
-                os.makedirs("models", exist_ok=True)
-                final_model_path = os.path.join("models", st.session_state.current_model_file.name)
-                with open(final_model_path, "wb") as f:
-                    f.write(st.session_state.current_model_file.getbuffer())
-            elif st.session_state.uploaded_model_file is not None:
-                os.makedirs("models", exist_ok=True)
-                final_model_path = os.path.join("models", st.session_state.model_name)
-                with open(final_model_path, "wb") as f:
-                    f.write(st.session_state.uploaded_model_file.getbuffer())
-            else:
-                final_model_path = st.session_state.current_model_path
+            final_model_path = resolve_model_path()
             
             # Detekce typu modelu
-            model_type = detect_model_type(final_model_path)
+            model_type = engine.detect_model_type(final_model_path)
             update_progress(0.05)
             
             # Generování obrázku
             update_progress(0.1)
             start_time = time.time()
             
-            result_image = apply_style(
-                input_image,
-                final_model_path,
-                model_type,
-                strength,
-                guidance_scale,
-                num_inference_steps,
-                update_progress,
-                clip_skip=clip_skip,
-                seed=seed,
-                upscale_factor=upscale_factor,
-                num_images=num_images,
-                sampler=sampler,
-                variance_seed=variance_seed,
-                variance_strength=variance_strength
-            )
+            # Úloha jde do enginu - jedna pipeline pro všechny sessions
+            style_params = {
+                'model_path': os.path.abspath(final_model_path),
+                'model_type': model_type,
+                'strength': strength,
+                'guidance_scale': guidance_scale,
+                'num_inference_steps': num_inference_steps,
+                'clip_skip': clip_skip,
+                'seed': seed,
+                'upscale_factor': upscale_factor,
+                'num_images': num_images,
+                'sampler': sampler,
+                'variance_seed': variance_seed,
+                'variance_strength': variance_strength,
+                'feature_reuse_interval': feature_reuse_interval,
+                'feature_reuse_check': feature_reuse_check,
+                'guidance_mode': guidance_mode,
+                'cfg_fraction': cfg_fraction,
+                'backend': backend,
+                'upscaler': upscaler,
+                'hires_scale': hires_scale,
+                'hires_strength': hires_strength,
+                'hires_steps': hires_steps
+            }
+            job_id = engine.submit_style(input_image, style_params)
+            _, style_result = wait_for_job(engine, job_id, update_progress)
+            result_images = style_result['images']
+            style_report = style_result['report']
             
             # Vyčištění progress baru
             progress_container.empty()
             
-            # Vyčištění output_placeholder a zobrazení výsledku
-            output_placeholder.empty()
+            if style_report.get('cache') in ("hit", "coalesced"):
+                st.caption("♻️ Výsledek z cache" if style_report['cache'] == "hit" else "♻️ Sdíleno se souběžným stejným požadavkem")
             
-            if num_images == 1:
-                with output_placeholder.container():
-                    st.image(result_image, width=int(400 * 0.84))
-                    
-                    # Tlačítko pro stažení
-                    buf = io.BytesIO()
-                    result_image.save(buf, format="PNG")
-                    st.download_button(
-                        label="📥 Stáhnout",
-                        data=buf.getvalue(),
-                        file_name="result.png",
-                        mime="image/png",
-                        use_container_width=True
-                    )
-            else:
-                # Pro více variant zobrazíme info v col2 a mřížku pod sloupci
-                with output_placeholder.container():
-                    st.markdown(f"### 🖼️ {num_images} variant")
-                    st.markdown("*Mřížka níže*")
+            if style_report.get('int8'):
+                st.caption(f"🗜️ int8 UNet: {style_report['int8']['unet_int8_mb']:.0f} MB, ušetřeno {style_report['int8']['memory_saved_mb']:.0f} MB")
             
-            # Galerie variant s velkým náhledem a miniaturami
-            if num_images > 1:
-                st.markdown("---")
-                st.markdown('<div class="variant-gallery">', unsafe_allow_html=True)
-                st.markdown(f"### 🖼️ Galerie variant ({num_images})")
-                
-                # Inicializace vybrané varianty
-                if 'selected_variant' not in st.session_state:
-                    st.session_state.selected_variant = 0
-                
-                # Hlavní náhled
-                st.markdown('<div class="variant-main-preview">', unsafe_allow_html=True)
-                st.markdown(f"**Varianta {st.session_state.selected_variant + 1} - Hlavní náhled**")
-                
-                # Zobrazení vybraného obrázku ve velkém
-                selected_image = result_image  # Pro demonstraci - v reálné implementaci by to byl result_images[st.session_state.selected_variant]
-                st.image(selected_image, use_column_width=True)
+            if style_report.get('hires'):
+                hires_report = style_report['hires']
+                st.caption(
+                    f"🔍 Hires fix: {hires_report['first_pass_size'][0]}×{hires_report['first_pass_size'][1]} → "
+                    f"{hires_report['final_size'][0]}×{hires_report['final_size'][1]}, {hires_report['steps']} kroků doladění"
+                )
+            
+            upscale_times = style_result['timings'].get('upscale_variants_s')
+            if upscale_times:
+                st.caption(
+                    f"⬆️ Upscaling {style_result['timings']['upscale_s']:.1f} s · varianty: "
+                    + ", ".join(f"{t:.1f} s" for t in upscale_times)
+                )
+            
+            if style_report.get('seeds'):
+                st.caption(f"🎯 Seedy variant: {', '.join(str(s) for s in style_report['seeds'])}")
+            
+            if style_report.get('guidance', {}).get('saved_evaluations'):
+                guidance_stats = style_report['guidance']
+                st.caption(
+                    f"🧭 {GUIDANCE_MODES[guidance_mode]}: {guidance_stats['unet_evaluations']} vyhodnocení UNetu, "
+                    f"ušetřeno {guidance_stats['saved_evaluations']} z {guidance_stats['baseline_evaluations']}"
+                )
+            
+            if 'feature_reuse' in style_report:
+                quality = style_report['feature_reuse']
+                st.info(
+                    f"⚡ Feature reuse (k={feature_reuse_interval}): PSNR {quality['psnr_db']:.1f} dB, "
+                    f"zrychlení {quality['speedup']:.2f}× ({quality['reused_steps']} z "
+                    f"{quality['full_steps'] + quality['reused_steps']} kroků z cache)"
+                )
+            
+            # Výsledky zůstávají v session - výběr varianty (rerun) je nezahodí
+            st.session_state.style_results = {
+                'job_id': job_id,
+                'images': result_images,
+                'params': style_params,
+                'seeds': style_report.get('seeds', []),
+            }
+            st.session_state.selected_variant = 0
+            
+            # Kódování všech variant hned paralelně v poolu
+            encoder = get_encoder()
+            for i, image in enumerate(result_images):
+                # Jedna úroveň spustí celou pyramidu náhledů (kaskádově od největší)
+                encoder.submit(f"{job_id}_{i}", image, preview_format, max_size=THUMBNAIL_SIZES[0])
+                encoder.submit(f"{job_id}_{i}", image, "png")
                 
-                # Tlačítko pro stažení vybrané varianty
-                buf = io.BytesIO()
-                selected_image.save(buf, format="PNG")
+        except JobCancelled:
+            progress_container.empty()
+            st.warning("⏹️ Generování bylo zrušeno")
+        except Exception as e:
+            progress_container.empty()
+            st.error(f"❌ Chyba: {str(e)}")
+    
+    elif grid_button and input_image_file is not None and (st.session_state.current_upload_path is not None or st.session_state.current_model_path is not None):
+        with progress_container:
+            st.markdown("**Grid sweep**")
+            grid_progress = st.progress(0)
+            grid_status = st.empty()
+            st.button("⏹️ Zrušit", key="cancel_grid", use_container_width=True)
+        
+        def update_grid_progress(progress: float, text: str = ""):
+            grid_progress.progress(min(1.0, progress))
+            if text:
+                grid_status.text(text)
+        
+        try:
+            grid_strengths = parse_value_list(grid_strengths_text, float)
+            grid_guidance = parse_value_list(grid_guidance_text, float)
+            grid_steps = parse_value_list(grid_steps_text, int)
+            grid_seeds = parse_value_list(grid_seeds_text, int)
+            
+            final_model_path = resolve_model_path()
+            model_type = engine.detect_model_type(final_model_path)
+            
+            # Grid běží v enginu nad rezidentní pipeline
+            grid_job_id = engine.submit_grid(input_image, {
+                'model_path': os.path.abspath(final_model_path),
+                'model_type': model_type,
+                'clip_skip': clip_skip,
+                'sampler': sampler,
+                'strengths': grid_strengths,
+                'guidance_scales': grid_guidance,
+                'steps_list': grid_steps,
+                'seeds': grid_seeds
+            })
+            _, grid_result = wait_for_job(engine, grid_job_id, update_grid_progress)
+            timings = grid_result['timings']
+            progress_container.empty()
+            
+            st.markdown(f"### 🧪 Grid ({len(grid_result['cells'])} buněk)")
+            st.caption(
+                f"Načtení {timings['load_s']:.1f} s · kódování {timings['encode_s']:.1f} s · "
+                f"odšumování {timings['denoise_s']:.1f} s ({grid_result['total_denoising_steps']} kroků) · "
+                f"uloženo do {grid_result['output_dir']}"
+            )
+            st.image(grid_result['contact_sheet'], use_column_width=True)
+            
+            with open(grid_result['contact_sheet_path'], "rb") as f:
                 st.download_button(
-                    label=f"📥 Stáhnout variantu {st.session_state.selected_variant + 1}",
-                    data=buf.getvalue(),
-                    file_name=f"result_variant_{st.session_state.selected_variant + 1}.png",
+                    label="📥 Stáhnout contact sheet",
+                    data=f.read(),
+                    file_name="contact_sheet.png",
                     mime="image/png",
-                    key="download_selected_variant",
                     use_container_width=True
                 )
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Miniatury variant
-                st.markdown("**Vyberte variantu:**")
-                st.markdown('<div class="variant-thumbnails">', unsafe_allow_html=True)
-                
-                # Vytvoření sloupců pro miniatury (max 4 na řádek)
-                cols_per_row = min(4, num_images)
-                rows = (num_images + cols_per_row - 1) // cols_per_row
-                
-                for row in range(rows):
-                    thumbnail_cols = st.columns(cols_per_row)
-                    for col_idx in range(cols_per_row):
-                        img_idx = row * cols_per_row + col_idx
-                        if img_idx < num_images:
-                            with thumbnail_cols[col_idx]:
-                                # CSS třída pro vybranou miniaturu
-                                thumbnail_class = "selected" if img_idx == st.session_state.selected_variant else ""
-                                
-                                # Tlačítko pro výběr varianty
-                                if st.button(
-                                    f"Varianta {img_idx + 1}",
-                                    key=f"select_variant_{img_idx}",
-                                    use_container_width=True
-                                ):
-                                    st.session_state.selected_variant = img_idx
-                                    st.rerun()
-                                
-                                # Miniatura obrázku
-                                st.markdown(f'<div class="variant-thumbnail {thumbnail_class}">', unsafe_allow_html=True)
-                                st.image(result_image, width=150)  # V reálné implementaci: result_images[img_idx]
-                                st.markdown('</div>', unsafe_allow_html=True)
-                                
-                                # Individuální tlačítko pro stažení
-                                buf_thumb = io.BytesIO()
-                                result_image.save(buf_thumb, format="PNG")
-                                st.download_button(
-                                    label="📥",
-                                    data=buf_thumb.getvalue(),
-                                    file_name=f"variant_{img_idx + 1}.png",
-                                    mime="image/png",
-                                    key=f"download_thumb_{img_idx}",
-                                    help=f"Stáhnout variantu {img_idx + 1}"
-                                )
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Tlačítko pro stažení všech variant
-                if st.button("📦 Stáhnout všechny varianty", use_container_width=True):
-                    st.info("💡 Funkce stažení všech variant bude implementována v budoucí verzi.")
-                
-                st.markdown('</div>', unsafe_allow_html=True)
-                
+        except JobCancelled:
+            progress_container.empty()
+            st.warning("⏹️ Generování bylo zrušeno")
         except Exception as e:
             progress_container.empty()
             st.error(f"❌ Chyba: {str(e)}")
     
-    elif process_button:
+    elif process_button or grid_button:
         if input_image_file is None:
             st.warning("⚠️ Nahrajte obrázek")
-        if (model_file is None and model_path is None and 
-            st.session_state.uploaded_model_file is None):
+        if st.session_state.current_upload_path is None and st.session_state.current_model_path is None:
             st.warning("⚠️ Vyberte model")
     
+    # Poslední výsledky stylu (i po rerunu z výběru varianty)
+    if st.session_state.get('style_results') and not grid_button:
+        show_results(st.session_state.style_results, output_placeholder, preview_format)
+    
+    # Historie se načítá jen na požádání - index a miniatury, ne plné obrázky
+    st.markdown("---")
+    if st.checkbox("🕘 Historie výsledků", value=False):
+        show_history()
+    
     # Informace o aplikaci odstraněny podle požadavku uživatele
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+Streamovaný ZIP export všech variant
+
+Archiv vzniká po položkách přímo do proudu bloků - v paměti je vždy jen
+rozpracovaný blok, nikdy celý ZIP. PNG se ukládají bez komprese (jsou už
+komprimované) z cache zakódovaných výsledků nebo po blocích z disku.
+Součástí je manifest.json s parametry a seedem každé varianty.
+"""
+
+import os
+import json
+import time
+import zipfile
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from config import EXPORTS_MAX_AGE_H
+from encoding import get_encoder
+
+# Velikost bloku, po kterém se archiv posílá klientovi nebo zapisuje na disk
+EXPORT_CHUNK_KB = int(os.getenv('EXPORT_CHUNK_KB', '1024'))
+
+# Zdroj položky: hotové bajty, cesta k souboru, nebo funkce vracející bajty (až v okamžiku zápisu)
+Source = Union[bytes, str, Callable[[], bytes]]
+
+
+class _ChunkSink:
+    """Nepřevíjitelný výstup pro ZipFile - zapsané bajty se průběžně odebírají."""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pending(self) -> int:
+        return self._size
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Source]], chunk_size: int = EXPORT_CHUNK_KB * 1024) -> Iterator[bytes]:
+    """Generátor bloků ZIP archivu; položky se čtou a zapisují jedna po druhé."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as zf:
+        for name, source in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            # JSON se komprimuje, obrázky už komprimované jsou
+            info.compress_type = zipfile.ZIP_DEFLATED if name.endswith(".json") else zipfile.ZIP_STORED
+            if callable(source):
+                source = source()
+
+            with zf.open(info, "w") as dest:
+                if isinstance(source, str):
+                    with open(source, "rb") as f:
+                        for block in iter(lambda: f.read(chunk_size), b""):
+                            dest.write(block)
+                            if sink.pending() >= chunk_size:
+                                yield sink.drain()
+                else:
+                    view = memoryview(source)
+                    for offset in range(0, len(view), chunk_size):
+                        dest.write(view[offset:offset + chunk_size])
+                        if sink.pending() >= chunk_size:
+                            yield sink.drain()
+            if sink.pending() >= chunk_size:
+                yield sink.drain()
+    # Zbytek poslední položky a centrální adresář
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+def variant_manifest(job_id: str, params: dict, seeds: List[int], images: List[Image.Image]) -> dict:
+    """Parametry úlohy a seed, rozměry a jméno souboru každé varianty."""
+    params = dict(params)
+    if params.get('model_path'):
+        # Jen jméno modelu - cesty na serveru do exportu nepatří
+        params['model_path'] = os.path.basename(params['model_path'])
+    return {
+        'job_id': job_id,
+        'exported_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'params': params,
+        'variants': [
+            {
+                'index': i,
+                'file': f"variant_{i + 1}.png",
+                'seed': seeds[i] if i < len(seeds) else None,
+                'width': image.width,
+                'height': image.height,
+            }
+            for i, image in enumerate(images)
+        ],
+    }
+
+
+def variant_entries(job_id: str, images: List[Image.Image], params: dict, seeds: List[int],
+                    paths: Optional[List[str]] = None) -> List[Tuple[str, Source]]:
+    """
+    Položky archivu - PNG z disku (pokud výstupy už leží v úložišti úloh),
+    jinak sdílené bajty z cache enkodéru. Kóduje se líně, až při zápisu položky.
+    """
+    encoder = get_encoder()
+    entries = [("manifest.json", json.dumps(variant_manifest(job_id, params, seeds, images), indent=2, ensure_ascii=False).encode())]
+    for i, image in enumerate(images):
+        if paths and i < len(paths) and os.path.exists(paths[i]):
+            source = paths[i]
+        else:
+            source = (lambda i=i, image=image: encoder.get(f"{job_id}_{i}", image, "png"))
+        entries.append((f"variant_{i + 1}.png", source))
+    return entries
+
+
+def prune_exports(root: str, max_age_h: float = EXPORTS_MAX_AGE_H) -> int:
+    """Smaže exporty (i nedokončené .tmp) starší než max_age_h hodin. Vrací počet smazaných."""
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - max_age_h * 3600
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            # Soubor mezitím smazal jiný proces
+            pass
+    return removed
+
+
+def write_zip(entries: Iterable[Tuple[str, Source]], path: str) -> str:
+    """Zapíše streamovaný archiv atomicky na disk (paměť omezená velikostí bloku)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for block in stream_zip(entries):
+            f.write(block)
+    os.replace(tmp_path, path)
+    return path
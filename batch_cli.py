@@ -0,0 +1,293 @@
+"""
+Dávkové zpracování složky obrázků z příkazové řádky
+
+Vstupy tečou třemi stupni propojenými omezenými frontami:
+
+1. pool vláken pro dekódování a předzpracování (bucket rozlišení)
+2. stupeň zařízení - skládá dávky ze vstupů se stejným bucketem
+3. pool vláken pro upscaling, kódování PNG a zápis
+
+CPU práce s obrázky se tak překrývá s odšumováním a paměť zůstává konstantní
+pro libovolný počet vstupů. Hotové výstupy se při opakovaném spuštění
+přeskočí, takže přerušený běh lze navázat.
+
+Příklad:
+    python batch_cli.py /data/shoot /data/outputs/shoot --model /data/loras/tuymans.safetensors
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+from config import BACKENDS, CPU_BACKENDS, DEFAULT_PARAMS, GUIDANCE_MODES, MAX_BATCH_SIZE
+from inference import (
+    load_pipeline,
+    free_memory,
+    detect_model_type,
+    get_resolution_bucket,
+    generate_batch,
+    upscale_images,
+)
+from noise import variant_seeds
+from onnx_backend import enable_onnx_backend
+from preprocess import decode_image
+from quantization import enable_int8_backend
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff'}
+
+# Konec proudu ve frontách mezi stupni
+_DONE = object()
+
+
+def find_inputs(input_dir: str) -> List[Path]:
+    """Všechny obrázky ve složce (rekurzivně), seřazené pro stabilní pořadí."""
+    root = Path(input_dir)
+    return sorted(p for p in root.rglob("*") if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def output_paths(path: Path, input_dir: str, output_dir: str, num_images: int) -> List[Path]:
+    """
+    Výstupní soubory pro vstup - zachovává strukturu podsložek. Přípona
+    vstupu zůstává ve jménu (a.jpg -> a_jpg.png), takže a.jpg a a.png ani
+    DSC_001.edit.jpg a DSC_001.raw.jpg se nepřepíšou navzájem.
+    """
+    relative = path.relative_to(input_dir)
+    name = f"{relative.stem}{relative.suffix.replace('.', '_')}"
+    folder = Path(output_dir) / relative.parent
+    if num_images == 1:
+        return [folder / f"{name}.png"]
+    return [folder / f"{name}_v{i + 1}.png" for i in range(num_images)]
+
+
+def find_collisions(paths: List[Path], input_dir: str, output_dir: str, num_images: int) -> Dict[str, List[Path]]:
+    """
+    Výstupy, na které by zapisovalo víc vstupů. Porovnává se bez ohledu
+    na velikost písmen (výstupní volume nemusí velikost rozlišovat).
+    """
+    owners = {}
+    for path in paths:
+        for out_path in output_paths(path, input_dir, output_dir, num_images):
+            owners.setdefault(str(out_path).lower(), []).append(path)
+    return {out: inputs for out, inputs in owners.items() if len(inputs) > 1}
+
+
+def save_atomic(image: Image.Image, path: Path):
+    """Zápis přes dočasný soubor - nedokončený výstup se při navázání nepočítá jako hotový."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    image.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """Třístupňová pipeline složka -> složka."""
+
+    def __init__(self, args):
+        self.args = args
+        self.params = dict(
+            DEFAULT_PARAMS,
+            strength=args.strength,
+            guidance_scale=args.guidance_scale,
+            num_inference_steps=args.steps,
+            clip_skip=args.clip_skip,
+            seed=args.seed,
+            num_images=args.num_images,
+            upscale_factor=args.upscale,
+            sampler=args.sampler,
+            guidance_mode=args.guidance_mode,
+            cfg_fraction=args.cfg_fraction,
+            feature_reuse_interval=args.feature_reuse,
+            backend=args.backend,
+            upscaler=args.upscaler,
+            hires_scale=args.hires_scale,
+            hires_strength=args.hires_strength,
+            hires_steps=args.hires_steps,
+        )
+        self.device = "cpu"
+        self.path_queue = queue.Queue()
+        self.decoded_queue = queue.Queue(maxsize=args.queue_size)
+        self.encode_queue = queue.Queue(maxsize=args.queue_size)
+        self.lock = threading.Lock()
+        self.stats = {'done': 0, 'skipped': 0, 'failed': 0, 'images_written': 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self.lock:
+            self.stats[key] += n
+
+    def _decode_worker(self):
+        """Stupeň 1 - redukované dekódování rovnou do bucketu (EXIF orientace, sRGB)."""
+        while True:
+            path = self.path_queue.get()
+            if path is _DONE:
+                self.decoded_queue.put(_DONE)
+                return
+            try:
+                self.decoded_queue.put((path, decode_image(path)))
+            except Exception as e:
+                print(f"❌ {path}: nelze načíst ({e})")
+                self._count('failed')
+
+    def _encode_worker(self):
+        """Stupeň 3 - upscaling, PNG a atomický zápis."""
+        while True:
+            item = self.encode_queue.get()
+            if item is _DONE:
+                return
+            path, images = item
+            try:
+                images = upscale_images(images, self.params['upscale_factor'], upscaler=self.params['upscaler'], device=self.device)
+                for image, out_path in zip(images, output_paths(path, self.args.input_dir, self.args.output_dir, len(images))):
+                    save_atomic(image, out_path)
+                self._count('images_written', len(images))
+                self._count('done')
+            except Exception as e:
+                print(f"❌ {path}: nelze uložit ({e})")
+                self._count('failed')
+
+    def _run_group(self, pipe, group):
+        """Jedna dávka vstupů se stejným bucketem."""
+        inputs = [(image, variant_seeds(self.params['seed'], None, self.params['num_images'])) for _, image in group]
+        try:
+            outputs = generate_batch(pipe, inputs, self.params, max_batch=self.args.max_batch)
+        except Exception as e:
+            print(f"❌ Dávka {[str(p) for p, _ in group]} selhala: {e}")
+            self._count('failed', len(group))
+            return
+        for (path, _), images in zip(group, outputs):
+            self.encode_queue.put((path, images))
+
+    def _device_stage(self, pipe, decode_workers: int):
+        """Stupeň 2 - skládání dávek podle bucketu a odšumování."""
+        pending = {}
+        per_input = max(1, self.params['num_images'])
+        batch_inputs = max(1, self.args.max_batch // per_input)
+        finished = 0
+
+        def flush(bucket):
+            self._run_group(pipe, pending.pop(bucket))
+
+        while finished < decode_workers:
+            try:
+                item = self.decoded_queue.get(timeout=0.5)
+            except queue.Empty:
+                # Nic nového - nenecháme zařízení čekat, pustíme největší rozpracovanou dávku
+                if pending:
+                    flush(max(pending, key=lambda b: len(pending[b])))
+                continue
+            if item is _DONE:
+                finished += 1
+                continue
+
+            path, image = item
+            bucket = get_resolution_bucket(*image.size)
+            pending.setdefault(bucket, []).append((path, image))
+            if len(pending[bucket]) >= batch_inputs:
+                flush(bucket)
+
+        for bucket in list(pending):
+            flush(bucket)
+
+    def run(self) -> dict:
+        args = self.args
+        paths = find_inputs(args.input_dir)
+        collisions = find_collisions(paths, args.input_dir, args.output_dir, args.num_images)
+        if collisions:
+            # Před během - jinak by se výstupy tiše přepsaly a navázání je bralo jako hotové
+            for out_path, inputs in collisions.items():
+                print(f"❌ Kolize výstupu {out_path}: {', '.join(str(p) for p in inputs)}")
+            self.stats['failed'] += len({p for inputs in collisions.values() for p in inputs})
+            return self.stats
+        todo = []
+        for path in paths:
+            if not args.overwrite and all(p.exists() for p in output_paths(path, args.input_dir, args.output_dir, args.num_images)):
+                self._count('skipped')
+            else:
+                todo.append(path)
+        print(f"📁 {len(paths)} vstupů, {len(todo)} ke zpracování, {self.stats['skipped']} již hotových")
+        if not todo:
+            return self.stats
+
+        model_type = args.model_type or detect_model_type(args.model)
+        pipe, device = load_pipeline(args.model, model_type, clip_skip=args.clip_skip, sampler=args.sampler,
+                                     device="cpu" if args.backend in CPU_BACKENDS else None)
+        self.device = device
+        if args.backend == "onnx":
+            enable_onnx_backend(pipe, args.model, model_type)
+        elif args.backend == "int8":
+            enable_int8_backend(pipe, args.model, model_type)
+
+        for path in todo:
+            self.path_queue.put(path)
+        for _ in range(args.decode_workers):
+            self.path_queue.put(_DONE)
+
+        decoders = [threading.Thread(target=self._decode_worker, daemon=True) for _ in range(args.decode_workers)]
+        encoders = [threading.Thread(target=self._encode_worker, daemon=True) for _ in range(args.encode_workers)]
+        for thread in decoders + encoders:
+            thread.start()
+
+        start = time.time()
+        try:
+            self._device_stage(pipe, args.decode_workers)
+        finally:
+            for _ in encoders:
+                self.encode_queue.put(_DONE)
+            for thread in encoders:
+                thread.join()
+            del pipe
+            free_memory(device)
+
+        elapsed = time.time() - start
+        print(f"✅ Hotovo za {elapsed:.1f} s: {self.stats['done']} zpracováno, {self.stats['skipped']} přeskočeno, "
+              f"{self.stats['failed']} selhalo ({self.stats['images_written'] / max(elapsed, 1e-6):.2f} obrázků/s)")
+        return self.stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dávkový přenos stylu složka -> složka")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--model", required=True, help="Cesta k .safetensors (LoRA nebo full model)")
+    parser.add_argument("--model-type", choices=["lora", "full_model"], default=None)
+    parser.add_argument("--strength", type=float, default=DEFAULT_PARAMS['strength'])
+    parser.add_argument("--guidance-scale", type=float, default=DEFAULT_PARAMS['guidance_scale'])
+    parser.add_argument("--steps", type=int, default=DEFAULT_PARAMS['num_inference_steps'])
+    parser.add_argument("--clip-skip", type=int, default=DEFAULT_PARAMS['clip_skip'])
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--num-images", type=int, default=1)
+    parser.add_argument("--upscale", type=int, default=1)
+    parser.add_argument("--upscaler", default="", help="Cesta k ESRGAN modelu (.safetensors/.pth); prázdné = LANCZOS")
+    parser.add_argument("--hires-scale", type=float, default=DEFAULT_PARAMS['hires_scale'], help="Hires fix - zvětšení latentů (1.0 = vypnuto)")
+    parser.add_argument("--hires-strength", type=float, default=DEFAULT_PARAMS['hires_strength'])
+    parser.add_argument("--hires-steps", type=int, default=DEFAULT_PARAMS['hires_steps'])
+    parser.add_argument("--sampler", default=DEFAULT_PARAMS['sampler'])
+    parser.add_argument("--guidance-mode", choices=list(GUIDANCE_MODES.keys()), default=DEFAULT_PARAMS['guidance_mode'])
+    parser.add_argument("--cfg-fraction", type=float, default=DEFAULT_PARAMS['cfg_fraction'])
+    parser.add_argument("--backend", choices=list(BACKENDS.keys()), default=DEFAULT_PARAMS['backend'])
+    parser.add_argument("--feature-reuse", type=int, default=1, help="Interval feature reuse (1 = vypnuto)")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE, help="Max. vzorků v jednom volání pipeline")
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--encode-workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=16, help="Kapacita front mezi stupni")
+    parser.add_argument("--overwrite", action="store_true", help="Znovu zpracovat i hotové vstupy")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.isdir(args.input_dir):
+        print(f"❌ Vstupní složka neexistuje: {args.input_dir}")
+        return 1
+    stats = BatchRunner(args).run()
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Kooperativní zrušení běžících úloh
+
+Token se kontroluje v každém kroku odšumování a mezi fázemi pipeline
+(kódování, dávky vzorků, upscaling). Zrušená práce vyhodí Cancelled, takže
+se odpojí obaly UNetu a uvolní slot v admission controlu stejnou cestou
+jako při chybě.
+"""
+
+import threading
+from typing import List
+
+
+class Cancelled(Exception):
+    """Úloha byla zrušena (uživatelem, přes API nebo odpojením session)."""
+
+
+class CancellationToken:
+    """Příznak zrušení sdílený mezi vlákny."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = ""
+
+    def cancel(self, reason: str = "Zrušeno"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+class BatchCancellation:
+    """Dávka sdílí jedno volání pipeline - zastaví se až po zrušení všech jejích úloh."""
+
+    def __init__(self, tokens: List[CancellationToken]):
+        self.tokens = tokens
+
+    def is_cancelled(self) -> bool:
+        return all(token.is_cancelled() for token in self.tokens)
+
+    def raise_if_cancelled(self):
+        if self.is_cancelled():
+            raise Cancelled(self.tokens[0].reason if self.tokens else "Zrušeno")
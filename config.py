@@ -0,0 +1,129 @@
+"""
+Sdílená konfigurace AI Style Transfer
+
+Environment variables, datové adresáře a výchozí parametry bez závislosti
+na torch/diffusers, aby je mohlo načíst tenké Streamlit UI i inference engine.
+"""
+
+import os
+
+# Environment variables pro konfiguraci
+FORCE_CPU = os.getenv('FORCE_CPU', 'false').lower() == 'true'
+MAX_MEMORY_GB = float(os.getenv('MAX_MEMORY_GB', '8'))
+# BASE_MODEL - nepoužíváme base modely, pouze uživatelské full a LoRA modely
+ENABLE_ATTENTION_SLICING = os.getenv('ENABLE_ATTENTION_SLICING', 'true').lower() == 'true'
+ENABLE_CPU_OFFLOAD = os.getenv('ENABLE_CPU_OFFLOAD', 'auto')
+LORA_MODELS_PATH = os.getenv('LORA_MODELS_PATH', '/data/loras')
+FULL_MODELS_PATH = os.getenv('FULL_MODELS_PATH', '/data/models')
+OUTPUT_PATH = os.getenv('OUTPUT_PATH', '/data/outputs')
+HF_HOME = os.getenv('HF_HOME', '/root/.cache/huggingface')
+BASE_MODEL = os.getenv('BASE_MODEL', 'stabilityai/stable-diffusion-xl-base-1.0')
+# Maximální počet vzorků v jednom volání pipeline a plocha vstupu (SDXL ~1 MP)
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '4'))
+MAX_INPUT_MEGAPIXELS = float(os.getenv('MAX_INPUT_MEGAPIXELS', '1.0'))
+
+# Vytvoření adresářů - s fallback pro lokální vývoj
+try:
+    os.makedirs(LORA_MODELS_PATH, exist_ok=True)
+    os.makedirs(FULL_MODELS_PATH, exist_ok=True)
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+except OSError:
+    # Fallback pro lokální vývoj - použij lokální složky
+    LORA_MODELS_PATH = './lora_models'
+    FULL_MODELS_PATH = './models'
+    OUTPUT_PATH = './outputs'
+    os.makedirs(LORA_MODELS_PATH, exist_ok=True)
+    os.makedirs(FULL_MODELS_PATH, exist_ok=True)
+    os.makedirs(OUTPUT_PATH, exist_ok=True)
+
+# Rozpracovaná nahrávání modelů - na stejném volume jako katalog kvůli atomickému přesunu
+UPLOADS_PATH = os.getenv('UPLOADS_PATH', os.path.join(os.path.dirname(os.path.abspath(LORA_MODELS_PATH)), '.uploads'))
+UPLOAD_CHUNK_MB = int(os.getenv('UPLOAD_CHUNK_MB', '16'))
+
+try:
+    os.makedirs(HF_HOME, exist_ok=True)
+except OSError:
+    # Fallback pro HuggingFace cache
+    HF_HOME = os.path.expanduser('~/.cache/huggingface')
+    os.makedirs(HF_HOME, exist_ok=True)
+
+# Trvalé úložiště úloh enginu (SQLite + vstupy/výstupy úloh)
+JOBS_PATH = os.getenv('JOBS_PATH', os.path.join(OUTPUT_PATH, 'jobs'))
+# Retence ukončených úloh - stáří ve dnech a počet nejnovějších (0 = bez limitu)
+JOBS_MAX_AGE_DAYS = float(os.getenv('JOBS_MAX_AGE_DAYS', '7'))
+JOBS_MAX_COUNT = int(os.getenv('JOBS_MAX_COUNT', '1000'))
+
+# Cache deterministických výsledků (jen úlohy se zadaným seedem)
+CACHE_PATH = os.getenv('CACHE_PATH', os.path.join(OUTPUT_PATH, 'cache'))
+RESULT_CACHE_MB = float(os.getenv('RESULT_CACHE_MB', '2048'))
+
+# Historie výsledků adresovaná obsahem (PNG, miniatury a index)
+RESULTS_PATH = os.getenv('RESULTS_PATH', os.path.join(OUTPUT_PATH, 'results'))
+
+# Naučené upscalery (ESRGAN .safetensors/.pth) na stejném volume jako modely
+UPSCALER_MODELS_PATH = os.getenv('UPSCALER_MODELS_PATH', os.path.join(os.path.dirname(os.path.abspath(LORA_MODELS_PATH)), 'upscalers'))
+
+# ZIP exporty všech variant z UI
+EXPORTS_PATH = os.getenv('EXPORTS_PATH', os.path.join(OUTPUT_PATH, 'exports'))
+# Jak dlouho (hodiny) exporty na disku zůstávají
+EXPORTS_MAX_AGE_H = float(os.getenv('EXPORTS_MAX_AGE_H', '24'))
+
+# Exporty modelů pro ONNX Runtime backend (jednou pro model a LoRA)
+ONNX_CACHE_PATH = os.getenv('ONNX_CACHE_PATH', os.path.join(OUTPUT_PATH, 'onnx'))
+
+# Kvantizované int8 UNety pro CPU backend (jednou pro model a LoRA)
+QUANT_CACHE_PATH = os.getenv('QUANT_CACHE_PATH', os.path.join(OUTPUT_PATH, 'quantized'))
+
+# Inference engine - samostatný proces vlastnící zařízení a cache
+ENGINE_HOST = os.getenv('ENGINE_HOST', '127.0.0.1')
+ENGINE_PORT = int(os.getenv('ENGINE_PORT', '8765'))
+ENGINE_AUTHKEY = os.getenv('ENGINE_AUTHKEY', 'lora-tuymans-engine').encode()
+ENGINE_AUTOSTART = os.getenv('ENGINE_AUTOSTART', 'true').lower() == 'true'
+
+# HTTP job API běžící v procesu enginu (prázdný API_TOKEN = bez autentizace,
+# pak API naslouchá jen na loopbacku - jinou adresu engine bez tokenu odmítne)
+API_ENABLED = os.getenv('API_ENABLED', 'true').lower() == 'true'
+API_HOST = os.getenv('API_HOST', '127.0.0.1')
+API_PORT = int(os.getenv('API_PORT', '8502'))
+API_TOKEN = os.getenv('API_TOKEN', '')
+
+# Výchozí parametry generování (stejné jako výchozí hodnoty v UI)
+DEFAULT_PARAMS = {
+    'strength': 0.6,
+    'guidance_scale': 7.5,
+    'num_inference_steps': 20,
+    'clip_skip': 2,
+    'seed': None,
+    'upscale_factor': 1,
+    'num_images': 1,
+    'sampler': "DPMSolverMultistepScheduler",
+    'variance_seed': None,
+    'variance_strength': 0.0,
+    'feature_reuse_interval': 1,
+    'feature_reuse_check': False,
+    'guidance_mode': "standard",
+    'cfg_fraction': 1.0,
+    'backend': "torch",
+    'upscaler': "",
+    # Hires fix - druhý průchod nad zvětšenými latenty (1.0 = vypnuto)
+    'hires_scale': 1.0,
+    'hires_strength': 0.35,
+    'hires_steps': 20,
+}
+
+# Výpočetní backendy (popisky pro UI)
+BACKENDS = {
+    "torch": "PyTorch (eager)",
+    "onnx": "ONNX Runtime (CPU)",
+    "int8": "PyTorch int8 (CPU)",
+}
+
+# Backendy, které běží vždy na CPU bez ohledu na zařízení workeru
+CPU_BACKENDS = ("onnx", "int8")
+
+# Režimy guidance fast path (popisky pro UI)
+GUIDANCE_MODES = {
+    "standard": "Standardní CFG",
+    "truncate": "CFG truncation",
+    "no_cfg_empty_prompt": "Bez CFG pro prázdný prompt",
+}
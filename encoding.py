@@ -0,0 +1,175 @@
+"""
+Kódování výsledků jednou na formát - pool vláken a cache zakódovaných bajtů
+
+Každý výsledek (id úlohy + index varianty) se do daného formátu a velikosti
+zakóduje nejvýš jednou; náhled, miniatury, tlačítka stažení, HTTP API
+i zápis na disk pak sdílejí stejné bajty. Kódování běží paralelně v poolu
+vláken (kodeky Pillow uvolňují GIL) s vyladěnou úrovní komprese.
+
+Náhledy tvoří pyramidu (THUMBNAIL_SIZES, výchozí šířky z UI): úrovně vznikají
+jednou na výsledek kaskádou od největší, každá z předchozí s reducing_gap,
+takže se plné rozlišení zmenšuje jen jednou a do prohlížeče jde jen ta
+velikost, která se zobrazuje.
+"""
+
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from PIL import Image
+
+ENCODE_WORKERS = int(os.getenv('ENCODE_WORKERS', str(min(4, os.cpu_count() or 1))))
+ENCODE_CACHE_MB = float(os.getenv('ENCODE_CACHE_MB', '512'))
+# zlib úroveň 3 je několikanásobně rychlejší než výchozí 6 a soubor je jen o málo větší
+PNG_COMPRESS_LEVEL = int(os.getenv('PNG_COMPRESS_LEVEL', '3'))
+WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', '90'))
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '92'))
+# Úrovně pyramidy náhledů (delší strana): miniatura galerie, náhled výsledku, hlavní náhled galerie
+THUMBNAIL_SIZES = tuple(sorted(int(s) for s in os.getenv('THUMBNAIL_SIZES', '150,336,1024').split(',') if s.strip()))
+
+# Formáty výstupu - PNG bezztrátově pro stažení, WebP/JPEG hlavně pro náhledy
+FORMATS = {
+    'png': {'format': "PNG", 'mime': "image/png", 'ext': "png", 'options': {'compress_level': PNG_COMPRESS_LEVEL}},
+    'webp': {'format': "WEBP", 'mime': "image/webp", 'ext': "webp", 'options': {'quality': WEBP_QUALITY, 'method': 4}},
+    'jpeg': {'format': "JPEG", 'mime': "image/jpeg", 'ext': "jpg", 'options': {'quality': JPEG_QUALITY}},
+}
+
+
+def shrink(image: Image.Image, max_size: int) -> Image.Image:
+    """Zmenší obrázek na max_size delší strany - nejdřív rychlé reduce(), pak LANCZOS."""
+    if max(image.size) <= max_size:
+        return image
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return image
+
+
+def pyramid_level(size: int) -> int:
+    """Nejmenší úroveň pyramidy, která pokryje požadovanou velikost."""
+    return next((level for level in THUMBNAIL_SIZES if level >= size), THUMBNAIL_SIZES[-1])
+
+
+def encode_image(image: Image.Image, fmt: str = "png", max_size: Optional[int] = None) -> bytes:
+    """Zakóduje obrázek (volitelně zmenšený na max_size delší strany) do bajtů."""
+    spec = FORMATS[fmt]
+    if max_size:
+        image = shrink(image, max_size)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format=spec['format'], **spec['options'])
+    return buf.getvalue()
+
+
+class EncodedCache:
+    """LRU zakódovaných bajtů podle (id výsledku, formát, velikost) se sdílením rozpracovaných kódování."""
+
+    def __init__(self, workers: int = ENCODE_WORKERS, budget_mb: float = ENCODE_CACHE_MB):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="encoder")
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.encodes = 0
+
+    def _encode(self, key, image: Image.Image) -> bytes:
+        result_id, fmt, max_size = key
+        try:
+            data = encode_image(image, fmt, max_size)
+        except Exception:
+            with self._lock:
+                self._inflight.pop(key, None)
+            raise
+        with self._lock:
+            self._store(key, data)
+            self._inflight.pop(key, None)
+        return data
+
+    def _store(self, key, data: bytes):
+        """Uloží bajty do LRU (volá se se zámkem)."""
+        self.encodes += 1
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        total = sum(len(d) for d in self._entries.values())
+        while total > self.budget_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            total -= len(old)
+
+    def _encode_pyramid(self, result_id: str, image: Image.Image, fmt: str, futures: dict):
+        """Kaskáda úrovní od největší - každá se zmenšuje z předchozí, ne z plného rozlišení."""
+        level_image = image
+        for size in sorted(futures, reverse=True):
+            key = (result_id, fmt, size)
+            try:
+                level_image = shrink(level_image, size)
+                data = encode_image(level_image, fmt)
+            except Exception as e:
+                with self._lock:
+                    for pending in futures:
+                        self._inflight.pop((result_id, fmt, pending), None)
+                for pending in futures.values():
+                    if not pending.done():
+                        pending.set_exception(e)
+                return
+            with self._lock:
+                self._store(key, data)
+                self._inflight.pop(key, None)
+            futures[size].set_result(data)
+
+    def submit(self, result_id: str, image: Image.Image, fmt: str = "png", max_size: Optional[int] = None) -> Future:
+        """
+        Naplánuje kódování (nebo vrátí hotové/rozpracované) bez čekání. Velikost
+        z THUMBNAIL_SIZES spustí stavbu celé pyramidy - ostatní úrovně jsou pak zdarma.
+        """
+        key = (result_id, fmt, max_size)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(self._entries[key])
+                return future
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            if max_size in THUMBNAIL_SIZES:
+                futures = {
+                    size: Future() for size in THUMBNAIL_SIZES
+                    if (result_id, fmt, size) not in self._entries and (result_id, fmt, size) not in self._inflight
+                }
+                for size, level_future in futures.items():
+                    self._inflight[(result_id, fmt, size)] = level_future
+                self._pool.submit(self._encode_pyramid, result_id, image, fmt, futures)
+                return futures[max_size]
+            future = self._pool.submit(self._encode, key, image)
+            self._inflight[key] = future
+            return future
+
+    def get(self, result_id: str, image: Image.Image, fmt: str = "png", max_size: Optional[int] = None) -> bytes:
+        return self.submit(result_id, image, fmt, max_size).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_mb': sum(len(d) for d in self._entries.values()) / (1024 * 1024),
+                'hits': self.hits,
+                'encodes': self.encodes,
+            }
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder() -> EncodedCache:
+    """Sdílený encoder pro celý proces."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = EncodedCache()
+        return _encoder
@@ -0,0 +1,403 @@
+"""
+Inference engine - samostatný dlouho běžící proces
+
+Vlastní zařízení, rezidentní pipeline (přes InferenceWorker) a cache. Streamlit
+UI je jen klient (engine_client.py); restart UI tak nestojí nové načtení
+modelu a engine lze restartovat bez zásahu do UI. Vstupní i výstupní obrázky
+putují přes sdílenou paměť, po spojení jdou jen malé slovníky.
+
+Spuštění: python engine.py
+"""
+
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener
+
+from PIL import Image
+
+from cancellation import Cancelled
+from encoding import get_encoder
+from config import ENGINE_HOST, ENGINE_PORT, ENGINE_AUTHKEY, API_ENABLED
+from engine_client import image_to_shm, image_from_shm
+from inference import get_system_info, get_optimal_device, detect_model_type
+from grid import run_parameter_grid_on_pipe
+from job_store import JobStore
+from noise import variant_seeds
+from result_cache import ResultCache, result_key
+from result_store import ResultStore
+from worker import Job, get_worker_pool
+
+# Osy gridu - v úložišti úloh jsou součástí parametrů
+GRID_AXES = ('strengths', 'guidance_scales', 'steps_list', 'seeds')
+
+# Jak dlouho engine drží výsledky úlohy, kterou si klient nevyzvedl
+ENGINE_JOB_TTL = float(os.getenv('ENGINE_JOB_TTL', '3600'))
+
+
+class InferenceEngine:
+    """Server přijímající požadavky klientů a předávající úlohy workeru."""
+
+    def __init__(self, host: str = ENGINE_HOST, port: int = ENGINE_PORT, authkey: bytes = ENGINE_AUTHKEY):
+        self.address = (host, port)
+        self.authkey = authkey
+        self.worker = get_worker_pool()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.store = JobStore()
+        self.results = ResultStore()
+        self.cache = ResultCache()
+        # Zápis výstupů na disk mimo vlákno workeru
+        self._persist_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+        # Test zařízení stojí CUDA inicializaci - jen jednou při startu
+        device, device_reason = get_optimal_device()
+        self.system_info = dict(get_system_info(), device=device, device_reason=device_reason)
+
+    def serve_forever(self):
+        self.recover()
+        threading.Thread(target=self._expire_jobs, daemon=True, name="engine-expiry").start()
+        if API_ENABLED:
+            from api import start_api
+            start_api(self)
+        with Listener(self.address, authkey=self.authkey) as listener:
+            print(f"✅ Inference engine naslouchá na {self.address[0]}:{self.address[1]} ({self.system_info['device_reason']})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Neúspěšná autentizace nebo přerušené spojení nesmí shodit engine
+                    print(f"Warning: Odmítnuté spojení: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            request = conn.recv()
+            handler = getattr(self, f"op_{request.pop('op', '')}", None)
+            if handler is None:
+                conn.send({'ok': False, 'error': "Neznámá operace"})
+                return
+            try:
+                conn.send({'ok': True, 'result': handler(**request)})
+            except Exception as e:
+                conn.send({'ok': False, 'error': str(e)})
+        except (OSError, EOFError) as e:
+            print(f"Warning: Spojení s klientem přerušeno: {e}")
+        finally:
+            conn.close()
+
+    def get_job(self, job_id: str):
+        return self._get_entry(job_id)['job']
+
+    def submit_style(self, image, params: dict, job_id: str = None, persist: bool = True) -> str:
+        """Zařadí úlohu stylového přenosu (sdíleno UI klientem i HTTP API)."""
+        job = Job(image, params, job_id=job_id)
+        if persist:
+            # Úloha je na disku dřív, než jde do fronty
+            self.store.add(job.id, "style", job.params, job.input_image)
+        entry = self._register(job, "style")
+        job.future.add_done_callback(lambda _: self._persist_pool.submit(self._persist, job))
+
+        try:
+            key = result_key(job.input_image, job.params)
+        except OSError as e:
+            print(f"Warning: Nelze spočítat klíč cache: {e}")
+            key = None
+        if key is None:
+            self.worker.enqueue(job)
+            return job.id
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            job.report.update(cache="hit", seeds=variant_seeds(job.params['seed'], job.params['variance_seed'], job.num_samples()))
+            job.status = "done"
+            job.set_progress(1.0, "Hotovo (z cache)")
+            job.future.set_result(cached)
+            return job.id
+
+        self._compute(job, key, entry)
+        return job.id
+
+    def _compute(self, job, key: str, entry: dict):
+        """Spustí výpočet, nebo se připojí k již běžícímu stejnému výpočtu."""
+        leader = self.cache.begin(key, job)
+        if leader is not None:
+            # Stejný výpočet už běží - úloha převezme jeho výsledek
+            entry['leader'] = leader
+            leader.future.add_done_callback(lambda future: self._follow(job, leader, key, entry))
+            return
+
+        entry.pop('leader', None)
+        job.report['cache'] = "miss"
+        job.future.add_done_callback(lambda _: self._persist_pool.submit(self._cache_result, key, job))
+        self.worker.enqueue(job)
+
+    def _follow(self, job, leader, key: str, entry: dict):
+        if job.future.done():
+            # Čekající úloha byla zrušena sama
+            return
+        if leader.status == "cancelled" and not job.cancel_token.is_cancelled():
+            # Zrušení jednoho klienta nesmí zrušit ostatní - výpočet převezme tato úloha
+            self.cache.end(key, leader)
+            self._compute(job, key, entry)
+            return
+        job.report.update(leader.report, cache="coalesced")
+        job.timings.update(leader.timings)
+        job.status = leader.status
+        job.set_progress(1.0, leader.message)
+        error = leader.future.exception()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(leader.future.result())
+
+    def encoded_outputs(self, job):
+        """PNG bajty výsledků úlohy - kódují se jednou pro úložiště, cache i HTTP API."""
+        encoder = get_encoder()
+        futures = [encoder.submit(f"{job.id}_{i}", image, "png") for i, image in enumerate(job.future.result())]
+        return [future.result() for future in futures]
+
+    def _cache_result(self, key: str, job):
+        try:
+            if job.future.exception() is None:
+                self.cache.put(key, job.future.result(), self.encoded_outputs(job))
+        except Exception as e:
+            print(f"Warning: Nelze uložit výsledek do cache: {e}")
+        finally:
+            self.cache.end(key, job)
+
+    def _persist(self, job):
+        try:
+            error = job.future.exception()
+            if isinstance(error, Cancelled):
+                self.store.update(job.id, status="cancelled", message=str(error), timings=job.timings)
+            elif error is not None:
+                self.store.update(job.id, status="failed", message=str(error), timings=job.timings)
+            elif job.call is not None:
+                # Grid - buňky a kontaktní arch už leží na disku, uloží se jen odkazy a metadata
+                result = job.future.result()
+                report = dict(job.report, grid={
+                    'cells': [{k: v for k, v in cell.items() if k != 'image'} for cell in result['cells']],
+                    'contact_sheet_path': result['contact_sheet_path'],
+                    'output_dir': result['output_dir'],
+                    'timings': result['timings'],
+                    'total_denoising_steps': result['total_denoising_steps'],
+                })
+                self.store.save_outputs(job.id, [result['contact_sheet_path']], report, job.timings)
+            else:
+                # Výstupy se zapíšou jen jednou do úložiště výsledků, úloha na ně odkazuje
+                outputs = self.results.add(job.id, job.future.result(), job.params, job.report, job.timings,
+                                           self.encoded_outputs(job))
+                self.store.save_outputs(job.id, outputs, job.report, job.timings)
+        except Exception as e:
+            print(f"❌ Nelze uložit úlohu {job.id}: {e}")
+
+    def recover(self):
+        """Znovu zařadí nedokončené úlohy z úložiště pod stejným id (idempotentní)."""
+        recovered = 0
+        for record in self.store.pending():
+            with self._lock:
+                if record['id'] in self._jobs:
+                    continue
+            if self.store.load_outputs(record) is not None:
+                # Výstupy stihly vzniknout před pádem - jen dopsat stav
+                self.store.update(record['id'], status="done")
+                continue
+            if not record['input_path'] or not os.path.exists(record['input_path']):
+                self.store.update(record['id'], status="failed", message="Chybí vstupní obrázek")
+                continue
+            with Image.open(record['input_path']) as image:
+                input_image = image.convert("RGB")
+            if record['kind'] == "grid":
+                self.submit_grid(input_image, record['params'], job_id=record['id'], persist=False)
+            else:
+                self.submit_style(input_image, record['params'], job_id=record['id'], persist=False)
+            recovered += 1
+        if recovered:
+            print(f"🔄 Obnoveno {recovered} nedokončených úloh z úložiště")
+
+    def _restore(self, job_id: str):
+        """Hotovou nebo selhanou úlohu z úložiště vrátí do registru (např. po restartu enginu)."""
+        record = self.store.get(job_id)
+        if record is None or record['status'] in ("queued", "running"):
+            return None
+        job = Job(params=record['params'], job_id=job_id)
+        job.report, job.timings = record['report'], record['timings']
+        if record['status'] == "done" and record['kind'] == "grid":
+            grid = record['report'].get('grid')
+            images = self.store.load_outputs(record)
+            if grid is None or images is None:
+                return None
+            job.future.set_result(dict(grid, contact_sheet=images[0]))
+        elif record['status'] == "done":
+            images = self.store.load_outputs(record)
+            if images is None:
+                return None
+            job.future.set_result(images)
+        elif record['status'] == "cancelled":
+            job.future.set_exception(Cancelled(record['message']))
+        else:
+            job.future.set_exception(RuntimeError(record['message']))
+        job.status = record['status']
+        job.set_progress(1.0, record['message'] or "Hotovo")
+        with self._lock:
+            return self._jobs.setdefault(job_id, {'job': job, 'kind': record['kind'], 'segments': [], 'finished_at': None})
+
+    def _get_entry(self, job_id: str) -> dict:
+        with self._lock:
+            entry = self._jobs.get(job_id)
+        if entry is None:
+            entry = self._restore(job_id)
+        if entry is None:
+            raise KeyError(f"Neznámá úloha {job_id}")
+        return entry
+
+    def cancel_job(self, job_id: str, reason: str = "Zrušeno") -> bool:
+        """Zruší čekající nebo běžící úlohu (UI, HTTP API, odpojení session)."""
+        entry = self._get_entry(job_id)
+        job = entry['job']
+        if job.future.done():
+            return False
+        if 'leader' in entry:
+            # Sloučená úloha nic nepočítá - jen přestane čekat na výpočet
+            job.cancel_token.cancel(reason)
+            job.mark_cancelled()
+            return True
+        return self.worker.cancel(job, reason)
+
+    def _register(self, job, kind: str) -> dict:
+        entry = {'job': job, 'kind': kind, 'segments': [], 'finished_at': None}
+        with self._lock:
+            self._jobs[job.id] = entry
+        return entry
+
+    def op_ping(self):
+        return "pong"
+
+    def op_system_info(self):
+        return dict(
+            self.system_info,
+            queue_length=self.worker.queue_length(),
+            workers=self.worker.stats(),
+            result_cache=self.cache.stats()
+        )
+
+    def op_detect_model_type(self, model_path: str):
+        return detect_model_type(model_path)
+
+    def op_submit_style(self, image: dict, params: dict):
+        return self.submit_style(image_from_shm(image), params)
+
+    def op_submit_grid(self, image: dict, params: dict):
+        return self.submit_grid(image_from_shm(image), params)
+
+    def submit_grid(self, input_image, params: dict, job_id: str = None, persist: bool = True) -> str:
+        """Zařadí grid sweep; osy gridu a vstup jdou do úložiště úloh jako u stylového přenosu."""
+        if persist:
+            job_id = job_id or uuid.uuid4().hex
+            self.store.add(job_id, "grid", params, input_image)
+        params = dict(params)
+        grid = {key: params.pop(key) for key in GRID_AXES}
+        job = self.worker.submit_call(
+            params,
+            lambda pipe, job: run_parameter_grid_on_pipe(
+                pipe,
+                input_image,
+                grid['strengths'],
+                grid['guidance_scales'],
+                grid['steps_list'],
+                grid['seeds'],
+                job.set_progress,
+                cancel_token=job.cancel_token
+            ),
+            job_id=job_id
+        )
+        self._register(job, "grid")
+        job.future.add_done_callback(lambda _: self._persist_pool.submit(self._persist, job))
+        return job.id
+
+    def op_status(self, job_id: str):
+        entry = self._get_entry(job_id)
+        job = entry['job']
+        # Sloučená úloha hlásí progress výpočtu, na který čeká
+        source = entry.get('leader', job) if not job.future.done() else job
+        return {
+            'kind': entry['kind'],
+            'status': job.status if job.future.done() else source.status,
+            'progress': source.progress,
+            'message': source.message,
+            'report': job.report,
+            'timings': job.timings,
+        }
+
+    def op_result(self, job_id: str):
+        entry = self._get_entry(job_id)
+        job = entry['job']
+        # Status "done" se nastavuje těsně před výsledkem future - krátké čekání stačí
+        result = job.future.result(timeout=10)
+
+        def share(image):
+            shm, descriptor = image_to_shm(image)
+            entry['segments'].append(shm)
+            return descriptor
+
+        if entry['kind'] == "grid":
+            return {
+                'contact_sheet': share(result['contact_sheet']),
+                'cells': [{k: v for k, v in cell.items() if k != 'image'} for cell in result['cells']],
+                'contact_sheet_path': result['contact_sheet_path'],
+                'output_dir': result['output_dir'],
+                'timings': dict(result['timings'], load_s=job.timings.get('load_s', 0.0)),
+                'total_denoising_steps': result['total_denoising_steps'],
+            }
+        return {'images': [share(image) for image in result], 'report': job.report, 'timings': job.timings}
+
+    def op_cancel(self, job_id: str, reason: str = "Zrušeno"):
+        return self.cancel_job(job_id, reason)
+
+    def op_release(self, job_id: str):
+        with self._lock:
+            entry = self._jobs.pop(job_id, None)
+        if entry is not None:
+            self._free(entry)
+        return True
+
+    def _free(self, entry: dict):
+        for shm in entry['segments']:
+            shm.close()
+            shm.unlink()
+        entry['segments'] = []
+
+    def _expire_jobs(self):
+        """Uvolní výsledky úloh, které si klient nevyzvedl (např. po restartu UI)."""
+        while True:
+            time.sleep(60)
+            now = time.time()
+            expired = []
+            with self._lock:
+                for job_id, entry in list(self._jobs.items()):
+                    if entry['job'].future.done() and entry['finished_at'] is None:
+                        entry['finished_at'] = now
+                    if entry['finished_at'] is not None and now - entry['finished_at'] > ENGINE_JOB_TTL:
+                        expired.append(self._jobs.pop(job_id))
+            for entry in expired:
+                self._free(entry)
+            self._prune_store()
+
+    def _prune_store(self):
+        """Retence úložiště úloh - jen úlohy, které už engine nedrží v registru."""
+        try:
+            with self._lock:
+                active = set(self._jobs)
+            removed = self.store.prune(keep=active)
+            if removed:
+                print(f"🧹 Smazáno {removed} starých úloh z úložiště")
+        except Exception as e:
+            print(f"Warning: Retence úložiště úloh selhala: {e}")
+
+
+if __name__ == "__main__":
+    InferenceEngine().serve_forever()
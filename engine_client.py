@@ -0,0 +1,209 @@
+"""
+Klient inference enginu pro Streamlit UI
+
+Engine běží jako samostatný proces (engine.py) a vlastní zařízení, rezidentní
+pipeline i cache. UI s ním mluví přes multiprocessing.connection a obrázky
+předává přes sdílenou paměť jako surové RGB pixely - bez picklování a bez
+závislosti na torch/diffusers.
+"""
+
+import os
+import sys
+import time
+import subprocess
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Client
+from typing import Optional
+
+from PIL import Image
+
+from config import ENGINE_HOST, ENGINE_PORT, ENGINE_AUTHKEY, ENGINE_AUTOSTART
+
+# Jak dlouho čekat na naběhnutí enginu po automatickém spuštění
+ENGINE_START_TIMEOUT = float(os.getenv('ENGINE_START_TIMEOUT', '60'))
+
+
+class EngineError(RuntimeError):
+    """Chyba komunikace s enginem nebo chyba úlohy v enginu."""
+
+
+class EngineUnavailable(EngineError):
+    """Engine neodpovídá (neběží nebo se právě restartuje)."""
+
+
+class JobCancelled(EngineError):
+    """Úloha byla zrušena dřív, než doběhla."""
+
+
+def image_to_shm(image: Image.Image):
+    """Zapíše obrázek do nového segmentu sdílené paměti a vrátí (segment, popis)."""
+    image = image.convert("RGB")
+    data = image.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return shm, {'name': shm.name, 'width': image.width, 'height': image.height, 'mode': "RGB"}
+
+
+def image_from_shm(descriptor: dict) -> Image.Image:
+    """Načte kopii obrázku ze segmentu, který vlastní druhá strana."""
+    shm = shared_memory.SharedMemory(name=descriptor['name'])
+    try:
+        size = descriptor['width'] * descriptor['height'] * len(descriptor['mode'])
+        image = Image.frombytes(descriptor['mode'], (descriptor['width'], descriptor['height']), bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+        # Segment uvolní vlastník - resource tracker tohoto procesu ho nesmí smazat
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return image
+
+
+class EngineClient:
+    """Tenký klient - jedno spojení na volání, stav úloh drží engine."""
+
+    def __init__(self, host: str = ENGINE_HOST, port: int = ENGINE_PORT, authkey: bytes = ENGINE_AUTHKEY):
+        self.address = (host, port)
+        self.authkey = authkey
+
+    def _call(self, op: str, **kwargs):
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+        except (OSError, EOFError) as e:
+            raise EngineUnavailable(f"Inference engine není dostupný ({self.address[0]}:{self.address[1]}): {e}")
+        try:
+            conn.send(dict(kwargs, op=op))
+            response = conn.recv()
+        except (OSError, EOFError) as e:
+            raise EngineUnavailable(f"Spojení s enginem přerušeno: {e}")
+        finally:
+            conn.close()
+        if not response.get('ok'):
+            raise EngineError(response.get('error', "Neznámá chyba enginu"))
+        return response.get('result')
+
+    def ping(self) -> bool:
+        try:
+            return self._call("ping") == "pong"
+        except EngineError:
+            return False
+
+    def system_info(self) -> dict:
+        """Systémové informace a zvolené zařízení enginu."""
+        return self._call("system_info")
+
+    def detect_model_type(self, model_path: str) -> str:
+        return self._call("detect_model_type", model_path=os.path.abspath(model_path))
+
+    def _submit_with_image(self, op: str, image: Image.Image, params: dict) -> str:
+        shm, descriptor = image_to_shm(image)
+        try:
+            # Engine si obrázek zkopíruje ještě před odpovědí
+            return self._call(op, image=descriptor, params=params)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def submit_style(self, image: Image.Image, params: dict) -> str:
+        """Odešle úlohu stylového přenosu, vrací id úlohy."""
+        return self._submit_with_image("submit_style", image, params)
+
+    def submit_grid(self, image: Image.Image, params: dict) -> str:
+        """Odešle grid sweep (params obsahuje strengths, guidance_scales, steps_list, seeds)."""
+        return self._submit_with_image("submit_grid", image, params)
+
+    def status(self, job_id: str) -> dict:
+        """Stav úlohy - status, progress, message, report, timings."""
+        return self._call("status", job_id=job_id)
+
+    def result(self, job_id: str):
+        """
+        Výsledek hotové úlohy. Obrázky se zkopírují ze sdílené paměti enginu
+        a segmenty se hned uvolní.
+        """
+        result = self._call("result", job_id=job_id)
+        try:
+            if 'images' in result:
+                result['images'] = [image_from_shm(d) for d in result['images']]
+            if 'contact_sheet' in result:
+                result['contact_sheet'] = image_from_shm(result['contact_sheet'])
+        finally:
+            self.release(job_id)
+        return result
+
+    def cancel(self, job_id: str, reason: str = "Zrušeno") -> bool:
+        """Zruší úlohu v enginu; chyba spojení se jen zaloguje (volá se i při ukončení session)."""
+        try:
+            return self._call("cancel", job_id=job_id, reason=reason)
+        except EngineError as e:
+            print(f"Warning: Nelze zrušit úlohu {job_id}: {e}")
+            return False
+
+    def release(self, job_id: str):
+        """Uvolní výsledky úlohy v enginu."""
+        try:
+            self._call("release", job_id=job_id)
+        except EngineError as e:
+            print(f"Warning: Nelze uvolnit úlohu {job_id}: {e}")
+
+    def wait(self, job_id: str, progress_fn=None, poll_interval: float = 0.2):
+        """
+        Čeká na dokončení úlohy a průběžně hlásí progress. Restart enginu
+        přečká - úloha se obnoví z úložiště úloh pod stejným id.
+        """
+        last_seen = time.time()
+        while True:
+            try:
+                state = self.status(job_id)
+            except EngineUnavailable:
+                if time.time() - last_seen > ENGINE_START_TIMEOUT:
+                    raise
+                if progress_fn:
+                    progress_fn(0.0, "Inference engine se restartuje...")
+                time.sleep(1.0)
+                continue
+            last_seen = time.time()
+            if progress_fn:
+                progress_fn(state['progress'], state['message'])
+            if state['status'] == "failed":
+                self.release(job_id)
+                raise EngineError(state['message'])
+            if state['status'] == "cancelled":
+                self.release(job_id)
+                raise JobCancelled(state['message'])
+            if state['status'] == "done":
+                return state, self.result(job_id)
+            time.sleep(poll_interval)
+
+
+def start_engine() -> subprocess.Popen:
+    """Spustí engine jako samostatný proces nezávislý na UI."""
+    engine_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine.py")
+    with open(os.getenv('ENGINE_LOG', '/tmp/engine.log'), "ab") as log:
+        return subprocess.Popen(
+            [sys.executable, engine_script],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+
+
+def ensure_engine(client: Optional[EngineClient] = None, timeout: float = ENGINE_START_TIMEOUT) -> EngineClient:
+    """Vrátí klienta běžícího enginu, při ENGINE_AUTOSTART engine případně spustí."""
+    client = client or EngineClient()
+    if client.ping():
+        return client
+    if not ENGINE_AUTOSTART:
+        raise EngineError("Inference engine neběží (ENGINE_AUTOSTART=false)")
+
+    print("🚀 Inference engine neběží, spouštím engine.py...")
+    process = start_engine()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if client.ping():
+            return client
+        if process.poll() is not None:
+            # Engine mezitím mohl spustit jiný proces - port je obsazený
+            if client.ping():
+                return client
+            raise EngineError(f"Inference engine skončil s kódem {process.returncode}")
+        time.sleep(0.5)
+    raise EngineError(f"Inference engine nenaběhl do {timeout:.0f} s")
@@ -0,0 +1,301 @@
+"""
+Naučený upscaler z rodiny ESRGAN (RRDBNet, Real-ESRGAN, SRVGGNetCompact)
+
+Architektura se pozná z vah lokálního souboru (.safetensors nebo .pth
+z UPSCALER_MODELS_PATH), bez další závislosti. Obrázek se zpracuje po
+dlaždicích s překryvem - překryvy se slijí váhovým oknem, takže švy
+nejsou vidět - a dlaždice jdou do sítě po dávkách, aby paměť zůstala
+omezená na CPU i GPU. Načtené modely zůstávají rezidentní jako pipeline.
+"""
+
+import os
+import re
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+# Hrana vstupní dlaždice, překryv (ve vstupních pixelech) a počet dlaždic v jednom průchodu
+ESRGAN_TILE = int(os.getenv('ESRGAN_TILE', '256'))
+ESRGAN_TILE_OVERLAP = int(os.getenv('ESRGAN_TILE_OVERLAP', '16'))
+ESRGAN_TILE_BATCH = int(os.getenv('ESRGAN_TILE_BATCH', '4'))
+# Kolik upscalerů drží proces rezidentně
+UPSCALER_RESIDENT = int(os.getenv('UPSCALER_RESIDENT', '1'))
+
+
+class ResidualDenseBlock(nn.Module):
+    def __init__(self, num_feat: int = 64, num_grow_ch: int = 32):
+        super().__init__()
+        self.conv1 = nn.Conv2d(num_feat, num_grow_ch, 3, 1, 1)
+        self.conv2 = nn.Conv2d(num_feat + num_grow_ch, num_grow_ch, 3, 1, 1)
+        self.conv3 = nn.Conv2d(num_feat + 2 * num_grow_ch, num_grow_ch, 3, 1, 1)
+        self.conv4 = nn.Conv2d(num_feat + 3 * num_grow_ch, num_grow_ch, 3, 1, 1)
+        self.conv5 = nn.Conv2d(num_feat + 4 * num_grow_ch, num_feat, 3, 1, 1)
+        self.lrelu = nn.LeakyReLU(negative_slope=0.2, inplace=True)
+
+    def forward(self, x):
+        x1 = self.lrelu(self.conv1(x))
+        x2 = self.lrelu(self.conv2(torch.cat((x, x1), 1)))
+        x3 = self.lrelu(self.conv3(torch.cat((x, x1, x2), 1)))
+        x4 = self.lrelu(self.conv4(torch.cat((x, x1, x2, x3), 1)))
+        x5 = self.conv5(torch.cat((x, x1, x2, x3, x4), 1))
+        return x5 * 0.2 + x
+
+
+class RRDB(nn.Module):
+    def __init__(self, num_feat: int, num_grow_ch: int = 32):
+        super().__init__()
+        self.rdb1 = ResidualDenseBlock(num_feat, num_grow_ch)
+        self.rdb2 = ResidualDenseBlock(num_feat, num_grow_ch)
+        self.rdb3 = ResidualDenseBlock(num_feat, num_grow_ch)
+
+    def forward(self, x):
+        return self.rdb3(self.rdb2(self.rdb1(x))) * 0.2 + x
+
+
+class RRDBNet(nn.Module):
+    """ESRGAN / Real-ESRGAN generátor; měřítko 2 a 1 přes pixel unshuffle vstupu (num_in_ch už po něm)."""
+
+    def __init__(self, num_in_ch: int = 3, num_out_ch: int = 3, scale: int = 4, num_feat: int = 64,
+                 num_block: int = 23, num_grow_ch: int = 32):
+        super().__init__()
+        self.scale = scale
+        self.conv_first = nn.Conv2d(num_in_ch, num_feat, 3, 1, 1)
+        self.body = nn.Sequential(*[RRDB(num_feat, num_grow_ch) for _ in range(num_block)])
+        self.conv_body = nn.Conv2d(num_feat, num_feat, 3, 1, 1)
+        self.conv_up1 = nn.Conv2d(num_feat, num_feat, 3, 1, 1)
+        self.conv_up2 = nn.Conv2d(num_feat, num_feat, 3, 1, 1)
+        self.conv_hr = nn.Conv2d(num_feat, num_feat, 3, 1, 1)
+        self.conv_last = nn.Conv2d(num_feat, num_out_ch, 3, 1, 1)
+        self.lrelu = nn.LeakyReLU(negative_slope=0.2, inplace=True)
+
+    def forward(self, x):
+        if self.scale == 2:
+            x = F.pixel_unshuffle(x, 2)
+        elif self.scale == 1:
+            x = F.pixel_unshuffle(x, 4)
+        feat = self.conv_first(x)
+        feat = feat + self.conv_body(self.body(feat))
+        feat = self.lrelu(self.conv_up1(F.interpolate(feat, scale_factor=2, mode="nearest")))
+        feat = self.lrelu(self.conv_up2(F.interpolate(feat, scale_factor=2, mode="nearest")))
+        return self.conv_last(self.lrelu(self.conv_hr(feat)))
+
+
+class SRVGGNetCompact(nn.Module):
+    """Kompaktní síť Real-ESRGAN (realesr-general, animevideo) - jen konvoluce a pixel shuffle."""
+
+    def __init__(self, num_in_ch: int = 3, num_out_ch: int = 3, num_feat: int = 64, num_conv: int = 16,
+                 upscale: int = 4):
+        super().__init__()
+        self.scale = upscale
+        body = [nn.Conv2d(num_in_ch, num_feat, 3, 1, 1), nn.PReLU(num_parameters=num_feat)]
+        for _ in range(num_conv):
+            body += [nn.Conv2d(num_feat, num_feat, 3, 1, 1), nn.PReLU(num_parameters=num_feat)]
+        body.append(nn.Conv2d(num_feat, num_out_ch * upscale * upscale, 3, 1, 1))
+        self.body = nn.ModuleList(body)
+        self.upsampler = nn.PixelShuffle(upscale)
+
+    def forward(self, x):
+        out = x
+        for layer in self.body:
+            out = layer(out)
+        return self.upsampler(out) + F.interpolate(x, scale_factor=self.scale, mode="nearest")
+
+
+# Původní formát ESRGAN (model.N...) -> názvy RRDBNet
+_LEGACY_KEYS = [
+    (re.compile(r"^model\.0\."), "conv_first."),
+    (re.compile(r"^model\.1\.sub\.(\d+)\.RDB(\d)\.conv(\d)\.0\."), lambda m: f"body.{m[1]}.rdb{m[2]}.conv{m[3]}."),
+    (re.compile(r"^model\.3\."), "conv_up1."),
+    (re.compile(r"^model\.6\."), "conv_up2."),
+    (re.compile(r"^model\.8\."), "conv_hr."),
+    (re.compile(r"^model\.10\."), "conv_last."),
+]
+
+
+def _convert_legacy(state_dict: dict) -> dict:
+    """Přejmenuje váhy starého ESRGAN formátu (jen 4x, jak ho ukládal původní repozitář)."""
+    blocks = {int(m[1]) for key in state_dict for m in [re.match(r"^model\.1\.sub\.(\d+)\.RDB", key)] if m}
+    converted = {}
+    for key, value in state_dict.items():
+        new_key = key
+        trunk = re.match(r"^model\.1\.sub\.(\d+)\.", key)
+        if trunk and int(trunk[1]) not in blocks:
+            # Poslední prvek sub je konvoluce za bloky
+            new_key = "conv_body." + key[trunk.end():]
+        else:
+            for pattern, replacement in _LEGACY_KEYS:
+                if pattern.match(key):
+                    new_key = pattern.sub(replacement, key)
+                    break
+        converted[new_key] = value
+    return converted
+
+
+def _read_state_dict(path: str) -> dict:
+    if path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        state_dict = load_file(path, device="cpu")
+    else:
+        state_dict = torch.load(path, map_location="cpu", weights_only=True)
+    # Checkpointy Real-ESRGAN balí váhy do params_ema / params
+    for wrapper in ("params_ema", "params"):
+        if isinstance(state_dict, dict) and wrapper in state_dict:
+            return state_dict[wrapper]
+    return state_dict
+
+
+def build_upscaler(state_dict: dict) -> nn.Module:
+    """Sestaví síť podle tvarů vah a váhy načte (striktně - špatná architektura selže hned)."""
+    if "model.0.weight" in state_dict:
+        state_dict = _convert_legacy(state_dict)
+
+    if "conv_first.weight" in state_dict:
+        num_feat, num_in_ch = state_dict["conv_first.weight"].shape[:2]
+        num_block = len({key.split(".")[1] for key in state_dict if key.startswith("body.") and ".rdb1.conv1.weight" in key})
+        num_grow_ch = state_dict["body.0.rdb1.conv1.weight"].shape[0]
+        num_out_ch = state_dict["conv_last.weight"].shape[0]
+        # Varianty x2 a x1 mají na vstupu pixel unshuffle (4 resp. 16 kanálů na barvu)
+        scale = {1: 4, 4: 2, 16: 1}.get(num_in_ch // num_out_ch, 4)
+        model = RRDBNet(num_in_ch, num_out_ch, scale, num_feat, num_block, num_grow_ch)
+    elif "body.0.weight" in state_dict:
+        conv_indices = sorted(int(key.split(".")[1]) for key, value in state_dict.items()
+                              if key.startswith("body.") and key.endswith(".weight") and value.dim() == 4)
+        num_feat, num_in_ch = state_dict["body.0.weight"].shape[:2]
+        last_out = state_dict[f"body.{conv_indices[-1]}.weight"].shape[0]
+        upscale = int(math.sqrt(last_out // num_in_ch))
+        model = SRVGGNetCompact(num_in_ch, num_in_ch, num_feat, len(conv_indices) - 2, upscale)
+    else:
+        raise ValueError("Nepodporovaná architektura upscaleru (očekává se RRDBNet nebo SRVGGNetCompact)")
+
+    model.load_state_dict(state_dict, strict=True)
+    return model.eval()
+
+
+def _feather(length: int, overlap: int) -> torch.Tensor:
+    """Váhy podél jedné osy dlaždice - lineární náběh v překryvu, jinde 1."""
+    weights = torch.ones(length)
+    if overlap > 0:
+        ramp = torch.linspace(1.0 / (overlap + 1), overlap / (overlap + 1), overlap)
+        weights[:overlap] = ramp
+        weights[-overlap:] = torch.minimum(weights[-overlap:], ramp.flip(0))
+    return weights
+
+
+def _positions(size: int, tile: int, step: int):
+    """Začátky dlaždic podél osy - poslední dlaždice je zarovnaná ke kraji."""
+    if size <= tile:
+        return [0]
+    positions = list(range(0, size - tile, step))
+    positions.append(size - tile)
+    return positions
+
+
+class ESRGANUpscaler:
+    """Rezidentní upscaler na jednom zařízení s dlaždicovou inferencí po dávkách."""
+
+    def __init__(self, path: str, device: str = "cpu"):
+        self.path = path
+        self.device = device
+        self.dtype = torch.float16 if device.startswith("cuda") else torch.float32
+        self.model = build_upscaler(_read_state_dict(path)).to(device=device, dtype=self.dtype)
+        self.scale = self.model.scale
+        # Lock - jedna síť na zařízení, dlaždice paralelizuje dávka, ne vlákna
+        self._lock = threading.Lock()
+
+    @torch.inference_mode()
+    def upscale(self, image: Image.Image, factor: int, cancel_token=None, tile: int = ESRGAN_TILE,
+                overlap: int = ESRGAN_TILE_OVERLAP, batch: int = ESRGAN_TILE_BATCH) -> Image.Image:
+        """Zvětší obrázek sítí a případně dorovná na požadovaný faktor (LANCZOS)."""
+        x = torch.from_numpy(np.asarray(image.convert("RGB"), dtype=np.float32) / 255.0).permute(2, 0, 1)
+        _, height, width = x.shape
+        tile_h, tile_w = min(tile, height), min(tile, width)
+        overlap = min(overlap, tile_h // 2, tile_w // 2)
+        step_h, step_w = tile_h - overlap, tile_w - overlap
+        s = self.scale
+
+        output = torch.zeros(3, height * s, width * s)
+        weight_sum = torch.zeros(1, height * s, width * s)
+        window = (_feather(tile_h * s, overlap * s)[:, None] * _feather(tile_w * s, overlap * s)[None, :])[None]
+
+        boxes = [(y, x0) for y in _positions(height, tile_h, step_h) for x0 in _positions(width, tile_w, step_w)]
+        with self._lock:
+            for i in range(0, len(boxes), batch):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                chunk = boxes[i:i + batch]
+                tiles = torch.stack([x[:, y:y + tile_h, x0:x0 + tile_w] for y, x0 in chunk])
+                result = self.model(tiles.to(device=self.device, dtype=self.dtype)).float().clamp_(0, 1).cpu()
+                for (y, x0), out_tile in zip(chunk, result):
+                    region = (slice(None), slice(y * s, (y + tile_h) * s), slice(x0 * s, (x0 + tile_w) * s))
+                    output[region] += out_tile * window
+                    weight_sum[region] += window
+
+        output = (output / weight_sum).permute(1, 2, 0).mul_(255.0).round_().to(torch.uint8).numpy()
+        upscaled = Image.fromarray(output)
+        target = (image.width * factor, image.height * factor)
+        if upscaled.size != target:
+            upscaled = upscaled.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        return upscaled
+
+
+_resident = OrderedDict()
+_resident_lock = threading.Lock()
+# Rozpracovaná načtení: klíč -> Event (ostatní žádosti o stejný model čekají na něj, ne na zámek)
+_loading = {}
+
+
+def _resident_key(path: str, device: str):
+    """Klíč podle obsahu souboru - přepsaný .pth se načte znovu."""
+    from result_cache import model_fingerprint
+
+    return model_fingerprint(path), device
+
+
+def is_resident(path: str, device: str = "cpu") -> bool:
+    """Je upscaler už načtený na zařízení? (admission pak nepočítá jeho váhy)"""
+    try:
+        key = _resident_key(path, device)
+    except OSError:
+        return False
+    with _resident_lock:
+        return key in _resident
+
+
+def get_upscaler(path: str, device: str = "cpu") -> ESRGANUpscaler:
+    """Rezidentní upscaler - načte se jednou, nejdéle nepoužitý se uvolní nad UPSCALER_RESIDENT."""
+    key = _resident_key(path, device)
+    while True:
+        with _resident_lock:
+            upscaler = _resident.get(key)
+            if upscaler is not None:
+                _resident.move_to_end(key)
+                return upscaler
+            loading = _loading.get(key)
+            if loading is None:
+                loading = _loading[key] = threading.Event()
+                break
+        # Stejný model už načítá jiné vlákno - po dokončení (i neúspěšném) se zkusí znovu
+        loading.wait()
+
+    upscaler = None
+    try:
+        # Čtení vah a přesun na zařízení mimo zámek - ostatní upscalery i admission neblokuje
+        print(f"🔄 Načítání upscaleru {os.path.basename(path)} na {device}...")
+        upscaler = ESRGANUpscaler(path, device)
+    finally:
+        with _resident_lock:
+            if upscaler is not None:
+                _resident[key] = upscaler
+                while len(_resident) > max(1, UPSCALER_RESIDENT):
+                    _resident.popitem(last=False)
+            del _loading[key]
+            loading.set()
+    if device.startswith("cuda"):
+        torch.cuda.empty_cache()
+    return upscaler
@@ -0,0 +1,181 @@
+"""
+Feature reuse akcelerace pro SDXL UNet
+
+Sousední kroky odšumování mají velmi podobné hluboké příznaky. Hluboké bloky
+UNetu se proto přepočítávají jen každých k kroků a mezi tím se aktualizují
+pouze mělké bloky (conv_in, první down blok a poslední up blok), které
+dostanou hluboké příznaky z posledního plného kroku.
+"""
+
+import time
+
+import numpy as np
+import torch
+from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+
+
+class FeatureReuseUNet:
+    """Obalí pipe.unet a cachuje výstup hlubokých bloků mezi kroky."""
+
+    def __init__(self, unet, cache_interval: int = 3):
+        self.unet = unet
+        self.cache_interval = max(1, int(cache_interval))
+        self.enabled = True
+        self.deep_features = None
+        self.step = 0
+        self.full_steps = 0
+        self.reused_steps = 0
+
+        # Původní forward může být instanční atribut (accelerate CPU offload hook)
+        self._had_instance_forward = 'forward' in unet.__dict__
+        self.original_forward = unet.forward
+
+        # Vstup posledního up bloku = výstup předposledního up bloku
+        self._hook = unet.up_blocks[-2].register_forward_hook(self._capture_deep_features)
+        unet.forward = self.forward
+
+    def _capture_deep_features(self, module, inputs, output):
+        self.deep_features = output
+
+    def reset(self):
+        """Vymaže cache a počítadla před dalším voláním pipeline."""
+        self.deep_features = None
+        self.step = 0
+        self.full_steps = 0
+        self.reused_steps = 0
+
+    def remove(self):
+        """Odpojí hook a obnoví původní forward UNetu."""
+        self._hook.remove()
+        if self._had_instance_forward:
+            self.unet.forward = self.original_forward
+        else:
+            del self.unet.forward
+        self.deep_features = None
+
+    def forward(self, sample, timestep, encoder_hidden_states=None, **kwargs):
+        reuse = (
+            self.enabled
+            and self.deep_features is not None
+            and self.step % self.cache_interval != 0
+            and self.deep_features.shape[0] == sample.shape[0]
+        )
+        self.step += 1
+
+        if not reuse:
+            self.full_steps += 1
+            return self.original_forward(sample, timestep, encoder_hidden_states=encoder_hidden_states, **kwargs)
+
+        self.reused_steps += 1
+        output = self._shallow_forward(
+            sample,
+            timestep,
+            encoder_hidden_states,
+            added_cond_kwargs=kwargs.get('added_cond_kwargs'),
+            cross_attention_kwargs=kwargs.get('cross_attention_kwargs'),
+        )
+        if kwargs.get('return_dict', True):
+            return UNet2DConditionOutput(sample=output)
+        return (output,)
+
+    def _time_embedding(self, sample, timestep, added_cond_kwargs):
+        """Časový embedding včetně SDXL text_time podmínky (jako UNet2DConditionModel.forward)."""
+        unet = self.unet
+        timesteps = timestep
+        if not torch.is_tensor(timesteps):
+            timesteps = torch.tensor([timesteps], dtype=torch.float32, device=sample.device)
+        elif timesteps.ndim == 0:
+            timesteps = timesteps[None].to(sample.device)
+        timesteps = timesteps.expand(sample.shape[0])
+
+        emb = unet.time_embedding(unet.time_proj(timesteps).to(dtype=sample.dtype))
+
+        if unet.config.addition_embed_type == "text_time":
+            text_embeds = added_cond_kwargs["text_embeds"]
+            time_embeds = unet.add_time_proj(added_cond_kwargs["time_ids"].flatten())
+            time_embeds = time_embeds.reshape((text_embeds.shape[0], -1))
+            add_embeds = torch.concat([text_embeds, time_embeds], dim=-1).to(emb.dtype)
+            emb = emb + unet.add_embedding(add_embeds)
+
+        if unet.time_embed_act is not None:
+            emb = unet.time_embed_act(emb)
+        return emb
+
+    def _shallow_forward(self, sample, timestep, encoder_hidden_states, added_cond_kwargs=None, cross_attention_kwargs=None):
+        """Přepočítá jen mělké bloky a použije hluboké příznaky z cache."""
+        unet = self.unet
+        emb = self._time_embedding(sample, timestep, added_cond_kwargs)
+
+        sample = unet.conv_in(sample)
+        down_block = unet.down_blocks[0]
+        if getattr(down_block, "has_cross_attention", False):
+            _, res_samples = down_block(
+                hidden_states=sample,
+                temb=emb,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+            )
+        else:
+            _, res_samples = down_block(hidden_states=sample, temb=emb)
+
+        # Poslední up blok spotřebuje skip connections z conv_in a prvního down bloku
+        up_block = unet.up_blocks[-1]
+        res_samples = ((sample,) + tuple(res_samples))[:len(up_block.resnets)]
+        if getattr(up_block, "has_cross_attention", False):
+            sample = up_block(
+                hidden_states=self.deep_features,
+                temb=emb,
+                res_hidden_states_tuple=res_samples,
+                encoder_hidden_states=encoder_hidden_states,
+                cross_attention_kwargs=cross_attention_kwargs,
+            )
+        else:
+            sample = up_block(hidden_states=self.deep_features, temb=emb, res_hidden_states_tuple=res_samples)
+
+        if unet.conv_norm_out is not None:
+            sample = unet.conv_norm_out(sample)
+            sample = unet.conv_act(sample)
+        return unet.conv_out(sample)
+
+
+def enable_feature_reuse(pipe, cache_interval: int = 3) -> FeatureReuseUNet:
+    """Zapne feature reuse na UNetu pipeline (interval 1 = každý krok plně)."""
+    return FeatureReuseUNet(pipe.unet, cache_interval)
+
+
+def image_psnr(image_a, image_b) -> float:
+    """PSNR dvou PIL obrázků v dB (inf pro identické obrázky)."""
+    a = np.asarray(image_a.convert("RGB"), dtype=np.float32)
+    b = np.asarray(image_b.convert("RGB").resize(image_a.size), dtype=np.float32)
+    mse = float(np.mean((a - b) ** 2))
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+
+def check_feature_reuse_quality(reuser: FeatureReuseUNet, render) -> dict:
+    """
+    Porovná výstup s feature reuse proti plnému výpočtu.
+
+    render() musí být deterministický (pevný seed) a vracet PIL obrázek.
+    """
+    reuser.enabled = False
+    reuser.reset()
+    start = time.time()
+    full_image = render()
+    full_time = time.time() - start
+
+    reuser.enabled = True
+    reuser.reset()
+    start = time.time()
+    fast_image = render()
+    fast_time = time.time() - start
+
+    return {
+        'psnr_db': image_psnr(full_image, fast_image),
+        'full_time_s': full_time,
+        'reuse_time_s': fast_time,
+        'speedup': full_time / fast_time if fast_time > 0 else 0.0,
+        'full_steps': reuser.full_steps,
+        'reused_steps': reuser.reused_steps,
+    }
@@ -0,0 +1,187 @@
+"""
+Parameter grid sweep pro ladění LoRA modelů
+
+Strength × CFG × steps × seed jako jedna úloha: model se načte jednou,
+vstupní obrázek i prázdný prompt se zakódují jednou a buňky se stejnými
+parametry (liší se jen seedem) běží v jedné dávce. Výsledkem jsou
+jednotlivé soubory a contact sheet.
+
+Inference se importuje až uvnitř funkcí, které ji spouštějí - UI (tenký
+klient bez torch) odsud sdílí parsování a rozpis gridu.
+"""
+
+import os
+import time
+import itertools
+from PIL import Image, ImageDraw
+from typing import List, Optional
+
+from config import OUTPUT_PATH
+
+# Maximální počet seedů v jednom volání pipeline
+GRID_MAX_BATCH = int(os.getenv('GRID_MAX_BATCH', '4'))
+
+
+def parse_value_list(text: str, cast=float) -> list:
+    """Převede text "0.4, 0.6; 0.8" na seznam hodnot bez duplicit."""
+    values = []
+    for part in text.replace(';', ',').split(','):
+        part = part.strip()
+        if part:
+            value = cast(part)
+            if value not in values:
+                values.append(value)
+    return values
+
+
+def expand_grid(strengths, guidance_scales, steps_list, seeds) -> List[dict]:
+    """Rozepíše kartézský součin parametrů na jednotlivé buňky."""
+    cells = []
+    for strength, guidance_scale, steps, seed in itertools.product(strengths, guidance_scales, steps_list, seeds):
+        cells.append({
+            'index': len(cells),
+            'strength': strength,
+            'guidance_scale': guidance_scale,
+            'num_inference_steps': steps,
+            'seed': seed,
+        })
+    return cells
+
+
+def group_cells(cells: List[dict], max_batch: int = GRID_MAX_BATCH) -> List[List[dict]]:
+    """Seskupí buňky lišící se jen seedem do dávek pro jedno volání pipeline."""
+    groups = {}
+    for cell in cells:
+        key = (cell['strength'], cell['guidance_scale'], cell['num_inference_steps'])
+        groups.setdefault(key, []).append(cell)
+
+    size = max(1, max_batch)
+    batches = []
+    for group in groups.values():
+        for start in range(0, len(group), size):
+            batches.append(group[start:start + size])
+    return batches
+
+
+def build_contact_sheet(cells: List[dict], columns: int, thumb_size: int = 256) -> Image.Image:
+    """Sestaví contact sheet - řádky jsou kombinace parametrů, sloupce seedy."""
+    label_height = 18
+    rows = (len(cells) + columns - 1) // columns
+    sheet = Image.new("RGB", (columns * thumb_size, rows * (thumb_size + label_height)), "white")
+    draw = ImageDraw.Draw(sheet)
+
+    for position, cell in enumerate(sorted(cells, key=lambda c: c['index'])):
+        row, col = divmod(position, columns)
+        x = col * thumb_size
+        y = row * (thumb_size + label_height)
+
+        thumb = cell['image'].copy()
+        thumb.thumbnail((thumb_size, thumb_size), Image.Resampling.LANCZOS)
+        sheet.paste(thumb, (x + (thumb_size - thumb.width) // 2, y + (thumb_size - thumb.height) // 2))
+
+        label = (f"s={cell['strength']} cfg={cell['guidance_scale']} "
+                 f"st={cell['num_inference_steps']} seed={cell['seed']}")
+        draw.text((x + 4, y + thumb_size + 3), label, fill="black")
+
+    return sheet
+
+
+def run_parameter_grid_on_pipe(pipe, input_image, strengths, guidance_scales, steps_list, seeds, progress_callback,
+                               output_dir: Optional[str] = None, max_batch: int = GRID_MAX_BATCH, cancel_token=None) -> dict:
+    """
+    Spustí celý grid nad již načtenou pipeline (např. rezidentní ve workeru).
+
+    Vrací slovník s buňkami (parametry, obrázek, cesta), contact sheetem
+    a časy jednotlivých fází.
+    """
+    from inference import denoising_steps, fit_to_bucket, encode_image_latents, encode_empty_prompt, run_img2img_batch
+
+    cells = expand_grid(strengths, guidance_scales, steps_list, seeds)
+    if not cells:
+        raise ValueError("Grid neobsahuje žádné kombinace parametrů")
+
+    batches = group_cells(cells, max_batch)
+    total_steps = sum(denoising_steps(b[0]['strength'], b[0]['num_inference_steps']) for b in batches)
+    timings = {}
+
+    output_dir = output_dir or os.path.join(OUTPUT_PATH, "grid", time.strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Společná práce pro všechny buňky - jedno zakódování obrázku a promptu
+    start = time.time()
+    image_latents = encode_image_latents(pipe, fit_to_bucket(input_image))
+    prompt_kwargs = encode_empty_prompt(pipe)
+    timings['encode_s'] = time.time() - start
+
+    progress_callback(0.6, f"Grid: {len(cells)} buněk v {len(batches)} dávkách...")
+    start = time.time()
+    done_steps = 0
+    for batch_index, batch in enumerate(batches):
+        params = batch[0]
+        batch_steps = denoising_steps(params['strength'], params['num_inference_steps'])
+
+        def callback_fn(step, timestep, latents):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            # Mapování kroků celého gridu na progress 0.6 - 0.95
+            progress_callback(0.6 + 0.35 * (done_steps + step) / max(1, total_steps))
+            return latents
+
+        progress_callback(0.6 + 0.35 * done_steps / max(1, total_steps),
+                          f"Grid dávka {batch_index + 1}/{len(batches)}...")
+        images = run_img2img_batch(
+            pipe,
+            image_latents,
+            prompt_kwargs,
+            [cell['seed'] for cell in batch],
+            params['strength'],
+            params['guidance_scale'],
+            params['num_inference_steps'],
+            callback=callback_fn,
+        )
+        for cell, image in zip(batch, images):
+            cell['image'] = image
+            cell['path'] = os.path.join(
+                output_dir,
+                f"cell_{cell['index']:03d}_s{cell['strength']}_cfg{cell['guidance_scale']}"
+                f"_st{cell['num_inference_steps']}_seed{cell['seed']}.png"
+            )
+            image.save(cell['path'])
+        done_steps += batch_steps
+    timings['denoise_s'] = time.time() - start
+
+    contact_sheet = build_contact_sheet(cells, columns=len(seeds))
+    contact_sheet_path = os.path.join(output_dir, "contact_sheet.png")
+    contact_sheet.save(contact_sheet_path)
+    progress_callback(1.0)
+
+    return {
+        'cells': cells,
+        'contact_sheet': contact_sheet,
+        'contact_sheet_path': contact_sheet_path,
+        'output_dir': output_dir,
+        'timings': timings,
+        'total_denoising_steps': total_steps,
+    }
+
+
+def run_parameter_grid(input_image, model_path, model_type, strengths, guidance_scales, steps_list, seeds,
+                       progress_callback, clip_skip=2, sampler="DPMSolverMultistepScheduler",
+                       output_dir: Optional[str] = None, max_batch: int = GRID_MAX_BATCH) -> dict:
+    """Načte model jednou a spustí nad ním celý grid."""
+    from inference import load_pipeline, free_memory
+
+    progress_callback(0.1)
+    start = time.time()
+    pipe, device = load_pipeline(model_path, model_type, clip_skip=clip_skip, sampler=sampler, progress_callback=progress_callback)
+    load_time = time.time() - start
+
+    try:
+        result = run_parameter_grid_on_pipe(pipe, input_image, strengths, guidance_scales, steps_list, seeds,
+                                            progress_callback, output_dir=output_dir, max_batch=max_batch)
+    finally:
+        del pipe
+        free_memory(device)
+
+    result['timings']['load_s'] = load_time
+    return result
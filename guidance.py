@@ -0,0 +1,127 @@
+"""
+Guidance fast paths pro classifier-free guidance
+
+S prázdným promptem a vynulovanými negativními embeddingy SDXL jsou podmíněná
+a nepodmíněná větev UNetu téměř totožné, takže CFG zdvojnásobuje výpočet
+bez užitku. Režimy:
+
+- "standard": běžné CFG (při guidance_scale <= 1 jen jeden průchod)
+- "truncate": nepodmíněná větev se po zadaném podílu kroků přestane počítat
+- "no_cfg_empty_prompt": pro prázdný prompt se CFG vypne úplně
+"""
+
+from typing import Optional
+
+import torch
+from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+
+from config import GUIDANCE_MODES
+
+
+def resolve_guidance(prompt: str, guidance_scale: float, mode: str = "standard") -> float:
+    """Vrátí efektivní guidance_scale pro daný režim (1.0 = jeden průchod UNetem)."""
+    if mode == "no_cfg_empty_prompt" and not prompt:
+        return 1.0
+    return guidance_scale
+
+
+class GuidanceController:
+    """Obalí pipe.unet, počítá vyhodnocení UNetu a zkracuje CFG po zadaném kroku."""
+
+    def __init__(self, unet, truncate_after_step=None, mode: str = "standard", cfg_fraction: float = 1.0):
+        self.unet = unet
+        self.truncate_after_step = truncate_after_step
+        self.mode = mode
+        self.cfg_fraction = cfg_fraction
+        self.step = 0
+        self.unet_evaluations = 0
+        self.baseline_evaluations = 0
+
+        # Původní forward může být instanční atribut (accelerate hook nebo feature reuse)
+        self._had_instance_forward = 'forward' in unet.__dict__
+        self.original_forward = unet.forward
+        unet.forward = self.forward
+
+    def reset(self, total_steps: Optional[int] = None):
+        """
+        Vynuluje počítadlo kroků před dalším voláním pipeline (statistiky zůstávají).
+        S total_steps se práh zkrácení CFG přepočítá pro průchod s jiným počtem
+        kroků (druhý průchod hires fix).
+        """
+        self.step = 0
+        if total_steps is not None:
+            self.truncate_after_step = truncate_after_step(self.mode, total_steps, self.cfg_fraction)
+
+    def remove(self):
+        """Obnoví původní forward UNetu."""
+        if self._had_instance_forward:
+            self.unet.forward = self.original_forward
+        else:
+            del self.unet.forward
+
+    def forward(self, sample, timestep, encoder_hidden_states=None, **kwargs):
+        step = self.step
+        self.step += 1
+        batch = sample.shape[0]
+
+        truncate = (
+            self.truncate_after_step is not None
+            and step >= self.truncate_after_step
+            and batch % 2 == 0
+            and encoder_hidden_states is not None
+            and encoder_hidden_states.shape[0] == batch
+        )
+        # Baseline = celá dávka bez zkracování (jednoprůchodovou cestu řeší stats())
+        self.baseline_evaluations += batch
+        if not truncate:
+            self.unet_evaluations += batch
+            return self.original_forward(sample, timestep, encoder_hidden_states=encoder_hidden_states, **kwargs)
+
+        # Pipeline skládá dávku jako [nepodmíněná, podmíněná] - počítáme jen druhou půlku
+        half = batch // 2
+        cond_kwargs = dict(kwargs)
+        added_cond_kwargs = kwargs.get('added_cond_kwargs')
+        if added_cond_kwargs:
+            cond_kwargs['added_cond_kwargs'] = {
+                key: value[half:] if torch.is_tensor(value) and value.shape[0] == batch else value
+                for key, value in added_cond_kwargs.items()
+            }
+        cond_kwargs['return_dict'] = False
+        if torch.is_tensor(timestep) and timestep.ndim > 0 and timestep.shape[0] == batch:
+            timestep = timestep[half:]
+
+        self.unet_evaluations += half
+        noise_cond = self.original_forward(
+            sample[half:], timestep, encoder_hidden_states=encoder_hidden_states[half:], **cond_kwargs
+        )[0]
+
+        # uncond == cond => noise_uncond + g * (cond - uncond) == cond
+        output = torch.cat([noise_cond, noise_cond])
+        if kwargs.get('return_dict', True):
+            return UNet2DConditionOutput(sample=output)
+        return (output,)
+
+    def stats(self, mode: str, effective_guidance_scale: float) -> dict:
+        """Souhrn ušetřených vyhodnocení UNetu (počítáno ve vzorcích dávky)."""
+        baseline = self.baseline_evaluations
+        if effective_guidance_scale <= 1.0:
+            # Jednoprůchodová cesta - plné CFG by mělo dvojnásobnou dávku
+            baseline *= 2
+        return {
+            'mode': mode,
+            'unet_evaluations': self.unet_evaluations,
+            'baseline_evaluations': baseline,
+            'saved_evaluations': baseline - self.unet_evaluations,
+        }
+
+
+def truncate_after_step(mode: str, total_steps: int, cfg_fraction: float = 1.0) -> Optional[int]:
+    """Krok, od kterého se v režimu "truncate" nepočítá nepodmíněná větev (None = nikdy)."""
+    if mode == "truncate" and cfg_fraction < 1.0:
+        return max(0, int(round(total_steps * cfg_fraction)))
+    return None
+
+
+def enable_guidance_fast_path(pipe, mode: str, total_steps: int, cfg_fraction: float = 1.0) -> GuidanceController:
+    """Zapne počítání (a v režimu "truncate" zkracování) CFG na UNetu pipeline."""
+    return GuidanceController(pipe.unet, truncate_after_step(mode, total_steps, cfg_fraction), mode, cfg_fraction)
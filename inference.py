@@ -0,0 +1,609 @@
+"""
+Inference jádro pro AI Style Transfer
+
+Výběr zařízení, načítání pipeline a generování bez závislosti na Streamlit UI,
+aby ho mohla sdílet aplikace, grid sweep i další vstupní body.
+"""
+
+import os
+import gc
+import argparse
+import platform
+import psutil
+import torch
+from PIL import Image
+from diffusers import StableDiffusionXLImg2ImgPipeline
+from diffusers import (
+    DPMSolverMultistepScheduler,
+    EulerDiscreteScheduler,
+    EulerAncestralDiscreteScheduler,
+    DDIMScheduler,
+    LMSDiscreteScheduler,
+    PNDMScheduler
+)
+from safetensors import safe_open
+from typing import Optional, List
+
+from feature_reuse import enable_feature_reuse, check_feature_reuse_quality, image_psnr
+from guidance import resolve_guidance, enable_guidance_fast_path
+from noise import variant_seeds, make_generators, install_batch_stable_noise, check_batch_invariance
+from preprocess import get_resolution_bucket, fit_to_bucket
+from upscaling import get_upscale_stage
+from config import (
+    FORCE_CPU,
+    MAX_MEMORY_GB,
+    ENABLE_ATTENTION_SLICING,
+    ENABLE_CPU_OFFLOAD,
+    LORA_MODELS_PATH,
+    FULL_MODELS_PATH,
+    OUTPUT_PATH,
+    HF_HOME,
+    BASE_MODEL,
+    MAX_BATCH_SIZE,
+    DEFAULT_PARAMS,
+)
+
+# Dostupné schedulery
+SCHEDULER_MAP = {
+    "DPMSolverMultistepScheduler": DPMSolverMultistepScheduler,
+    "EulerDiscreteScheduler": EulerDiscreteScheduler,
+    "EulerAncestralDiscreteScheduler": EulerAncestralDiscreteScheduler,
+    "DDIMScheduler": DDIMScheduler,
+    "LMSDiscreteScheduler": LMSDiscreteScheduler,
+    "PNDMScheduler": PNDMScheduler
+}
+
+def _no_progress(progress: float, text: str = "") -> None:
+    pass
+
+
+# Funkce pro detekci hardware
+def get_system_info():
+    """Získá informace o systému a dostupném hardware"""
+    info = {
+        'platform': platform.system(),
+        'cpu_count': psutil.cpu_count(),
+        'memory_gb': psutil.virtual_memory().total / (1024**3),
+        'cuda_available': torch.cuda.is_available(),
+        'cuda_device_count': torch.cuda.device_count() if torch.cuda.is_available() else 0,
+        'cuda_device_name': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        'cuda_memory_gb': torch.cuda.get_device_properties(0).total_memory / (1024**3) if torch.cuda.is_available() else 0
+    }
+    return info
+
+def get_optimal_device():
+    """Určí optimální zařízení pro inference s fallback pro CUDA chyby"""
+    if FORCE_CPU:
+        return "cpu", "Vynuceno CPU"
+
+    if not torch.cuda.is_available():
+        return "cpu", "CUDA není dostupná"
+
+    try:
+        # Test CUDA funkčnosti s RTX 5090 fallback
+        test_tensor = torch.randn(10, device='cuda')
+        _ = test_tensor + 1  # Jednoduchý test operace
+        gpu_memory = torch.cuda.get_device_properties(0).total_memory / (1024**3)
+        if gpu_memory < 4:
+            return "cpu", f"Nedostatek GPU paměti ({gpu_memory:.1f} GB < 4 GB)"
+
+        return "cuda", f"GPU: {torch.cuda.get_device_name(0)} ({gpu_memory:.1f} GB)"
+    except Exception as e:
+        # Fallback na CPU při CUDA chybách (RTX 5090 kompatibilita)
+        return "cpu", f"CUDA chyba - fallback na CPU: {str(e)[:30]}..."
+
+def get_inference_devices(spec: str = "auto") -> List[str]:
+    """
+    Seznam zařízení pro workery. "auto" = všechna CUDA GPU (nebo CPU, pokud
+    CUDA nefunguje), jinak čárkami oddělený seznam, např. "cuda:0,cuda:1" nebo "cpu,cpu".
+    """
+    if spec.strip().lower() != "auto":
+        return [device.strip() for device in spec.split(',') if device.strip()]
+    device, _ = get_optimal_device()
+    if device == "cuda":
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return ["cpu"]
+
+# Funkce pro detekci typu modelu
+def detect_model_type(file_path):
+    """Detekuje zda je soubor LoRA model nebo full safetensors model"""
+    try:
+        # Stačí názvy tensorů z hlavičky - celý soubor se do RAM nenačítá
+        with safe_open(file_path, framework="pt") as f:
+            keys = list(f.keys())
+
+        # Kontrola velikosti souboru
+        file_size = os.path.getsize(file_path) / (1024 * 1024 * 1024)  # GB
+
+        # LoRA modely jsou obvykle menší (< 1GB) a obsahují specifické klíče
+        lora_keys = ['lora_unet', 'lora_te', 'alpha', 'rank']
+        has_lora_keys = any(any(lora_key in key for lora_key in lora_keys) for key in keys)
+
+        # Full modely jsou větší a obsahují kompletní váhy
+        full_model_keys = ['model.diffusion_model', 'first_stage_model', 'cond_stage_model']
+        has_full_keys = any(any(full_key in key for full_key in full_model_keys) for key in keys)
+
+        if has_lora_keys or file_size < 1.0:
+            return "lora"
+        elif has_full_keys or file_size > 2.0:
+            return "full_model"
+        else:
+            # Pokud nejsme si jisti, zkusíme podle velikosti
+            return "lora" if file_size < 1.0 else "full_model"
+
+    except Exception as e:
+        print(f"Warning: Nelze detekovat typ modelu: {e}")
+        return "unknown"
+
+def set_scheduler(pipe, sampler):
+    """Přepne scheduler rezidentní pipeline (levné, bez nového načtení modelu)."""
+    if sampler in SCHEDULER_MAP and type(pipe.scheduler) is not SCHEDULER_MAP[sampler]:
+        pipe.scheduler = SCHEDULER_MAP[sampler].from_config(pipe.scheduler.config)
+
+def load_pipeline(model_path, model_type, clip_skip=2, sampler="DPMSolverMultistepScheduler", progress_callback=None, device: Optional[str] = None):
+    """
+    Načte SDXL img2img pipeline pro LoRA nebo full model a vrátí (pipe, device).
+    Bez zadaného device ("cuda:1", "cpu", ...) se použije get_optimal_device().
+    """
+    progress_callback = progress_callback or _no_progress
+
+    if device is None:
+        # Použití optimální device detekce s fallback
+        device, device_reason = get_optimal_device()
+
+        # Logování device informací
+        if "chyba" in device_reason.lower():
+            print(f"Warning: {device_reason}")
+    is_cuda = device.startswith("cuda")
+    torch_dtype = torch.float16 if is_cuda else torch.float32
+
+    # Pokročilé vyčištění paměti před načtením
+    if is_cuda:
+        torch.cuda.empty_cache()
+        torch.cuda.synchronize(device)
+    gc.collect()
+
+    # Nastavení memory efficient attention pro velké modely
+    os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:512"
+
+    # Optimalizace pro velké modely na základě environment variables
+    enable_memory_efficient_attention = ENABLE_ATTENTION_SLICING
+
+    # CPU offload dává smysl jen s GPU - model se přesouvá na zařízení po částech
+    if not is_cuda:
+        enable_cpu_offload = False
+    elif ENABLE_CPU_OFFLOAD == 'auto':
+        enable_cpu_offload = torch.cuda.get_device_properties(torch.device(device)).total_memory < MAX_MEMORY_GB * 1024**3
+    else:
+        enable_cpu_offload = ENABLE_CPU_OFFLOAD.lower() == 'true'
+    gpu_id = torch.device(device).index or 0
+
+    # Progress tracking - načítání modelu
+    progress_callback(0.2)
+
+    if model_type == "lora":
+        # Robustnější CUDA handling pro RTX 5090
+        try:
+            # Načtení base modelu pro LoRA
+            pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
+                BASE_MODEL,
+                torch_dtype=torch_dtype,
+                variant="fp16" if is_cuda else None,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+                clip_skip=clip_skip
+            )
+        except RuntimeError as cuda_error:
+            if "CUDA" in str(cuda_error):
+                # Fallback na CPU při CUDA chybě
+                print(f"Warning: CUDA chyba při načítání modelu, přepínám na CPU: {str(cuda_error)[:50]}...")
+                device = "cpu"
+                is_cuda = False
+                enable_cpu_offload = False
+                torch_dtype = torch.float32
+                pipe = StableDiffusionXLImg2ImgPipeline.from_pretrained(
+                    BASE_MODEL,
+                    torch_dtype=torch_dtype,
+                    use_safetensors=True,
+                    low_cpu_mem_usage=True,
+                    clip_skip=clip_skip
+                )
+            else:
+                raise cuda_error
+
+        # Progress tracking - optimalizace
+        progress_callback(0.4)
+
+        # Memory efficient optimizations
+        if enable_memory_efficient_attention:
+            pipe.enable_attention_slicing()
+            pipe.enable_vae_slicing()
+
+        if enable_cpu_offload:
+            pipe.enable_model_cpu_offload(gpu_id=gpu_id)
+        else:
+            pipe = pipe.to(device)
+
+        # Progress tracking - načítání LoRA
+        progress_callback(0.5)
+
+        # Načtení LoRA modelu - robustnější přístup
+        try:
+            # Pokus o načtení jako adresář s adapter_config.json
+            if os.path.isdir(model_path):
+                pipe.load_lora_weights(model_path)
+            else:
+                # Načtení .safetensors souboru přímo
+                pipe.load_lora_weights(model_path, adapter_name="lora_adapter")
+        except Exception as e:
+            try:
+                # Fallback - načtení pomocí from_single_file
+                pipe.load_lora_weights(model_path, weight_name=os.path.basename(model_path))
+            except Exception as e2:
+                print(f"Warning: Nelze načíst LoRA model: {e2}")
+                # Pokračovat bez LoRA
+                pass
+
+    elif model_type == "full_model":
+        # Načtení full safetensors modelu
+        try:
+            pipe = StableDiffusionXLImg2ImgPipeline.from_single_file(
+                model_path,
+                torch_dtype=torch_dtype,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+                clip_skip=clip_skip
+            )
+
+            # Progress tracking - optimalizace
+            progress_callback(0.5)
+
+            # Memory efficient optimizations pro full modely
+            if enable_memory_efficient_attention:
+                pipe.enable_attention_slicing()
+                pipe.enable_vae_slicing()
+
+            if enable_cpu_offload:
+                pipe.enable_model_cpu_offload(gpu_id=gpu_id)
+            else:
+                pipe = pipe.to(device)
+        except Exception as e:
+            raise RuntimeError(f"Chyba při načítání full modelu: {e}") from e
+    else:
+        raise ValueError("Nepodporovaný typ modelu")
+
+    # Nastavení scheduleru
+    set_scheduler(pipe, sampler)
+
+    # Šum z CPU generátorů po vzorcích - stejný seed = stejný latent na každém zařízení
+    install_batch_stable_noise()
+
+    return pipe, device
+
+def denoising_steps(strength: float, num_inference_steps: int) -> int:
+    """Počet skutečně provedených kroků img2img (stejně jako get_timesteps v diffusers)."""
+    return min(int(num_inference_steps * strength), num_inference_steps)
+
+def free_memory(device):
+    """Vyčistí paměť po uvolnění pipeline (volající musí zahodit svou referenci)."""
+    if device.startswith("cuda"):
+        with torch.cuda.device(device):
+            torch.cuda.empty_cache()
+    gc.collect()
+
+def encode_image_latents(pipe, image: Image.Image):
+    """
+    Zakóduje vstupní obrázek VAE encoderem do škálovaných latentů.
+
+    Používá střed posteriorního rozdělení (mode), takže výsledek je
+    deterministický a lze ho sdílet mezi více voláními pipeline.
+    """
+    device = pipe._execution_device
+    pixels = pipe.image_processor.preprocess(image)
+    vae = pipe.vae
+    needs_upcast = vae.dtype == torch.float16 and vae.config.force_upcast
+    if needs_upcast:
+        vae.to(dtype=torch.float32)
+
+    with torch.no_grad():
+        pixels = pixels.to(device=device, dtype=vae.dtype)
+        latents = vae.encode(pixels).latent_dist.mode()
+
+    if needs_upcast:
+        vae.to(dtype=torch.float16)
+    latents = vae.config.scaling_factor * latents
+    return latents.to(dtype=pipe.unet.dtype)
+
+def encode_empty_prompt(pipe):
+    """Zakóduje prázdný prompt jednou - vrací kwargs pro volání pipeline."""
+    with torch.no_grad():
+        (
+            prompt_embeds,
+            negative_prompt_embeds,
+            pooled_prompt_embeds,
+            negative_pooled_prompt_embeds,
+        ) = pipe.encode_prompt(
+            "",
+            device=pipe._execution_device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=True,
+        )
+    return {
+        'prompt_embeds': prompt_embeds,
+        'negative_prompt_embeds': negative_prompt_embeds,
+        'pooled_prompt_embeds': pooled_prompt_embeds,
+        'negative_pooled_prompt_embeds': negative_pooled_prompt_embeds,
+    }
+
+def run_img2img_batch(pipe, image_latents, prompt_kwargs, seeds: List[int], strength, guidance_scale, num_inference_steps, callback=None,
+                      output_type: str = "pil"):
+    """
+    Jedno volání pipeline pro více seedů nad předem zakódovaným obrázkem.
+
+    Každý vzorek má vlastní CPU generátor, takže výsledek nezávisí na zařízení,
+    velikosti dávky ani pozici v dávce. S output_type="latent" vrací škálované
+    latenty bez dekódování VAE.
+    """
+    generators = make_generators(seeds)
+    return pipe(
+        image=image_latents,
+        strength=strength,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        num_images_per_prompt=len(seeds),
+        generator=generators,
+        callback=callback,
+        callback_steps=1,
+        output_type=output_type,
+        **prompt_kwargs
+    ).images
+
+def upscale_latents(latents, scale: float):
+    """
+    Zvětší latenty (bilineárně) pro druhý průchod hires fix. Rozměry se
+    zaokrouhlí na násobky 8 latentních pixelů (64 px obrazu) kvůli UNetu.
+    """
+    height, width = latents.shape[-2:]
+    target = (max(8, int(round(height * scale / 8)) * 8), max(8, int(round(width * scale / 8)) * 8))
+    return torch.nn.functional.interpolate(latents.float(), size=target, mode="bilinear", align_corners=False).to(latents.dtype)
+
+def verify_batch_invariance(pipe, image_latents, prompt_kwargs, seeds: List[int], strength, guidance_scale, num_inference_steps) -> dict:
+    """
+    Regresní kontrola: dávkové a samostatné generování musí dát stejné obrázky.
+
+    Šum je identický bit po bitu (noise.check_batch_invariance); zbylý rozdíl
+    může pocházet jen z numeriky dávkových kernelů, proto se vrací i PSNR.
+    """
+    batched = run_img2img_batch(pipe, image_latents, prompt_kwargs, seeds, strength, guidance_scale, num_inference_steps)
+    single = [
+        run_img2img_batch(pipe, image_latents, prompt_kwargs, [s], strength, guidance_scale, num_inference_steps)[0]
+        for s in seeds
+    ]
+    psnr_values = [image_psnr(a, b) for a, b in zip(single, batched)]
+    return {
+        'noise_identical': check_batch_invariance(seeds, tuple(image_latents.shape[1:])),
+        'min_psnr_db': min(psnr_values),
+        'psnr_db': psnr_values,
+    }
+
+def _check_cancelled(cancel_token):
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+def generate_batch(pipe, inputs, params: dict, progress_callback=None, report: Optional[dict] = None, max_batch: int = MAX_BATCH_SIZE,
+                   cancel_token=None):
+    """
+    Vygeneruje varianty pro jeden nebo více vstupů se stejnými parametry.
+
+    inputs je seznam dvojic (obrázek v bucketu, seedy). Vzorky všech vstupů se
+    skládají do dávek po max_batch; vrací seznam výsledků pro každý vstup.
+    cancel_token se kontroluje v každém kroku odšumování a mezi fázemi.
+    S hires_scale > 1 běží dvouprůchodový hires fix nad latenty.
+    """
+    progress_callback = progress_callback or _no_progress
+    params = dict(DEFAULT_PARAMS, **params)
+    strength = params['strength']
+    num_inference_steps = params['num_inference_steps']
+    total_steps = max(1, denoising_steps(strength, num_inference_steps))
+
+    hires = params['hires_scale'] > 1.0
+    hires_total_steps = max(1, denoising_steps(params['hires_strength'], params['hires_steps']))
+
+    set_scheduler(pipe, params['sampler'])
+    reuser = None
+    guidance = None
+    try:
+        # Feature reuse - hluboké bloky UNetu jen každých k kroků
+        if params['feature_reuse_interval'] > 1:
+            if getattr(pipe, 'onnx_backend', None) is not None:
+                # Bloky UNetu jsou v ONNX grafu - feature reuse by běžel eager
+                print("Warning: Feature reuse není dostupný s ONNX backendem")
+            else:
+                reuser = enable_feature_reuse(pipe, params['feature_reuse_interval'])
+
+        # Guidance fast path - obaluje feature reuse, proto se zapíná až po něm
+        prompt = ""
+        effective_guidance_scale = resolve_guidance(prompt, params['guidance_scale'], params['guidance_mode'])
+        guidance = enable_guidance_fast_path(pipe, params['guidance_mode'], total_steps, params['cfg_fraction'])
+
+        # Společné kódování promptu; každý vstup se kóduje jen jednou pro všechny své seedy
+        prompt_kwargs = encode_empty_prompt(pipe)
+        samples = []
+        for input_index, (image, seeds) in enumerate(inputs):
+            _check_cancelled(cancel_token)
+            image_latents = encode_image_latents(pipe, image)
+            samples.extend((input_index, image_latents, seed) for seed in seeds)
+
+        outputs = [[] for _ in inputs]
+        max_batch = max(1, max_batch)
+        for start in range(0, len(samples), max_batch):
+            chunk = samples[start:start + max_batch]
+
+            # Callback pro progress bar během generování (0.6 - 0.85)
+            def callback_fn(step, timestep, latents):
+                _check_cancelled(cancel_token)
+                done = start + len(chunk) * min(1.0, (step + 1) / total_steps)
+                progress_callback(0.6 + 0.25 * done / len(samples))
+                return latents
+
+            def refine_callback(step, timestep, latents):
+                _check_cancelled(cancel_token)
+                return latents
+
+            _check_cancelled(cancel_token)
+            progress_callback(0.6 + 0.25 * start / len(samples), f"Generuji {start + 1}-{start + len(chunk)}/{len(samples)}...")
+            if reuser is not None:
+                reuser.reset()
+            guidance.reset(total_steps)
+
+            chunk_seeds = [sample[2] for sample in chunk]
+            images = run_img2img_batch(
+                pipe,
+                torch.cat([sample[1] for sample in chunk]),
+                prompt_kwargs,
+                chunk_seeds,
+                strength,
+                effective_guidance_scale,
+                num_inference_steps,
+                callback=callback_fn,
+                output_type="latent" if hires else "pil"
+            )
+            if hires:
+                # Hires fix - latenty prvního průchodu se zvětší v latentním prostoru a krátký
+                # druhý průchod s nízkým strength je doladí; VAE dekóduje jen konečný výsledek
+                _check_cancelled(cancel_token)
+                progress_callback(0.6 + 0.25 * (start + len(chunk)) / len(samples), f"Hires fix {start + 1}-{start + len(chunk)}/{len(samples)}...")
+                latents = upscale_latents(images, params['hires_scale'])
+                if reuser is not None:
+                    reuser.reset()
+                # Druhý průchod má vlastní počet kroků - práh zkrácení CFG z něj
+                guidance.reset(hires_total_steps)
+                images = run_img2img_batch(
+                    pipe,
+                    latents,
+                    prompt_kwargs,
+                    chunk_seeds,
+                    params['hires_strength'],
+                    effective_guidance_scale,
+                    params['hires_steps'],
+                    callback=refine_callback
+                )
+                if report is not None:
+                    report['hires'] = {
+                        'scale': params['hires_scale'],
+                        'strength': params['hires_strength'],
+                        'steps': hires_total_steps,
+                        'first_pass_size': [chunk[0][1].shape[-1] * pipe.vae_scale_factor, chunk[0][1].shape[-2] * pipe.vae_scale_factor],
+                        'final_size': list(images[0].size),
+                    }
+            for (input_index, _, _), image in zip(chunk, images):
+                outputs[input_index].append(image)
+
+        guidance_stats = guidance.stats(params['guidance_mode'], effective_guidance_scale)
+        if report is not None:
+            report['guidance'] = guidance_stats
+        guidance.remove()
+        guidance = None
+
+        # Kontrola kvality feature reuse proti plnému výpočtu (stejný seed)
+        if reuser is not None and params['feature_reuse_check'] and samples:
+            _check_cancelled(cancel_token)
+            progress_callback(0.85, "Porovnávám s plným výpočtem...")
+            _, image_latents, check_seed = samples[0]
+            quality = check_feature_reuse_quality(reuser, lambda: run_img2img_batch(
+                pipe,
+                image_latents,
+                prompt_kwargs,
+                [check_seed],
+                strength,
+                effective_guidance_scale,
+                num_inference_steps
+            )[0])
+            if report is not None:
+                report['feature_reuse'] = quality
+
+        return outputs
+
+    finally:
+        # Odpojení obalů UNetu v opačném pořadí, než byly zapnuty
+        if guidance is not None:
+            guidance.remove()
+        if reuser is not None:
+            reuser.remove()
+
+def upscale_images(results, upscale_factor, progress_callback=None, cancel_token=None, upscaler="", device="cpu"):
+    """Upscaling výsledků (LANCZOS, nebo naučený upscaler) ve stupni upscalingu."""
+    progress_callback = progress_callback or _no_progress
+    if upscale_factor <= 1:
+        return results
+
+    progress_callback(0.9, "Upscaling obrázků...")
+    upscaled_results, _ = get_upscale_stage().run(results, upscale_factor, cancel_token, progress_callback, upscaler, device)
+    return upscaled_results
+
+# Funkce pro aplikaci stylu na vstupní obrázek
+def apply_style(input_image, model_path, model_type, strength, guidance_scale, num_inference_steps, progress_callback, clip_skip=2, seed=None, upscale_factor=1, num_images=1, sampler="DPMSolverMultistepScheduler", variance_seed=None, variance_strength=0.0, feature_reuse_interval=1, feature_reuse_check=False, guidance_mode="standard", cfg_fraction=1.0, report: Optional[dict] = None, cancel_token=None, upscaler="", hires_scale=1.0, hires_strength=0.35, hires_steps=20):
+    # Progress tracking - začátek
+    progress_callback(0.1)
+
+    device = get_optimal_device()[0]
+    try:
+        pipe, device = load_pipeline(model_path, model_type, clip_skip=clip_skip, sampler=sampler, progress_callback=progress_callback)
+
+        # Progress tracking - příprava generování
+        progress_callback(0.6, f"Generuji {num_images} variant...")
+
+        seeds = variant_seeds(seed, variance_seed, num_images)
+        if report is not None:
+            report['seeds'] = seeds
+
+        params = {
+            'strength': strength,
+            'guidance_scale': guidance_scale,
+            'num_inference_steps': num_inference_steps,
+            'sampler': sampler,
+            'feature_reuse_interval': feature_reuse_interval,
+            'feature_reuse_check': feature_reuse_check,
+            'guidance_mode': guidance_mode,
+            'cfg_fraction': cfg_fraction,
+            'hires_scale': hires_scale,
+            'hires_strength': hires_strength,
+            'hires_steps': hires_steps,
+        }
+        results = generate_batch(pipe, [(fit_to_bucket(input_image), seeds)], params, progress_callback, report,
+                                 cancel_token=cancel_token)[0]
+
+        # Progress tracking - generování dokončeno
+        progress_callback(0.85)
+
+        # Upscaling pokud je povoleno
+        results = upscale_images(results, upscale_factor, progress_callback, cancel_token, upscaler, device)
+
+        # Progress tracking - dokončeno
+        progress_callback(1.0)
+
+        # Vrátíme první obrázek pro zpětnou kompatibilitu, ale všechny jsou v results
+        return results[0] if results else None
+
+    finally:
+        # Uvolnění pipeline a vyčištění paměti
+        if 'pipe' in locals():
+            del pipe
+        free_memory(device)
+
+
+if __name__ == "__main__":
+    # Regresní kontrola dávkové invariance na skutečném modelu (python inference.py --model ... --image ...)
+    parser = argparse.ArgumentParser(description="Kontrola, že dávkové a samostatné generování dává stejné varianty")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--model-type", choices=["lora", "full_model"], default="lora")
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[42, 43, 44, 45])
+    parser.add_argument("--strength", type=float, default=0.6)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+
+    pipe, _ = load_pipeline(args.model, args.model_type)
+    with Image.open(args.image) as source:
+        latents = encode_image_latents(pipe, fit_to_bucket(source.convert("RGB")))
+    print(verify_batch_invariance(pipe, latents, encode_empty_prompt(pipe), args.seeds, args.strength, 7.5, args.steps))
@@ -0,0 +1,142 @@
+"""
+Trvalé úložiště úloh enginu (SQLite na /data)
+
+Každá úloha stylového přenosu se zapíše i se vstupním obrázkem dřív, než
+jde do fronty. Po pádu nebo restartu engine nedokončené úlohy znovu zařadí
+pod stejným id a hotové výstupy jen načte z disku - nic se nepočítá dvakrát.
+
+Výstupy se neukládají znovu - záznam úlohy odkazuje na PNG bloby v úložišti
+výsledků (result_store.py). Ukončené úlohy se mažou podle stáří a počtu
+(JOBS_MAX_AGE_DAYS, JOBS_MAX_COUNT); bloby zůstávají historii.
+"""
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import threading
+from typing import List, Optional
+
+from PIL import Image
+
+from config import JOBS_PATH, JOBS_MAX_AGE_DAYS, JOBS_MAX_COUNT
+
+# Stavy, ve kterých úloha ještě nemá uložené výstupy
+PENDING_STATUSES = ("queued", "running")
+
+
+class JobStore:
+    """Tabulka úloh v SQLite a soubory vstupů/výstupů v JOBS_PATH/<id>/."""
+
+    def __init__(self, root: str = JOBS_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "jobs.sqlite"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    input_path TEXT,
+                    outputs TEXT NOT NULL DEFAULT '[]',
+                    report TEXT NOT NULL DEFAULT '{}',
+                    timings TEXT NOT NULL DEFAULT '{}',
+                    message TEXT NOT NULL DEFAULT '',
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def add(self, job_id: str, kind: str, params: dict, input_image: Image.Image):
+        """Uloží novou úlohu včetně vstupu (PNG, bezztrátově)."""
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        input_path = os.path.join(self.job_dir(job_id), "input.png")
+        input_image.save(input_path, format="PNG")
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO jobs (id, kind, status, params, input_path, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(params), input_path, now, now)
+            )
+
+    def save_outputs(self, job_id: str, outputs: List[str], report: dict, timings: dict):
+        """Označí úlohu jako hotovou s cestami k už zapsaným výstupům (bloby úložiště výsledků)."""
+        self.update(job_id, status="done", outputs=outputs, report=report, timings=timings, message="")
+
+    def update(self, job_id: str, **fields):
+        for key in ('outputs', 'report', 'timings'):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], default=str)
+        fields['updated_at'] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", list(fields.values()) + [job_id])
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._decode(row) if row else None
+
+    def pending(self) -> List[dict]:
+        """Nedokončené úlohy v pořadí zadání."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM jobs WHERE status IN ({', '.join('?' for _ in PENDING_STATUSES)}) ORDER BY created_at",
+                PENDING_STATUSES
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def prune(self, max_age_days: float = JOBS_MAX_AGE_DAYS, max_count: int = JOBS_MAX_COUNT,
+              keep: Optional[set] = None) -> int:
+        """
+        Smaže ukončené úlohy starší než max_age_days a ty nad max_count
+        nejnovějších (0 = bez limitu) i s jejich složkou. Úlohy v keep zůstanou.
+        Vrací počet smazaných.
+        """
+        finished = f"status NOT IN ({', '.join('?' for _ in PENDING_STATUSES)})"
+        with self._lock:
+            ids = set()
+            if max_age_days > 0:
+                cutoff = time.time() - max_age_days * 86400
+                ids.update(row[0] for row in self._db.execute(
+                    f"SELECT id FROM jobs WHERE {finished} AND updated_at < ?", PENDING_STATUSES + (cutoff,)
+                ))
+            if max_count > 0:
+                ids.update(row[0] for row in self._db.execute(
+                    f"SELECT id FROM jobs WHERE {finished} ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                    PENDING_STATUSES + (max_count,)
+                ))
+            ids -= keep or set()
+            if ids:
+                with self._db:
+                    self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+        for job_id in ids:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        return len(ids)
+
+    def load_outputs(self, record: dict) -> Optional[List[Image.Image]]:
+        """Načte uložené výstupy; None pokud některý chybí."""
+        if not record['outputs'] or not all(os.path.exists(p) for p in record['outputs']):
+            return None
+        images = []
+        for path in record['outputs']:
+            with Image.open(path) as image:
+                images.append(image.convert("RGB"))
+        return images
+
+    @staticmethod
+    def _decode(row) -> dict:
+        record = dict(row)
+        for key in ('params', 'outputs', 'report', 'timings'):
+            record[key] = json.loads(record[key])
+        return record
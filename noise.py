@@ -0,0 +1,84 @@
+"""
+Generování šumu nezávislé na zařízení a velikosti dávky
+
+Šum se vzorkuje na CPU ve float32 z vlastního generátoru pro každý vzorek
+a teprve potom se přetypuje a přesune na cílové zařízení. Stejný seed tak
+dává stejný latent na CPU i CUDA, v dávce i samostatně a na libovolné pozici
+v dávce.
+"""
+
+import sys
+import random
+import torch
+import diffusers.utils.torch_utils as diffusers_torch_utils
+from typing import List
+
+MAX_SEED = 2147483647
+
+_original_randn_tensor = diffusers_torch_utils.randn_tensor
+
+
+def variant_seeds(seed, variance_seed, num_images: int) -> List[int]:
+    """Seedy pro jednotlivé varianty - bez zadaného seedu náhodné, ale vždy explicitní."""
+    if seed is None:
+        return [random.randint(0, MAX_SEED) for _ in range(num_images)]
+
+    seeds = []
+    for i in range(num_images):
+        current_seed = seed
+        if variance_seed is not None and i > 0:
+            # Pro varianty použijeme kombinaci původního seed a variance seed
+            current_seed = seed + (variance_seed * i) % MAX_SEED
+        seeds.append(current_seed)
+    return seeds
+
+
+def make_generators(seeds: List[int]) -> List[torch.Generator]:
+    """Jeden CPU generátor na vzorek."""
+    return [torch.Generator(device="cpu").manual_seed(int(s)) for s in seeds]
+
+
+def batch_stable_randn(shape, generator=None, device=None, dtype=None, layout=None):
+    """
+    Náhrada diffusers randn_tensor pro CPU generátory.
+
+    Každý vzorek se generuje zvlášť ve float32 (CPU kernel pro float16 dává
+    jinou sekvenci než pro float32), výsledek se až poté přetypuje.
+    """
+    generators = generator if isinstance(generator, list) else [generator]
+    if generator is None or any(g.device.type != "cpu" for g in generators):
+        return _original_randn_tensor(shape, generator=generator, device=device, dtype=dtype, layout=layout)
+
+    device = device or torch.device("cpu")
+    if isinstance(generator, list) and len(generator) == 1:
+        # Stejně jako diffusers - jeden generátor v seznamu platí pro celou dávku
+        generator = generator[0]
+    if isinstance(generator, list):
+        sample_shape = (1,) + tuple(shape[1:])
+        noise = torch.cat([
+            torch.randn(sample_shape, generator=generators[i], dtype=torch.float32)
+            for i in range(shape[0])
+        ])
+    else:
+        noise = torch.randn(shape, generator=generator, dtype=torch.float32)
+    return noise.to(device=device, dtype=dtype or torch.float32)
+
+
+def install_batch_stable_noise():
+    """Nahradí randn_tensor ve všech načtených modulech diffusers (idempotentní)."""
+    for name, module in list(sys.modules.items()):
+        if name.startswith("diffusers") and getattr(module, "randn_tensor", None) is _original_randn_tensor:
+            module.randn_tensor = batch_stable_randn
+
+
+def check_batch_invariance(seeds: List[int], shape=(4, 128, 128)) -> bool:
+    """
+    Regresní kontrola: šum pro seed nesmí záviset na velikosti dávky ani na pozici v ní.
+
+    Porovná dávku se samostatně generovanými vzorky a s dávkou v obráceném pořadí.
+    """
+    batch_shape = (len(seeds),) + tuple(shape)
+    batched = batch_stable_randn(batch_shape, generator=make_generators(seeds))
+    single = torch.cat([batch_stable_randn((1,) + tuple(shape), generator=make_generators([s])) for s in seeds])
+    reversed_batch = batch_stable_randn(batch_shape, generator=make_generators(list(reversed(seeds))))
+    return torch.equal(batched, single) and torch.equal(batched, reversed_batch.flip(0))
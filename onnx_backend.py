@@ -0,0 +1,321 @@
+"""
+ONNX Runtime backend pro inference na CPU
+
+UNet, VAE encoder a VAE decoder se pro každou kombinaci modelu a LoRA
+jednou exportují do ONNX a uloží do ONNX_CACHE_PATH. Pipeline diffusers
+zůstává beze změny (scheduler, CFG, callbacky) - jen forward UNetu a VAE
+se přesměruje do ONNX Runtime sessions s optimalizací grafu. Váhy eager
+UNetu a VAE se pak uvolní (moduly zůstanou jen kvůli konfiguraci), takže
+proces nedrží model dvakrát - jednou v PyTorch a jednou v sessions.
+Text encodery zůstávají v PyTorch.
+
+Benchmark proti eager PyTorch:
+    python onnx_backend.py --model /data/loras/tuymans.safetensors --image foto.jpg
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import itertools
+
+import psutil
+import torch
+from diffusers.models.autoencoder_kl import AutoencoderKLOutput
+from diffusers.models.unet_2d_condition import UNet2DConditionOutput
+from diffusers.models.vae import DecoderOutput, DiagonalGaussianDistribution
+
+from config import BASE_MODEL, ONNX_CACHE_PATH
+from result_cache import model_fingerprint
+
+# Počet vláken ONNX Runtime (0 = počet fyzických jader)
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))
+ONNX_OPSET = 17
+
+
+def export_key(model_path: str, model_type: str) -> str:
+    """Klíč exportu - otisk modelu (a base modelu pro LoRA)."""
+    digest = hashlib.sha256(f"{model_type}:{model_fingerprint(model_path)}".encode())
+    if model_type == "lora":
+        digest.update(BASE_MODEL.encode())
+    return digest.hexdigest()[:32]
+
+
+class _UNetExport(torch.nn.Module):
+    """UNet s plochými vstupy pro export (added_cond_kwargs SDXL jako samostatné tensory)."""
+
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states, text_embeds, time_ids):
+        return self.unet(
+            sample,
+            timestep,
+            encoder_hidden_states=encoder_hidden_states,
+            added_cond_kwargs={'text_embeds': text_embeds, 'time_ids': time_ids},
+            return_dict=False
+        )[0]
+
+
+class _VAEEncoderExport(torch.nn.Module):
+    """Encoder + quant_conv - výstupem jsou momenty posteriorního rozdělení."""
+
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, pixels):
+        return self.vae.quant_conv(self.vae.encoder(pixels))
+
+
+class _VAEDecoderExport(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latents):
+        return self.vae.decoder(self.vae.post_quant_conv(latents))
+
+
+def export_pipeline(pipe, export_dir: str):
+    """Exportuje UNet a VAE pipeline (fp32, CPU) do ONNX s dynamickou dávkou a rozlišením."""
+    tmp_dir = export_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    # LoRA se zapeče do vah, aby graf neobsahoval vedlejší větve adaptéru
+    if hasattr(pipe, "fuse_lora"):
+        try:
+            pipe.fuse_lora()
+        except Exception as e:
+            print(f"Warning: Nelze zapéct LoRA před exportem: {e}")
+
+    unet, vae = pipe.unet, pipe.vae
+    # Attention slicing rozbaluje smyčku podle velikosti dávky - export s klasickou attention
+    attn_processors = unet.attn_processors
+    unet.set_default_attn_processor()
+    text_dim = unet.config.cross_attention_dim
+    pooled_dim = pipe.text_encoder_2.config.projection_dim
+    spatial = {0: "batch", 2: "height", 3: "width"}
+
+    with torch.no_grad():
+        print("📦 Export UNetu do ONNX...")
+        torch.onnx.export(
+            _UNetExport(unet),
+            (
+                torch.randn(2, 4, 128, 128),
+                torch.tensor([500.0, 500.0]),
+                torch.randn(2, 77, text_dim),
+                torch.randn(2, pooled_dim),
+                torch.randn(2, 6),
+            ),
+            os.path.join(tmp_dir, "unet.onnx"),
+            input_names=["sample", "timestep", "encoder_hidden_states", "text_embeds", "time_ids"],
+            output_names=["noise_pred"],
+            dynamic_axes={
+                'sample': spatial,
+                'timestep': {0: "batch"},
+                'encoder_hidden_states': {0: "batch"},
+                'text_embeds': {0: "batch"},
+                'time_ids': {0: "batch"},
+                'noise_pred': spatial,
+            },
+            opset_version=ONNX_OPSET,
+        )
+
+        print("📦 Export VAE encoderu a decoderu do ONNX...")
+        torch.onnx.export(
+            _VAEEncoderExport(vae),
+            (torch.randn(1, 3, 1024, 1024),),
+            os.path.join(tmp_dir, "vae_encoder.onnx"),
+            input_names=["pixels"],
+            output_names=["moments"],
+            dynamic_axes={'pixels': spatial, 'moments': spatial},
+            opset_version=ONNX_OPSET,
+        )
+        torch.onnx.export(
+            _VAEDecoderExport(vae),
+            (torch.randn(1, 4, 128, 128),),
+            os.path.join(tmp_dir, "vae_decoder.onnx"),
+            input_names=["latents"],
+            output_names=["image"],
+            dynamic_axes={'latents': spatial, 'image': spatial},
+            opset_version=ONNX_OPSET,
+        )
+    unet.set_attn_processor(attn_processors)
+
+    shutil.rmtree(export_dir, ignore_errors=True)
+    os.replace(tmp_dir, export_dir)
+
+
+def create_session(path: str):
+    """ONNX Runtime session s plnou optimalizací grafu a vlákny podle fyzických jader."""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = ONNX_THREADS or psutil.cpu_count(logical=False) or 1
+    options.inter_op_num_threads = 1
+    options.enable_mem_pattern = True
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def release_weights(module: torch.nn.Module):
+    """
+    Uvolní tensory vah modulu - zůstanou prázdné se stejným dtype a zařízením,
+    takže konfigurace, dtype i device modulu pro pipeline platí dál.
+    """
+    for tensor in itertools.chain(module.parameters(), module.buffers()):
+        tensor.data = torch.empty(0, dtype=tensor.dtype, device=tensor.device)
+
+
+def _to_numpy(tensor):
+    return tensor.detach().to(device="cpu", dtype=torch.float32).contiguous().numpy()
+
+
+class OnnxBackend:
+    """Přesměruje forward UNetu a encode/decode VAE do ONNX Runtime (odpojitelné přes remove())."""
+
+    def __init__(self, pipe, export_dir: str):
+        self.pipe = pipe
+        self.unet_session = create_session(os.path.join(export_dir, "unet.onnx"))
+        self.encoder_session = create_session(os.path.join(export_dir, "vae_encoder.onnx"))
+        self.decoder_session = create_session(os.path.join(export_dir, "vae_decoder.onnx"))
+
+        unet, vae = pipe.unet, pipe.vae
+        self._had_instance = {
+            'forward': 'forward' in unet.__dict__,
+            'encode': 'encode' in vae.__dict__,
+            'decode': 'decode' in vae.__dict__,
+        }
+        self.original_forward = unet.forward
+        self.original_encode = vae.encode
+        self.original_decode = vae.decode
+        unet.forward = self.forward
+        vae.encode = self.encode
+        vae.decode = self.decode
+        self.weights_released = False
+
+    def release_torch_weights(self):
+        """Uvolní eager váhy UNetu a VAE, které teď obsluhují sessions (nevratné)."""
+        release_weights(self.pipe.unet)
+        release_weights(self.pipe.vae)
+        self.weights_released = True
+
+    def remove(self):
+        """Vrátí eager PyTorch forward."""
+        if self.weights_released:
+            raise RuntimeError("Eager váhy UNetu a VAE jsou uvolněné, ONNX backend nelze odpojit")
+        unet, vae = self.pipe.unet, self.pipe.vae
+        for obj, name, original in (
+            (unet, 'forward', self.original_forward),
+            (vae, 'encode', self.original_encode),
+            (vae, 'decode', self.original_decode),
+        ):
+            if self._had_instance[name]:
+                setattr(obj, name, original)
+            else:
+                delattr(obj, name)
+
+    def forward(self, sample, timestep, encoder_hidden_states=None, added_cond_kwargs=None, return_dict=True, **kwargs):
+        # Vstupy mimo exportovaný graf (např. cross_attention_kwargs) řeší eager cesta
+        if any(value is not None for value in kwargs.values()) or not added_cond_kwargs:
+            if self.weights_released:
+                raise RuntimeError("Vstupy mimo ONNX graf vyžadují eager UNet, jehož váhy jsou uvolněné")
+            return self.original_forward(sample, timestep, encoder_hidden_states=encoder_hidden_states,
+                                         added_cond_kwargs=added_cond_kwargs, return_dict=return_dict, **kwargs)
+
+        batch = sample.shape[0]
+        timesteps = torch.as_tensor(timestep, dtype=torch.float32).reshape(-1).expand(batch)
+        noise_pred = self.unet_session.run(None, {
+            'sample': _to_numpy(sample),
+            'timestep': _to_numpy(timesteps),
+            'encoder_hidden_states': _to_numpy(encoder_hidden_states),
+            'text_embeds': _to_numpy(added_cond_kwargs['text_embeds']),
+            'time_ids': _to_numpy(added_cond_kwargs['time_ids']),
+        })[0]
+        output = torch.from_numpy(noise_pred).to(device=sample.device, dtype=sample.dtype)
+        if return_dict:
+            return UNet2DConditionOutput(sample=output)
+        return (output,)
+
+    def encode(self, pixels, return_dict=True):
+        moments = self.encoder_session.run(None, {'pixels': _to_numpy(pixels)})[0]
+        posterior = DiagonalGaussianDistribution(torch.from_numpy(moments).to(device=pixels.device, dtype=pixels.dtype))
+        if return_dict:
+            return AutoencoderKLOutput(latent_dist=posterior)
+        return (posterior,)
+
+    def decode(self, latents, return_dict=True, generator=None):
+        # Po jednom vzorku jako VAE slicing - nižší špička paměti
+        images = [
+            torch.from_numpy(self.decoder_session.run(None, {'latents': _to_numpy(latents[i:i + 1])})[0])
+            for i in range(latents.shape[0])
+        ]
+        image = torch.cat(images).to(device=latents.device, dtype=latents.dtype)
+        if return_dict:
+            return DecoderOutput(sample=image)
+        return (image,)
+
+
+def enable_onnx_backend(pipe, model_path: str, model_type: str, progress_callback=None,
+                        release_torch_weights: bool = True) -> OnnxBackend:
+    """
+    Použije (případně nejdřív vytvoří) export v ONNX_CACHE_PATH a přepne pipeline
+    na ONNX Runtime. S release_torch_weights uvolní eager váhy UNetu a VAE.
+    """
+    export_dir = os.path.join(ONNX_CACHE_PATH, export_key(model_path, model_type))
+    if not os.path.exists(os.path.join(export_dir, "unet.onnx")):
+        if progress_callback:
+            progress_callback(0.5, "Export modelu do ONNX (jednou pro model)...")
+        start = time.time()
+        export_pipeline(pipe, export_dir)
+        print(f"✅ ONNX export hotov za {time.time() - start:.0f} s: {export_dir}")
+    backend = OnnxBackend(pipe, export_dir)
+    if release_torch_weights:
+        backend.release_torch_weights()
+    pipe.onnx_backend = backend
+    return backend
+
+
+def benchmark(model_path: str, model_type: str, image_path: str, strength: float = 0.6, steps: int = 20, seed: int = 42) -> dict:
+    """Porovná eager PyTorch a ONNX Runtime na stejném vstupu a seedu (čas a PSNR)."""
+    from PIL import Image
+    from feature_reuse import image_psnr
+    from inference import load_pipeline, fit_to_bucket, encode_image_latents, encode_empty_prompt, run_img2img_batch
+
+    pipe, _ = load_pipeline(model_path, model_type, device="cpu")
+    with Image.open(image_path) as image:
+        image = fit_to_bucket(image.convert("RGB"))
+
+    def render():
+        start = time.time()
+        latents = encode_image_latents(pipe, image)
+        result = run_img2img_batch(pipe, latents, encode_empty_prompt(pipe), [seed], strength, 7.5, steps)[0]
+        return result, time.time() - start
+
+    eager_image, eager_time = render()
+    # Eager váhy zůstávají - backend se po měření odpojí
+    backend = enable_onnx_backend(pipe, model_path, model_type, release_torch_weights=False)
+    onnx_image, onnx_time = render()
+    backend.remove()
+
+    return {
+        'eager_time_s': eager_time,
+        'onnx_time_s': onnx_time,
+        'speedup': eager_time / max(onnx_time, 1e-6),
+        'psnr_db': image_psnr(eager_image, onnx_image),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ONNX Runtime backendu proti eager PyTorch na CPU")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--model-type", choices=["lora", "full_model"], default="lora")
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+    print(benchmark(args.model, args.model_type, args.image, steps=args.steps))
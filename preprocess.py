@@ -0,0 +1,156 @@
+"""
+Rychlé předzpracování vstupních obrázků s cache dekódovaných výsledků
+
+Vstup se dekóduje jen v rozlišení, které je opravdu potřeba: JPEG přes
+draft mode rovnou v 1/2, 1/4 nebo 1/8 (nikdy menší než cílový bucket),
+ostatní formáty se zmenší s reducing_gap. EXIF orientace a převod barevného
+prostoru (ICC profil -> sRGB) proběhnou jednou. Výsledek v bucketu i malý
+náhled pro zobrazení se drží v LRU cache podle hashe uploadu a bucketu,
+takže Streamlit rerun dekódování neplatí znovu.
+
+Bez závislosti na torch - používá ho tenké UI, HTTP API i inference.
+"""
+
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from config import MAX_INPUT_MEGAPIXELS
+
+# Delší strana náhledu pro zobrazení v UI
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', '512'))
+# Limit paměti cache předzpracovaných obrázků
+PREPROCESS_CACHE_MB = float(os.getenv('PREPROCESS_CACHE_MB', '256'))
+
+# EXIF orientace, které prohazují šířku a výšku
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+_EXIF_ORIENTATION = 0x0112
+
+PreparedImage = namedtuple("PreparedImage", ["image", "preview", "sha256", "original_size"])
+
+
+def get_resolution_bucket(width: int, height: int, max_megapixels: float = MAX_INPUT_MEGAPIXELS):
+    """Rozlišení pro generování - násobky 64, plocha omezená na max_megapixels (0 = bez limitu)."""
+    scale = 1.0
+    if max_megapixels > 0:
+        scale = min(1.0, (max_megapixels * 1024 * 1024 / float(width * height)) ** 0.5)
+    bucket_width = max(64, int(round(width * scale / 64)) * 64)
+    bucket_height = max(64, int(round(height * scale / 64)) * 64)
+    return bucket_width, bucket_height
+
+
+def fit_to_bucket(image: Image.Image) -> Image.Image:
+    """Přizpůsobí vstupní obrázek rozlišení bucketu (stejné pro všechny vstupní body)."""
+    bucket = get_resolution_bucket(*image.size)
+    if image.size == bucket:
+        return image
+    return image.resize(bucket, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """Jediný převod barev - s ICC profilem do sRGB, jinak prostý převod režimu."""
+    icc_profile = image.info.get("icc_profile")
+    if icc_profile:
+        try:
+            from PIL import ImageCms
+            return ImageCms.profileToProfile(
+                image,
+                ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)),
+                ImageCms.createProfile("sRGB"),
+                outputMode="RGB"
+            )
+        except Exception as e:
+            print(f"Warning: ICC profil nelze použít, převádím bez něj: {e}")
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def decode_image(source, max_megapixels: float = MAX_INPUT_MEGAPIXELS) -> Image.Image:
+    """
+    Dekóduje obrázek (cesta, soubor nebo bytes) rovnou do RGB v rozlišení
+    bucketu - s EXIF orientací a redukovaným dekódováním.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        orientation = image.getexif().get(_EXIF_ORIENTATION, 1)
+        width, height = image.size
+        if orientation in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        bucket = get_resolution_bucket(width, height, max_megapixels)
+
+        if image.format == "JPEG":
+            # Draft vybere největší zmenšení DCT, které je stále aspoň velikosti bucketu
+            stored_bucket = (bucket[1], bucket[0]) if orientation in _TRANSPOSED_ORIENTATIONS else bucket
+            image.draft(image.mode if image.mode in ("RGB", "L") else None, stored_bucket)
+        image.load()
+        image = _to_rgb(ImageOps.exif_transpose(image))
+
+    if image.size != bucket:
+        image = image.resize(bucket, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return image
+
+
+def make_preview(image: Image.Image, size: int = PREVIEW_SIZE) -> Image.Image:
+    preview = image.copy()
+    preview.thumbnail((size, size), Image.Resampling.LANCZOS)
+    return preview
+
+
+class PreprocessCache:
+    """LRU předzpracovaných obrázků podle (hash uploadu, bucket) s limitem paměti."""
+
+    def __init__(self, budget_mb: float = PREPROCESS_CACHE_MB):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(prepared: PreparedImage) -> int:
+        return sum(len(image.getbands()) * image.width * image.height for image in (prepared.image, prepared.preview))
+
+    def get(self, key) -> Optional[PreparedImage]:
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return prepared
+
+    def put(self, key, prepared: PreparedImage):
+        with self._lock:
+            self._entries[key] = prepared
+            self._entries.move_to_end(key)
+            total = sum(self._size(p) for p in self._entries.values())
+            while total > self.budget_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                total -= self._size(old)
+
+
+_cache = PreprocessCache()
+
+
+def prepare_upload(data: bytes, max_megapixels: float = MAX_INPUT_MEGAPIXELS) -> PreparedImage:
+    """Obrázek v bucketu a náhled pro nahraná data - z cache, nebo jedno rychlé dekódování."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    with Image.open(io.BytesIO(data)) as header:
+        # Jen hlavička - velikost a orientace bez dekódování pixelů
+        original_size = header.size
+        if header.getexif().get(_EXIF_ORIENTATION, 1) in _TRANSPOSED_ORIENTATIONS:
+            original_size = original_size[::-1]
+    key = (sha256, get_resolution_bucket(*original_size, max_megapixels))
+
+    prepared = _cache.get(key)
+    if prepared is None:
+        image = decode_image(data, max_megapixels)
+        prepared = PreparedImage(image, make_preview(image), sha256, original_size)
+        _cache.put(key, prepared)
+    return prepared
@@ -0,0 +1,182 @@
+"""
+Dynamická int8 kvantizace UNetu pro inference na CPU
+
+Lineární vrstvy UNetu (včetně projekcí q/k/v/out v attention) se převedou
+na dynamicky kvantizované int8 - váhy jsou int8, aktivace se kvantizují za
+běhu. Kvantizovaný UNet se pro každou kombinaci modelu a LoRA uloží do
+QUANT_CACHE_PATH, takže se kvantizace neopakuje při každém načtení.
+Konvoluce, VAE a text encodery zůstávají ve float32.
+
+Na disku je jen state_dict (tensory, načítá se s weights_only=True). Při
+načtení se z UNetu pipeline postaví kostra s prázdnými int8 vrstvami
+a váhy se do ní nahrají - žádný pickle modulu se nespouští.
+
+Benchmark proti float32:
+    python quantization.py --model /data/loras/tuymans.safetensors --image foto.jpg
+"""
+
+import os
+import gc
+import time
+import hashlib
+import argparse
+
+import torch
+import diffusers
+from torch.ao.quantization import quantize_dynamic
+from torch.ao.nn.quantized import dynamic as nnqd
+
+from config import BASE_MODEL, QUANT_CACHE_PATH
+from result_cache import model_fingerprint
+
+
+def quantized_key(model_path: str, model_type: str) -> str:
+    """Klíč uloženého kvantizovaného UNetu - otisk modelu (a base modelu pro LoRA)."""
+    digest = hashlib.sha256(f"int8:{model_type}:{model_fingerprint(model_path)}".encode())
+    if model_type == "lora":
+        digest.update(BASE_MODEL.encode())
+    # Struktura UNetu (a tím klíče state_dict) závisí na verzi diffusers
+    digest.update(f"{torch.__version__}:{diffusers.__version__}".encode())
+    return digest.hexdigest()[:32]
+
+
+def module_bytes(module: torch.nn.Module) -> int:
+    """Velikost vah modulu v bajtech (včetně zabalených int8 vah)."""
+    total = 0
+    for value in module.state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.nelement() * tensor.element_size()
+    return total
+
+
+def _plain_linears(module: torch.nn.Module):
+    """
+    Nahradí podtřídy nn.Linear (LoRACompatibleLinear) obyčejným nn.Linear se
+    stejnými vahami - quantize_dynamic převádí jen přesný typ nn.Linear.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            if getattr(child, 'lora_layer', None) is not None:
+                # Nezapečená LoRA větev - vrstvu necháme ve float32
+                continue
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.weight = child.weight
+            if child.bias is not None:
+                linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _plain_linears(child)
+
+
+def _empty_int8_linears(module: torch.nn.Module):
+    """Nahradí nn.Linear prázdnou dynamickou int8 vrstvou (stejně jako quantize_dynamic, bez kvantizace vah)."""
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            setattr(module, name, nnqd.Linear(child.in_features, child.out_features,
+                                              bias_=child.bias is not None, dtype=torch.qint8))
+        else:
+            _empty_int8_linears(child)
+
+
+def load_quantized_unet(pipe, state: dict) -> torch.nn.Module:
+    """
+    Postaví z UNetu pipeline kostru se strukturou uloženého kvantizovaného
+    UNetu a nahraje do ní uložený state_dict.
+    """
+    unet = pipe.unet.to(device="cpu", dtype=torch.float32).eval()
+    for name, child in unet.named_modules():
+        # LoRA zapečená při kvantizaci už v uložených vahách je - větev se zahodí
+        if getattr(child, 'lora_layer', None) is not None and not any(key.startswith(f"{name}.lora_layer.") for key in state):
+            child.lora_layer = None
+    _plain_linears(unet)
+    _empty_int8_linears(unet)
+    unet.load_state_dict(state)
+    return unet
+
+
+def quantize_unet(pipe) -> torch.nn.Module:
+    """Zapeče LoRA a dynamicky kvantizuje lineární vrstvy UNetu (na místě)."""
+    if hasattr(pipe, "fuse_lora"):
+        try:
+            pipe.fuse_lora()
+        except Exception as e:
+            print(f"Warning: Nelze zapéct LoRA před kvantizací: {e}")
+
+    unet = pipe.unet.to(device="cpu", dtype=torch.float32).eval()
+    _plain_linears(unet)
+    return quantize_dynamic(unet, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def enable_int8_backend(pipe, model_path: str, model_type: str, progress_callback=None) -> dict:
+    """
+    Nahradí UNet pipeline kvantizovaným - z QUANT_CACHE_PATH, nebo ho jednou
+    vytvoří a uloží. Vrací velikost vah UNetu před a po kvantizaci.
+    """
+    path = os.path.join(QUANT_CACHE_PATH, quantized_key(model_path, model_type), "unet_int8_state.pt")
+    fp32_bytes = module_bytes(pipe.unet)
+
+    if os.path.exists(path):
+        unet = load_quantized_unet(pipe, torch.load(path, map_location="cpu", weights_only=True))
+    else:
+        if progress_callback:
+            progress_callback(0.5, "Kvantizace UNetu na int8 (jednou pro model)...")
+        start = time.time()
+        unet = quantize_unet(pipe)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        torch.save(unet.state_dict(), tmp_path)
+        os.replace(tmp_path, path)
+        print(f"✅ Kvantizace hotova za {time.time() - start:.0f} s: {path}")
+
+    pipe.unet = unet.eval()
+    gc.collect()
+
+    int8_bytes = module_bytes(unet)
+    info = {
+        'unet_fp32_mb': fp32_bytes / (1024 * 1024),
+        'unet_int8_mb': int8_bytes / (1024 * 1024),
+        'memory_saved_mb': (fp32_bytes - int8_bytes) / (1024 * 1024),
+    }
+    pipe.int8_backend = info
+    return info
+
+
+def benchmark(model_path: str, model_type: str, image_path: str, strength: float = 0.6, steps: int = 20, seed: int = 42) -> dict:
+    """Porovná float32 a int8 UNet na stejném vstupu a seedu (čas, paměť vah a PSNR)."""
+    from PIL import Image
+    from feature_reuse import image_psnr
+    from inference import load_pipeline, fit_to_bucket, encode_image_latents, encode_empty_prompt, run_img2img_batch
+
+    pipe, _ = load_pipeline(model_path, model_type, device="cpu")
+    with Image.open(image_path) as image:
+        image = fit_to_bucket(image.convert("RGB"))
+
+    def render():
+        start = time.time()
+        latents = encode_image_latents(pipe, image)
+        result = run_img2img_batch(pipe, latents, encode_empty_prompt(pipe), [seed], strength, 7.5, steps)[0]
+        return result, time.time() - start
+
+    fp32_image, fp32_time = render()
+    info = enable_int8_backend(pipe, model_path, model_type)
+    int8_image, int8_time = render()
+
+    return dict(
+        info,
+        fp32_time_s=fp32_time,
+        int8_time_s=int8_time,
+        speedup=fp32_time / max(int8_time, 1e-6),
+        psnr_db=image_psnr(fp32_image, int8_image),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dynamické int8 kvantizace proti float32 na CPU")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--model-type", choices=["lora", "full_model"], default="lora")
+    parser.add_argument("--image", required=True)
+    parser.add_argument("--steps", type=int, default=20)
+    args = parser.parse_args()
+    print(benchmark(args.model, args.model_type, args.image, steps=args.steps))
@@ -0,0 +1,225 @@
+"""
+Deterministická cache výsledků stylového přenosu
+
+Při zadaném seedu je výstup plně určen vstupním obrázkem, modelem a parametry
+generování. Klíč cache je hash všech těchto vstupů; výsledky leží jako PNG
+v CACHE_PATH s limitem velikosti a LRU vyřazováním. Souběžné stejné požadavky
+sdílejí jeden výpočet (in-flight coalescing).
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from PIL import Image
+
+from config import BASE_MODEL, CACHE_PATH, RESULT_CACHE_MB, UPLOADS_PATH
+
+# Parametry, které ovlivňují výstup (feature_reuse_check mění jen report)
+KEY_PARAMS = (
+    'model_type', 'strength', 'guidance_scale', 'num_inference_steps', 'clip_skip', 'sampler',
+    'upscale_factor', 'seed', 'num_images', 'variance_seed', 'guidance_mode', 'cfg_fraction',
+    'feature_reuse_interval', 'backend', 'hires_scale', 'hires_strength', 'hires_steps',
+)
+
+# Trvalý index otisků (cesta -> velikost, mtime, SHA-256) - celý hash se počítá jednou
+_FINGERPRINTS_PATH = os.path.join(CACHE_PATH, "model_hashes.json")
+# Index katalogu z nahrávání - stejné SHA-256 celého souboru (uploads.py)
+_CATALOG_INDEX_PATH = os.path.join(UPLOADS_PATH, "catalog_hashes.json")
+_HASH_BLOCK = 1024 * 1024
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+# Hashování celého modelu jen v jednom vlákně - souběžné čtení stejného disku nic nezrychlí
+_hashing_lock = threading.Lock()
+
+
+def _indexed_sha256(index_path: str, path: str, stat) -> Optional[str]:
+    try:
+        with open(index_path) as f:
+            record = json.load(f).get(path)
+    except (OSError, ValueError):
+        return None
+    if record and record.get('size') == stat.st_size and record.get('mtime_ns') == stat.st_mtime_ns:
+        return record.get('sha256')
+    return None
+
+
+def _remember(path: str, stat, sha256: str):
+    """Zapíše otisk do trvalého indexu (ztracený zápis jen znamená nové hashování)."""
+    try:
+        try:
+            with open(_FINGERPRINTS_PATH) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+        os.makedirs(os.path.dirname(_FINGERPRINTS_PATH), exist_ok=True)
+        tmp_path = f"{_FINGERPRINTS_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, _FINGERPRINTS_PATH)
+    except OSError as e:
+        print(f"Warning: Nelze uložit otisk modelu: {e}")
+
+
+def model_fingerprint(path: str) -> str:
+    """
+    Otisk souboru modelu - SHA-256 celého obsahu. Počítá se jednou pro
+    (cestu, velikost, mtime): z paměti, z indexu katalogu po nahrání,
+    z trvalého indexu v CACHE_PATH, teprve jinak čtením celého souboru.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    identity = (path, stat.st_size, stat.st_mtime_ns)
+    with _fingerprints_lock:
+        if identity in _fingerprints:
+            return _fingerprints[identity]
+
+    with _hashing_lock:
+        with _fingerprints_lock:
+            if identity in _fingerprints:
+                return _fingerprints[identity]
+        fingerprint = _indexed_sha256(_CATALOG_INDEX_PATH, path, stat) or _indexed_sha256(_FINGERPRINTS_PATH, path, stat)
+        if fingerprint is None:
+            print(f"🔐 Hashuji model: {path}")
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+                    digest.update(block)
+            fingerprint = digest.hexdigest()
+            _remember(path, stat, fingerprint)
+        with _fingerprints_lock:
+            _fingerprints[identity] = fingerprint
+    return fingerprint
+
+
+def result_key(image: Image.Image, params: dict) -> Optional[str]:
+    """Klíč cache pro úlohu, nebo None pokud výsledek není deterministický (bez seedu)."""
+    if params.get('seed') is None:
+        return None
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    digest.update(model_fingerprint(params['model_path']).encode())
+    digest.update(BASE_MODEL.encode())
+    # Upscaler podle obsahu souboru, ne podle cesty - přepsaný model cache nezasáhne
+    if params.get('upscaler'):
+        digest.update(f"upscaler:{model_fingerprint(params['upscaler'])}".encode())
+    digest.update(json.dumps({key: params.get(key) for key in KEY_PARAMS}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Výsledky na disku s LRU podle celkové velikosti a sdílením rozpracovaných výpočtů."""
+
+    def __init__(self, root: str = CACHE_PATH, budget_mb: float = RESULT_CACHE_MB):
+        self.root = root
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (počet obrázků, velikost v bajtech)
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._load_index()
+
+    def _paths(self, key: str, count: int) -> List[str]:
+        return [os.path.join(self.root, f"{key}_{i}.png") for i in range(count)]
+
+    def _load_index(self):
+        """Obnoví LRU index ze souborů (pořadí podle času posledního přístupu)."""
+        files = {}
+        for name in os.listdir(self.root):
+            if name.endswith(".png") and "_" in name:
+                key, index = name[:-4].rsplit("_", 1)
+                path = os.path.join(self.root, name)
+                stat = os.stat(path)
+                count, size, atime = files.get(key, (0, 0, 0.0))
+                files[key] = (max(count, int(index) + 1), size + stat.st_size, max(atime, stat.st_mtime))
+        for key, (count, size, _) in sorted(files.items(), key=lambda item: item[1][2]):
+            self._entries[key] = (count, size)
+
+    def get(self, key: str) -> Optional[List[Image.Image]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        images = []
+        try:
+            for path in self._paths(key, entry[0]):
+                with Image.open(path) as image:
+                    images.append(image.convert("RGB"))
+                # mtime slouží jako čas přístupu pro LRU po restartu
+                os.utime(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return images
+
+    def put(self, key: str, images: List[Image.Image], encoded: Optional[List[bytes]] = None):
+        """Uloží výsledky; encoded jsou už zakódované PNG bajty stejných obrázků."""
+        size = 0
+        for index, (image, path) in enumerate(zip(images, self._paths(key, len(images)))):
+            tmp_path = path + ".tmp"
+            if encoded is not None:
+                with open(tmp_path, "wb") as f:
+                    f.write(encoded[index])
+            else:
+                image.save(tmp_path, format="PNG")
+            os.replace(tmp_path, path)
+            size += os.path.getsize(path)
+
+        with self._lock:
+            self._entries[key] = (len(images), size)
+            self._entries.move_to_end(key)
+            evicted = []
+            total = sum(s for _, s in self._entries.values())
+            while total > self.budget_bytes and len(self._entries) > 1:
+                old_key, (count, old_size) = self._entries.popitem(last=False)
+                evicted.append((old_key, count))
+                total -= old_size
+        for old_key, count in evicted:
+            for path in self._paths(old_key, count):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def begin(self, key: str, job):
+        """Zaregistruje rozpracovaný výpočet; pokud už běží, vrátí jeho úlohu."""
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is not None:
+                self.coalesced += 1
+                return leader
+            self._inflight[key] = job
+            return None
+
+    def end(self, key: str, job=None):
+        """Ukončí rozpracovaný výpočet (s job jen pokud je pod klíčem registrovaná právě tato úloha)."""
+        with self._lock:
+            if job is None or self._inflight.get(key) is job:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_mb': sum(s for _, s in self._entries.values()) / (1024 * 1024),
+                'budget_mb': self.budget_bytes / (1024 * 1024),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'inflight': len(self._inflight),
+            }
@@ -0,0 +1,157 @@
+"""
+Trvalé úložiště výsledků adresované obsahem s indexem historie (SQLite na /data)
+
+Každý hotový výsledek se uloží jako PNG pod svým SHA-256 (stejný obrázek
+jen jednou, i když vznikl z cache nebo opakovaně) spolu s malou miniaturou.
+Index drží parametry úlohy, otisk modelu, seed, časy a odkazy na soubory,
+takže historie stránkuje přes tisíce výsledků jen nad indexem a miniaturami
+- plné obrázky se čtou až při otevření.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+
+from PIL import Image
+
+from config import RESULTS_PATH
+from encoding import THUMBNAIL_SIZES, get_encoder
+from result_cache import model_fingerprint
+
+# Formát miniatur v historii
+HISTORY_THUMBNAIL_FORMAT = "webp"
+
+
+class ResultStore:
+    """Bloby v RESULTS_PATH/blobs/<sha[:2]>/<sha>.<ext> a index results.sqlite."""
+
+    def __init__(self, root: str = RESULTS_PATH):
+        self.root = root
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "results.sqlite"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    variant INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    thumbnail_sha256 TEXT NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    seed INTEGER,
+                    model_name TEXT NOT NULL DEFAULT '',
+                    model_hash TEXT NOT NULL DEFAULT '',
+                    params TEXT NOT NULL DEFAULT '{}',
+                    timings TEXT NOT NULL DEFAULT '{}',
+                    created_at REAL NOT NULL,
+                    UNIQUE (job_id, variant)
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_sha256 ON results (sha256)")
+
+    def blob_path(self, sha256: str, ext: str = "png") -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], f"{sha256}.{ext}")
+
+    def _write_blob(self, data: bytes, ext: str) -> str:
+        """Zapíše bajty pod jejich hashem - existující blob se nepřepisuje."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(sha256, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return sha256
+
+    def add(self, job_id: str, images: List[Image.Image], params: dict, report: dict, timings: dict,
+            encoded: Optional[List[bytes]] = None) -> List[str]:
+        """
+        Uloží výsledky úlohy a zapíše je do indexu (opakované volání nic nezdvojí).
+        Vrací cesty k PNG blobům - úložiště úloh na ně jen odkazuje.
+        """
+        encoder = get_encoder()
+        seeds = report.get('seeds', [])
+        try:
+            model_hash = model_fingerprint(params['model_path'])
+        except (KeyError, OSError):
+            model_hash = ""
+
+        rows = []
+        for i, image in enumerate(images):
+            data = encoded[i] if encoded is not None else encoder.get(f"{job_id}_{i}", image, "png")
+            thumbnail = encoder.get(f"{job_id}_{i}", image, HISTORY_THUMBNAIL_FORMAT, max_size=THUMBNAIL_SIZES[0])
+            rows.append((
+                job_id, i,
+                self._write_blob(data, "png"),
+                self._write_blob(thumbnail, HISTORY_THUMBNAIL_FORMAT),
+                image.width, image.height,
+                seeds[i] if i < len(seeds) else None,
+                os.path.basename(params.get('model_path', "")),
+                model_hash,
+                json.dumps(params, default=str),
+                json.dumps(timings, default=str),
+                time.time(),
+            ))
+
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO results (job_id, variant, sha256, thumbnail_sha256, width, height, seed, "
+                "model_name, model_hash, params, timings, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return [self.blob_path(row[2]) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def page(self, before_id: Optional[int] = None, limit: int = 24) -> List[dict]:
+        """
+        Stránka historie od nejnovějších - jen záznamy indexu. Stránkuje se
+        podle id (keyset), takže i vzdálená stránka je jeden skok po indexu.
+        """
+        with self._lock:
+            if before_id is None:
+                rows = self._db.execute("SELECT * FROM results ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT * FROM results WHERE id < ? ORDER BY id DESC LIMIT ?", (before_id, limit)
+                ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def thumbnail(self, record: dict) -> bytes:
+        with open(self.blob_path(record['thumbnail_sha256'], HISTORY_THUMBNAIL_FORMAT), "rb") as f:
+            return f.read()
+
+    def image_bytes(self, record: dict) -> bytes:
+        with open(self.blob_path(record['sha256']), "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def _decode(row) -> dict:
+        record = dict(row)
+        for key in ('params', 'timings'):
+            record[key] = json.loads(record[key])
+        return record
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    """Sdílené úložiště výsledků pro celý proces."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
@@ -32,6 +32,7 @@ export STREAMLIT_SERVER_MAX_MESSAGE_SIZE=50000  # 50GB in MB
 cleanup() {
     echo "🛑 Shutting down services..."
     kill $STREAMLIT_PID 2>/dev/null
+    kill $ENGINE_PID 2>/dev/null
     wait
     echo "✅ All services stopped"
     exit 0
@@ -90,6 +91,12 @@ filebrowser --port 8083 --address 0.0.0.0 --root /data --database /data/filebrow
 FILEBROWSER_PID=$!
 echo "FileBrowser PID: $FILEBROWSER_PID"
 
+# Spuštění inference enginu - samostatný proces s modelem a cache
+echo "🧠 Starting Inference Engine on 127.0.0.1:${ENGINE_PORT:-8765} (HTTP API on port ${API_PORT:-8502})..."
+python3 engine.py > /tmp/engine.log 2>&1 &
+ENGINE_PID=$!
+echo "🧠 Engine PID: $ENGINE_PID"
+
 # Spuštění Streamlit App s error handlingem
 echo "🎨 Starting Streamlit App on port 8501..."
 python3 -m streamlit run app.py --server.port=8501 --server.address=0.0.0.0 --server.headless=true > /tmp/streamlit.log 2>&1 &
@@ -108,6 +115,13 @@ else
     cat /tmp/filemanager.log
 fi
 
+if kill -0 $ENGINE_PID 2>/dev/null; then
+    echo "✅ Inference Engine is running (PID: $ENGINE_PID)"
+else
+    echo "❌ Inference Engine failed to start"
+    cat /tmp/engine.log
+fi
+
 if kill -0 $STREAMLIT_PID 2>/dev/null; then
     echo "✅ Streamlit is running (PID: $STREAMLIT_PID)"
 else
@@ -117,8 +131,8 @@ fi
 
 echo "✅ Services started!"
 echo "🎨 Streamlit App: http://localhost:8501"
-echo "📁 File Manager: http://localhost:8502"
-echo "📋 Logs: /tmp/streamlit.log, /tmp/filemanager.log"
+echo "🔌 HTTP API: http://localhost:${API_PORT:-8502}"
+echo "📋 Logs: /tmp/streamlit.log, /tmp/engine.log, /tmp/filemanager.log"
 
 # Monitoring loop s lepším error handlingem
 while true; do
@@ -132,6 +146,16 @@ while true; do
         echo "🔄 Streamlit restarted (PID: $STREAMLIT_PID)"
     fi
     
+    # Kontrola Inference Engine - restart enginu nesahá na Streamlit
+    if ! kill -0 $ENGINE_PID 2>/dev/null; then
+        echo "❌ Inference Engine crashed, restarting..."
+        echo "📋 Last Engine log:"
+        tail -20 /tmp/engine.log
+        python3 engine.py > /tmp/engine.log 2>&1 &
+        ENGINE_PID=$!
+        echo "🔄 Inference Engine restarted (PID: $ENGINE_PID)"
+    fi
+    
     # Kontrola File Manager
     # File Manager monitoring removed
     
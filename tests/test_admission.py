@@ -0,0 +1,84 @@
+"""
+Admission control: odhad paměti dávky, volba velikosti části dávky
+a rezervace rozpočtu včetně podílu stupně upscalingu.
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("psutil")
+
+import admission
+from admission import AdmissionController, estimate_memory
+
+PARAMS = {'model_path': "/nonexistent/model.safetensors", 'model_type': "full_model", 'guidance_scale': 7.5}
+RESOLUTION = (1024, 1024)
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    controller = AdmissionController("cpu")
+    monkeypatch.setattr(controller, "host_budget_gb", lambda: 40.0)
+    monkeypatch.setattr(controller, "host_available_gb", lambda: 40.0)
+    monkeypatch.setattr(admission, "MAX_CONCURRENT_PER_DEVICE", 2)
+    return controller
+
+
+def estimate(chunk=1, total_samples=4, **params):
+    return estimate_memory(dict(PARAMS, **params), RESOLUTION, total_samples, chunk, "cpu", resident=True)
+
+
+def test_estimate_grows_with_chunk_and_upscale():
+    assert estimate(chunk=2)['host_gb'] > estimate(chunk=1)['host_gb']
+    assert estimate(upscale_factor=2)['host_gb'] > estimate()['host_gb']
+    assert estimate(hires_scale=1.5)['host_gb'] > estimate()['host_gb']
+    # Bez CFG běží jen jedna větev UNetu
+    assert estimate(guidance_scale=1.0)['host_gb'] < estimate()['host_gb']
+
+
+def test_stage_is_reserved_only_with_upscaling():
+    assert estimate()['stage'] == {'device_gb': 0.0, 'host_gb': 0.0}
+    stage = estimate(upscale_factor=2)['stage']
+    assert 0.0 < stage['host_gb'] < estimate(upscale_factor=2)['host_gb']
+
+
+def test_loading_counts_when_not_resident():
+    cold = estimate_memory(PARAMS, RESOLUTION, 1, 1, "cpu", resident=False)
+    # Na CPU jdou z RAM hostitele načítané i výsledné váhy
+    assert cold['host_gb'] - estimate(total_samples=1)['host_gb'] == pytest.approx(2 * cold['weights_gb'])
+
+
+def test_choose_chunk_picks_largest_fitting(controller):
+    fitting = [chunk for chunk in range(1, 9) if controller.can_ever_fit(estimate(chunk=chunk))]
+    chosen = controller.choose_chunk(lambda chunk: estimate(chunk=chunk), 8)
+    assert chosen['chunk'] == max(fitting) < 8
+
+
+def test_choose_chunk_rejects_job_that_never_fits(controller, monkeypatch):
+    monkeypatch.setattr(controller, "host_budget_gb", lambda: 1.0)
+    assert controller.choose_chunk(lambda chunk: estimate(chunk=chunk), 4) is None
+
+
+def test_release_keeps_stage_until_released(controller):
+    batch = {'device_gb': 0.0, 'host_gb': 30.0, 'stage': {'device_gb': 0.0, 'host_gb': 20.0}}
+    other = {'device_gb': 0.0, 'host_gb': 25.0}
+    controller.acquire(batch)
+    assert not controller.fits_now(other)
+
+    controller.release(batch, samples=4, elapsed=2.0, keep=batch['stage'])
+    # Odšumování skončilo, upscaling ale stále drží svůj podíl
+    assert not controller.fits_now(other)
+    assert controller.fits_now({'device_gb': 0.0, 'host_gb': 10.0})
+    assert controller.estimated_wait(2) == pytest.approx(1.0)
+
+    controller.release_stage(batch['stage'])
+    assert controller.fits_now(other)
+
+
+def test_concurrency_limit(controller):
+    small = {'device_gb': 0.0, 'host_gb': 1.0}
+    controller.acquire(small)
+    controller.acquire(small)
+    assert not controller.fits_now(small)
+    controller.release(small)
+    assert controller.fits_now(small)
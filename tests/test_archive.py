@@ -0,0 +1,88 @@
+"""
+Streamovaný ZIP export: platný archiv z bajtů, souborů i líných zdrojů
+a bloky omezené velikostí chunku bez ohledu na velikost položek.
+"""
+
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from archive import prune_exports, stream_zip, write_zip
+
+CHUNK = 4096
+
+
+def payload(size, seed):
+    return bytes((i * seed) % 251 for i in range(size))
+
+
+@pytest.fixture
+def entries(tmp_path):
+    image_path = tmp_path / "variant_2.png"
+    image_path.write_bytes(payload(5 * CHUNK + 17, 7))
+    return [
+        ("variant_1.png", payload(3 * CHUNK + 5, 3)),
+        ("variant_2.png", str(image_path)),
+        ("variant_3.png", lambda: payload(CHUNK // 2, 11)),
+        ("manifest.json", b'{"variants": 3}' * 200),
+    ]
+
+
+def expected(entries):
+    return {name: source() if callable(source) else open(source, "rb").read() if isinstance(source, str) else source
+            for name, source in entries}
+
+
+def test_stream_is_valid_zip(entries):
+    data = b"".join(stream_zip(entries, chunk_size=CHUNK))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == [name for name, _ in entries]
+        assert {name: zf.read(name) for name in zf.namelist()} == expected(entries)
+        # Obrázky se ukládají bez komprese, manifest se komprimuje
+        assert zf.getinfo("variant_1.png").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("manifest.json").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_blocks_are_bounded(entries):
+    blocks = list(stream_zip(entries, chunk_size=CHUNK))
+    assert len(blocks) > 4
+    # Blok přesáhne chunk nejvýš o jeden zápis a hlavičky položky
+    assert max(len(block) for block in blocks) < 2 * CHUNK + 1024
+
+
+def test_sources_are_read_lazily():
+    calls = []
+
+    def source():
+        calls.append(1)
+        return b"data"
+
+    stream = stream_zip([("a.png", b"x" * CHUNK), ("b.png", source)], chunk_size=CHUNK)
+    next(stream)
+    assert not calls
+    list(stream)
+    assert calls == [1]
+
+
+def test_write_zip_is_atomic(tmp_path, entries):
+    path = write_zip(entries, str(tmp_path / "exports" / "job.zip"))
+    assert not os.path.exists(path + ".tmp")
+    with zipfile.ZipFile(path) as zf:
+        assert zf.read("variant_2.png") == expected(entries)["variant_2.png"]
+
+
+def test_prune_exports_removes_only_old_files(tmp_path):
+    old, fresh = tmp_path / "old.zip", tmp_path / "fresh.zip.tmp"
+    old.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    past = time.time() - 3 * 3600
+    os.utime(old, (past, past))
+    assert prune_exports(str(tmp_path), max_age_h=2) == 1
+    assert not old.exists() and fresh.exists()
+    assert prune_exports(str(tmp_path / "missing")) == 0
@@ -0,0 +1,33 @@
+"""
+Výstupní cesty batch CLI: různé vstupy nesmí zapisovat do stejného
+souboru, ani na volume bez rozlišení velikosti písmen.
+"""
+
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+pytest.importorskip("PIL")
+
+from batch_cli import find_collisions, output_paths
+
+INPUT, OUTPUT = "/in", "/out"
+
+
+def test_output_paths_keep_extension_and_folders():
+    assert output_paths(Path("/in/sub/a.jpg"), INPUT, OUTPUT, 1) == [Path("/out/sub/a_jpg.png")]
+    assert output_paths(Path("/in/a.png"), INPUT, OUTPUT, 2) == [Path("/out/a_png_v1.png"), Path("/out/a_png_v2.png")]
+
+
+def test_distinct_inputs_do_not_collide():
+    paths = [Path(f"/in/{name}") for name in ("a.jpg", "a.png", "DSC_001.edit.jpg", "DSC_001.raw.jpg", "sub/a.jpg")]
+    assert find_collisions(paths, INPUT, OUTPUT, 1) == {}
+    assert find_collisions(paths, INPUT, OUTPUT, 3) == {}
+
+
+def test_case_only_difference_collides():
+    paths = [Path("/in/A.JPG"), Path("/in/a.jpg"), Path("/in/b.jpg")]
+    collisions = find_collisions(paths, INPUT, OUTPUT, 1)
+    assert collisions == {"/out/a_jpg.png": [Path("/in/A.JPG"), Path("/in/a.jpg")]}
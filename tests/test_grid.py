@@ -0,0 +1,42 @@
+"""
+Rozpis parameter gridu: parsování hodnot, kartézský součin buněk
+a seskupení buněk lišících se jen seedem do dávek.
+"""
+
+import pytest
+
+pytest.importorskip("PIL")
+
+from grid import expand_grid, group_cells, parse_value_list
+
+
+def test_parse_value_list():
+    assert parse_value_list("0.4, 0.6; 0.8,, 0.4") == [0.4, 0.6, 0.8]
+    assert parse_value_list("20;30", cast=int) == [20, 30]
+    assert parse_value_list(" ") == []
+    with pytest.raises(ValueError):
+        parse_value_list("0.4, abc")
+
+
+def test_expand_grid_covers_product():
+    cells = expand_grid([0.4, 0.6], [5.0, 7.5], [20], [1, 2, 3])
+    assert len(cells) == 12
+    assert [cell['index'] for cell in cells] == list(range(12))
+    combinations = {(c['strength'], c['guidance_scale'], c['num_inference_steps'], c['seed']) for c in cells}
+    assert len(combinations) == 12
+
+
+def test_group_cells_batches_seeds_only():
+    cells = expand_grid([0.4, 0.6], [7.5], [20, 30], [1, 2, 3, 4, 5])
+    batches = group_cells(cells, max_batch=2)
+    # 4 kombinace parametrů × 5 seedů po dvou = 3 dávky na kombinaci
+    assert len(batches) == 12
+    for batch in batches:
+        assert 1 <= len(batch) <= 2
+        assert len({(c['strength'], c['guidance_scale'], c['num_inference_steps']) for c in batch}) == 1
+    assert sorted(c['index'] for batch in batches for c in batch) == list(range(len(cells)))
+
+
+def test_group_cells_tolerates_zero_batch():
+    cells = expand_grid([0.5], [7.5], [20], [1, 2])
+    assert [len(batch) for batch in group_cells(cells, max_batch=0)] == [1, 1]
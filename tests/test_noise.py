@@ -0,0 +1,48 @@
+"""
+Šum pro seed musí být bit po bitu stejný bez ohledu na velikost dávky,
+pozici v dávce a rozdělení dávky na části (max_batch v generate_batch).
+"""
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+from noise import batch_stable_randn, check_batch_invariance, make_generators, variant_seeds
+
+SHAPE = (4, 32, 32)
+SEEDS = variant_seeds(1234, 77, 6)
+
+
+def sample_noise(seeds):
+    return batch_stable_randn((len(seeds),) + SHAPE, generator=make_generators(seeds))
+
+
+def test_batch_matches_single_samples():
+    batched = sample_noise(SEEDS)
+    single = torch.cat([sample_noise([seed]) for seed in SEEDS])
+    assert torch.equal(batched, single)
+
+
+@pytest.mark.parametrize("splits", [(1, 5), (2, 2, 2), (4, 2), (3, 1, 2)])
+def test_chunk_splits_match_full_batch(splits):
+    chunks, start = [], 0
+    for size in splits:
+        chunks.append(sample_noise(SEEDS[start:start + size]))
+        start += size
+    assert torch.equal(torch.cat(chunks), sample_noise(SEEDS))
+
+
+def test_position_in_batch_does_not_matter():
+    reversed_batch = sample_noise(list(reversed(SEEDS)))
+    assert torch.equal(reversed_batch.flip(0), sample_noise(SEEDS))
+
+
+def test_half_precision_is_cast_from_float32():
+    noise = batch_stable_randn((len(SEEDS),) + SHAPE, generator=make_generators(SEEDS), dtype=torch.float16)
+    assert noise.dtype == torch.float16
+    assert torch.equal(noise, sample_noise(SEEDS).to(torch.float16))
+
+
+def test_check_batch_invariance():
+    assert check_batch_invariance(SEEDS, SHAPE)
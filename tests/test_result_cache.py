@@ -0,0 +1,106 @@
+"""
+Cache výsledků: klíč určený obsahem vstupů, LRU podle velikosti na disku
+a sdílení rozpracovaného výpočtu mezi stejnými požadavky.
+"""
+
+import io
+import os
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import result_cache
+from result_cache import ResultCache, model_fingerprint, result_key
+
+
+@pytest.fixture(autouse=True)
+def isolated_fingerprints(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "_FINGERPRINTS_PATH", str(tmp_path / "model_hashes.json"))
+    monkeypatch.setattr(result_cache, "_CATALOG_INDEX_PATH", str(tmp_path / "catalog_hashes.json"))
+    monkeypatch.setattr(result_cache, "_fingerprints", {})
+
+
+@pytest.fixture
+def model(tmp_path):
+    path = tmp_path / "model.safetensors"
+    path.write_bytes(b"a" * 4096)
+    return str(path)
+
+
+def params(model, **overrides):
+    return dict({'model_path': model, 'model_type': "full_model", 'strength': 0.5, 'seed': 42}, **overrides)
+
+
+def png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+IMAGE = Image.new("RGB", (8, 8), (10, 20, 30))
+
+
+def test_key_requires_seed(model):
+    assert result_key(IMAGE, params(model, seed=None)) is None
+
+
+def test_key_is_deterministic_and_covers_inputs(model):
+    key = result_key(IMAGE, params(model))
+    assert key == result_key(IMAGE.copy(), params(model))
+    assert key != result_key(IMAGE, params(model, strength=0.6))
+    assert key != result_key(IMAGE, params(model, seed=43))
+    assert key != result_key(Image.new("RGB", (8, 8), (10, 20, 31)), params(model))
+
+
+def test_key_follows_model_content(model):
+    key = result_key(IMAGE, params(model))
+    # Změna uprostřed souboru (mimo začátek a konec) musí změnit otisk
+    with open(model, "r+b") as f:
+        f.seek(2048)
+        f.write(b"b")
+    os.utime(model, ns=(1, 1))
+    assert result_key(IMAGE, params(model)) != key
+
+
+def test_fingerprint_is_reused_from_index(model, monkeypatch):
+    fingerprint = model_fingerprint(model)
+    monkeypatch.setattr(result_cache, "_fingerprints", {})
+    # Z trvalého indexu - soubor se znovu nečte
+    monkeypatch.setattr(result_cache.hashlib, "sha256", None)
+    assert model_fingerprint(model) == fingerprint
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    encoded = png(IMAGE)
+    cache = ResultCache(root=str(tmp_path / "cache"), budget_mb=2.5 * len(encoded) / (1024 * 1024))
+    for key in ("a", "b"):
+        cache.put(key, [IMAGE], encoded=[encoded])
+    assert cache.get("a") is not None  # "a" je teď nejnověji použitý
+    cache.put("c", [IMAGE], encoded=[encoded])
+
+    assert cache.get("b") is None
+    assert cache.get("a")[0].tobytes() == IMAGE.tobytes()
+    assert cache.get("c") is not None
+    assert not os.path.exists(os.path.join(cache.root, "b_0.png"))
+    assert cache.stats()['entries'] == 2
+
+
+def test_index_survives_restart(tmp_path):
+    cache = ResultCache(root=str(tmp_path / "cache"))
+    cache.put("key", [IMAGE, IMAGE])
+    restarted = ResultCache(root=cache.root)
+    assert len(restarted.get("key")) == 2
+
+
+def test_inflight_requests_are_coalesced(tmp_path):
+    cache = ResultCache(root=str(tmp_path / "cache"))
+    leader, follower = object(), object()
+    assert cache.begin("key", leader) is None
+    assert cache.begin("key", follower) is leader
+    # Jiná úloha nesmí ukončit cizí rozpracovaný výpočet
+    cache.end("key", follower)
+    assert cache.begin("key", follower) is leader
+    cache.end("key", leader)
+    assert cache.begin("key", follower) is None
+    assert cache.stats()['coalesced'] == 2
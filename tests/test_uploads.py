@@ -0,0 +1,136 @@
+"""
+Chunkované nahrávání: navázání po výpadku, kontrolní součty chunků
+i celého souboru a publikace do katalogu.
+"""
+
+import io
+import os
+import hashlib
+
+import pytest
+
+import uploads
+from uploads import UploadManager
+
+CHUNK = 10
+DATA = bytes(range(256)) * 2 + b"tail"
+SHA = hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "LORA_MODELS_PATH", str(tmp_path / "loras"))
+    monkeypatch.setattr(uploads, "FULL_MODELS_PATH", str(tmp_path / "models"))
+    return UploadManager(root=str(tmp_path / "uploads"), chunk_size=CHUNK)
+
+
+def chunk(index, data=DATA):
+    return data[index * CHUNK:(index + 1) * CHUNK]
+
+
+def put(manager, index, data=DATA, **kwargs):
+    return manager.write_chunk(SHA, index, io.BytesIO(chunk(index, data)), **kwargs)
+
+
+def test_create_resumes_with_missing_chunks(manager):
+    status = manager.create("model.safetensors", len(DATA), SHA)
+    num_chunks = status['num_chunks']
+    assert num_chunks == -(-len(DATA) // CHUNK)
+    assert status['missing'] == list(range(num_chunks))
+
+    put(manager, 0)
+    put(manager, 3)
+    put(manager, 3)  # opakovaný chunk se nezapočítá dvakrát
+
+    resumed = manager.create("model.safetensors", len(DATA), SHA)
+    assert resumed['received'] == 2
+    assert resumed['missing'] == [i for i in range(num_chunks) if i not in (0, 3)]
+
+
+def test_new_manager_resumes_from_disk(manager):
+    manager.create("model.safetensors", len(DATA), SHA)
+    put(manager, 1)
+    restarted = UploadManager(root=manager.root, chunk_size=CHUNK)
+    assert 1 not in restarted.status(SHA)['missing']
+
+
+def test_rejects_invalid_chunks(manager):
+    num_chunks = manager.create("model.safetensors", len(DATA), SHA)['num_chunks']
+    with pytest.raises(ValueError):
+        manager.write_chunk(SHA, num_chunks, io.BytesIO(b"x"))
+    with pytest.raises(ValueError):
+        put(manager, 0, expected_sha256=hashlib.sha256(b"other").hexdigest())
+    with pytest.raises(ValueError):
+        manager.write_chunk(SHA, 0, io.BytesIO(chunk(0)[:-1]))
+    assert 0 in manager.status(SHA)['missing']
+
+
+def test_complete_requires_all_chunks(manager):
+    manager.create("model.safetensors", len(DATA), SHA)
+    put(manager, 0)
+    with pytest.raises(ValueError):
+        manager.complete(SHA)
+
+
+@pytest.mark.parametrize("order", ["in_order", "reversed"])
+def test_complete_publishes_verified_file(manager, order):
+    num_chunks = manager.create("model.safetensors", len(DATA), SHA, model_type="lora")['num_chunks']
+    indices = range(num_chunks) if order == "in_order" else reversed(range(num_chunks))
+    for index in indices:
+        put(manager, index, expected_sha256=hashlib.sha256(chunk(index)).hexdigest())
+
+    result = manager.complete(SHA)
+    assert result['status'] == "done"
+    assert result['path'] == os.path.join(uploads.LORA_MODELS_PATH, "model.safetensors")
+    with open(result['path'], "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(manager._part_path(SHA))
+    with pytest.raises(KeyError):
+        manager.status(SHA)
+
+
+def test_checksum_mismatch_discards_upload(manager):
+    corrupted = DATA[:5] + b"X" + DATA[6:]
+    num_chunks = manager.create("model.safetensors", len(DATA), SHA)['num_chunks']
+    for index in range(num_chunks):
+        put(manager, index, data=corrupted)
+    with pytest.raises(ValueError):
+        manager.complete(SHA)
+    assert not os.path.exists(manager._part_path(SHA))
+    assert manager.create("model.safetensors", len(DATA), SHA)['received'] == 0
+
+
+def test_removed_part_raises_key_error(manager):
+    manager.create("model.safetensors", len(DATA), SHA)
+    os.remove(manager._part_path(SHA))
+    with pytest.raises(KeyError):
+        put(manager, 0)
+
+
+def test_create_validates_request(manager):
+    with pytest.raises(ValueError):
+        manager.create("model.ckpt", len(DATA), SHA)
+    with pytest.raises(ValueError):
+        manager.create("model.safetensors", len(DATA), "abc")
+    with pytest.raises(ValueError):
+        manager.create("model.safetensors", 0, SHA)
+
+
+def test_duplicate_content_is_hardlinked(manager):
+    os.makedirs(uploads.LORA_MODELS_PATH)
+    original = os.path.join(uploads.LORA_MODELS_PATH, "original.safetensors")
+    with open(original, "wb") as f:
+        f.write(DATA)
+
+    result = manager.create("copy.safetensors", len(DATA), SHA)
+    assert result['status'] == "done" and result['deduplicated']
+    assert os.path.samefile(result['path'], original)
+    # Druhý dotaz už hash bere z indexu katalogu
+    assert manager.find_indexed(SHA, len(DATA))['path'] in (original, result['path'])
+
+
+def test_import_file_deduplicates(manager):
+    first = manager.import_file(io.BytesIO(DATA), "first.safetensors", model_type="full_model")
+    second = manager.import_file(io.BytesIO(DATA), "second.safetensors")
+    assert second['deduplicated'] and second['model_type'] == "full_model"
+    assert os.path.samefile(first['path'], second['path'])
@@ -0,0 +1,37 @@
+"""
+Slučování úloh do dávek: do jedné dávky smí jen úlohy se stejnými
+parametry odšumování i stejným odhadem paměti (upscaling).
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+Image = pytest.importorskip("PIL.Image")
+
+from worker import Job
+
+PARAMS = {'model_path': "/nonexistent/model.safetensors", 'model_type': "full_model", 'seed': 1}
+
+
+def job(**params):
+    return Job(Image.new("RGB", (1024, 1024)), dict(PARAMS, **params))
+
+
+def test_same_parameters_share_batch():
+    assert job().batch_key() == job(seed=2).batch_key()
+
+
+@pytest.mark.parametrize("params", [
+    {'strength': 0.3},
+    {'guidance_scale': 3.0},
+    {'upscale_factor': 4},
+    {'upscaler': "/nonexistent/esrgan.pth"},
+])
+def test_different_parameters_split_batch(params):
+    assert job().batch_key() != job(**params).batch_key()
+
+
+def test_custom_calls_never_coalesce():
+    first, second = Job(call=lambda job: None), Job(call=lambda job: None)
+    assert first.batch_key() != second.batch_key()
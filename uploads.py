@@ -0,0 +1,473 @@
+"""
+Chunkované nahrávání modelů přímo na volume s navázáním po výpadku
+
+Klient nejdřív pošle název, velikost a SHA-256 souboru, pak chunky pevné
+velikosti (PUT na index chunku, v libovolném pořadí, opakovaně). Server je
+streamuje rovnou do rozpracovaného souboru v UPLOADS_PATH na stejném volume
+jako katalog modelů - RAM hostitele zůstává konstantní. Po ověření
+kontrolního součtu se soubor atomicky přesune do LORA_MODELS_PATH nebo
+FULL_MODELS_PATH. Každý bajt se zapíše jen jednou. SHA-256 celého souboru
+se počítá průběžně z chunků přicházejících popořadě, takže dokončení soubor
+znovu nečte (jen zbytek za chunky, které přišly mimo pořadí nebo před
+restartem serveru).
+
+Deduplikace podle obsahu: katalog má index SHA-256 všech modelů. Pokud stejný
+obsah už v katalogu leží (pod jakýmkoli jménem), nahrávání skončí hned po
+ohlášení hashe a nové jméno je jen hardlink na existující soubor - bez
+přenosu dat, bez místa navíc a se stejným otiskem pro cache odvozených
+artefaktů (ONNX, int8, rezidentní pipeline).
+
+Klient z příkazové řádky (navazuje automaticky, stačí příkaz zopakovat):
+    python uploads.py model.safetensors --url http://localhost:8502
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from typing import Callable, Optional
+
+from config import API_PORT, API_TOKEN, FULL_MODELS_PATH, LORA_MODELS_PATH, UPLOAD_CHUNK_MB, UPLOADS_PATH
+
+MODEL_TYPES = ("lora", "full_model")
+# Po jak velkých kusech se čte tělo požadavku a soubor při hashování
+_IO_BLOCK = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 souboru čtený po blocích (konstantní paměť)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_IO_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _continue_sha256(path: str, digest, offset: int) -> str:
+    """Dopočítá rozpracovaný hash souboru od offsetu do konce."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for block in iter(lambda: f.read(_IO_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class UploadManager:
+    """Rozpracovaná nahrávání v UPLOADS_PATH (<sha256>.part + <sha256>.json) a index publikovaných modelů."""
+
+    def __init__(self, root: str = UPLOADS_PATH, chunk_size: int = UPLOAD_CHUNK_MB * 1024 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        # Čtení-úprava-zápis indexu katalogu; hashování souborů běží mimo oba zámky.
+        # Index zapisuje UI (import_file) i engine (complete) - mezi procesy chrání flock
+        self._index_lock = threading.Lock()
+        self._index_path = os.path.join(root, "catalog_hashes.json")
+        self._index_lock_path = self._index_path + ".lock"
+        # Průběžné SHA-256 nahrávání: upload_id -> počet zahashovaných chunků od začátku a hash
+        self._running = {}
+
+    def _state_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.json")
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.root, f"{upload_id}.part")
+
+    def _load(self, upload_id: str) -> dict:
+        if len(upload_id) != 64 or not all(c in "0123456789abcdef" for c in upload_id):
+            raise KeyError(f"Neznámé nahrávání {upload_id}")
+        try:
+            with open(self._state_path(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(f"Neznámé nahrávání {upload_id}")
+
+    def _load_index(self) -> dict:
+        """Index katalogu: cesta -> velikost, mtime a SHA-256 (platný jen pro nezměněný soubor)."""
+        try:
+            with open(self._index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _record(self, path: str, sha256: str, model_type: str):
+        """Zapíše hash souboru do indexu katalogu (platí pro jeho aktuální velikost a mtime)."""
+        stat = os.stat(path)
+        with self._index_lock, open(self._index_lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._load_index()
+                index[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256, 'model_type': model_type}
+                _write_json_atomic(self._index_path, index)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _catalog_files(size: int):
+        """Modely v katalogu se zadanou velikostí - (typ, cesta, stat)."""
+        for model_type, directory in (("lora", LORA_MODELS_PATH), ("full_model", FULL_MODELS_PATH)):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if not name.endswith(".safetensors") or os.path.islink(path):
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if stat.st_size == size:
+                        yield model_type, path, stat
+
+    def find_indexed(self, sha256: str, size: int) -> Optional[dict]:
+        """Model se stejným obsahem jen podle indexu (bez hashování) - rychlé, lze volat pod zámkem."""
+        index = self._load_index()
+        for model_type, path, stat in self._catalog_files(size):
+            record = index.get(path)
+            if record and record['size'] == stat.st_size and record['mtime_ns'] == stat.st_mtime_ns \
+                    and record['sha256'] == sha256:
+                return {'path': path, 'model_type': record.get('model_type', model_type), 'size': size}
+        return None
+
+    def find_existing(self, sha256: str, size: int) -> Optional[dict]:
+        """
+        Model se stejným obsahem kdekoli v katalogu. Hashují se jen soubory
+        se stejnou velikostí, které ještě nejsou v indexu (jednou, pak z indexu).
+        Volá se mimo self._lock - hashování velkého modelu trvá sekundy.
+        """
+        index = self._load_index()
+        for model_type, path, stat in self._catalog_files(size):
+            record = index.get(path)
+            if not record or record['size'] != stat.st_size or record['mtime_ns'] != stat.st_mtime_ns:
+                print(f"🔐 Hashuji model z katalogu: {path}")
+                try:
+                    self._record(path, file_sha256(path), model_type)
+                except FileNotFoundError:
+                    continue
+                record = self._load_index()[path]
+            if record['sha256'] == sha256:
+                return {'path': path, 'model_type': record.get('model_type', model_type), 'size': size}
+        return None
+
+    def _adopt(self, existing: dict, filename: str, sha256: str) -> dict:
+        """
+        Dokončí nahrávání bez uložení duplicity - pod novým jménem hardlink na
+        existující soubor (na stejném volume), jinak odkaz na existující cestu.
+        """
+        directory = os.path.dirname(existing['path'])
+        target = os.path.join(directory, filename)
+        if os.path.exists(target):
+            if os.path.samefile(target, existing['path']):
+                return dict(existing, path=target, upload_id=sha256, status="done", deduplicated=True)
+            stem, ext = os.path.splitext(filename)
+            target = os.path.join(directory, f"{stem}_{sha256[:8]}{ext}")
+        try:
+            if not os.path.exists(target):
+                os.link(existing['path'], target)
+                self._record(target, sha256, existing['model_type'])
+                print(f"🔗 Duplicitní model, hardlink {target} -> {existing['path']}")
+        except OSError as e:
+            print(f"Warning: Hardlink nelze vytvořit ({e}), používám existující soubor {existing['path']}")
+            target = existing['path']
+        return dict(existing, path=target, upload_id=sha256, status="done", deduplicated=True)
+
+    def _status(self, state: dict) -> dict:
+        num_chunks = max(1, -(-state['size'] // state['chunk_size']))
+        received = set(state['received'])
+        return {
+            'upload_id': state['sha256'],
+            'status': "uploading",
+            'filename': state['filename'],
+            'size': state['size'],
+            'chunk_size': state['chunk_size'],
+            'num_chunks': num_chunks,
+            'received': len(received),
+            'missing': [i for i in range(num_chunks) if i not in received],
+        }
+
+    def create(self, filename: str, size: int, sha256: str, model_type: Optional[str] = None) -> dict:
+        """Založí nahrávání, nebo vrátí rozpracované se stejným obsahem (navázání)."""
+        filename = os.path.basename(filename or "")
+        sha256 = (sha256 or "").lower()
+        if not filename.endswith(".safetensors"):
+            raise ValueError("Podporované jsou jen soubory .safetensors")
+        if len(sha256) != 64 or not all(c in "0123456789abcdef" for c in sha256):
+            raise ValueError("Neplatný SHA-256")
+        if size <= 0:
+            raise ValueError("Neplatná velikost souboru")
+        if model_type and model_type not in MODEL_TYPES:
+            raise ValueError(f"Neplatný typ modelu: {model_type}")
+
+        # Obsah už v katalogu je - klient nemusí poslat ani bajt
+        existing = self.find_existing(sha256, size)
+        with self._lock:
+            existing = existing or self.find_indexed(sha256, size)
+            if existing is not None:
+                return self._adopt(existing, filename, sha256)
+            try:
+                state = self._load(sha256)
+            except KeyError:
+                state = None
+            if state is None or state['size'] != size:
+                state = {
+                    'sha256': sha256,
+                    'filename': filename,
+                    'size': size,
+                    'model_type': model_type,
+                    'chunk_size': self.chunk_size,
+                    'received': [],
+                    'created_at': time.time(),
+                }
+                self._running.pop(sha256, None)
+                # Soubor v plné velikosti předem - chunky se zapisují na svůj offset
+                with open(self._part_path(sha256), "wb") as f:
+                    f.truncate(size)
+                _write_json_atomic(self._state_path(sha256), state)
+            return self._status(state)
+
+    def status(self, upload_id: str) -> dict:
+        with self._lock:
+            return self._status(self._load(upload_id))
+
+    def write_chunk(self, upload_id: str, index: int, stream, expected_sha256: Optional[str] = None) -> dict:
+        """Zapíše chunk ze streamu na jeho offset; už přijatý chunk se znovu nezapisuje."""
+        with self._lock:
+            state = self._load(upload_id)
+        status = self._status(state)
+        if not 0 <= index < status['num_chunks']:
+            raise ValueError(f"Chunk {index} mimo rozsah 0-{status['num_chunks'] - 1}")
+        if index in state['received']:
+            return status
+
+        offset = index * state['chunk_size']
+        expected_length = min(state['chunk_size'], state['size'] - offset)
+        digest = hashlib.sha256()
+        # Navazuje-li chunk na dosud zahashovaný začátek souboru, přičte se k hashi celého souboru
+        with self._lock:
+            running = self._running.setdefault(upload_id, {'chunks': 0, 'digest': hashlib.sha256(), 'busy': False})
+            extend = running['chunks'] == index and not running['busy']
+            if extend:
+                running['busy'] = True
+                whole = running['digest'].copy()
+        written = 0
+        valid = False
+        try:
+            try:
+                fd = os.open(self._part_path(upload_id), os.O_WRONLY)
+            except FileNotFoundError:
+                # Nahrávání mezitím skončilo nebo bylo zahozeno (neshoda kontrolního součtu)
+                raise KeyError(f"Nahrávání {upload_id} už neexistuje, založte ho znovu")
+            try:
+                while written < expected_length:
+                    block = stream.read(min(_IO_BLOCK, expected_length - written))
+                    if not block:
+                        break
+                    os.pwrite(fd, block, offset + written)
+                    digest.update(block)
+                    if extend:
+                        whole.update(block)
+                    written += len(block)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            if written != expected_length:
+                raise ValueError(f"Chunk {index} je neúplný ({written} z {expected_length} B)")
+            if expected_sha256 and digest.hexdigest() != expected_sha256.lower():
+                raise ValueError(f"Chunk {index} má jiný kontrolní součet")
+            valid = True
+        finally:
+            if extend:
+                with self._lock:
+                    running['busy'] = False
+                    if valid:
+                        running['chunks'] += 1
+                        running['digest'] = whole
+
+        with self._lock:
+            state = self._load(upload_id)
+            if index not in state['received']:
+                state['received'].append(index)
+                _write_json_atomic(self._state_path(upload_id), state)
+            return self._status(state)
+
+    def complete(self, upload_id: str, detect_model_type: Optional[Callable[[str], str]] = None) -> dict:
+        """Ověří SHA-256 celého souboru a atomicky ho publikuje do katalogu modelů."""
+        with self._lock:
+            state = self._load(upload_id)
+            missing = self._status(state)['missing']
+            running = self._running.get(upload_id)
+            if running is not None and not running['busy']:
+                chunks, digest = running['chunks'], running['digest'].copy()
+            else:
+                chunks, digest = 0, hashlib.sha256()
+        if missing:
+            raise ValueError(f"Chybí {len(missing)} chunků")
+
+        # Dohashování zbytku a detekce typu mimo zámek - ostatní nahrávání neblokují.
+        # Chunky přijaté popořadě už v hashi jsou, čte se jen zbytek za nimi.
+        part_path = self._part_path(upload_id)
+        try:
+            sha256 = _continue_sha256(part_path, digest, min(chunks * state['chunk_size'], state['size']))
+        except FileNotFoundError:
+            raise KeyError(f"Nahrávání {upload_id} už neexistuje, založte ho znovu")
+        if sha256 != state['sha256']:
+            # Nelze určit vadný chunk - nahrávání začne znovu
+            with self._lock:
+                self._running.pop(upload_id, None)
+                for path in (part_path, self._state_path(upload_id)):
+                    if os.path.exists(path):
+                        os.remove(path)
+            raise ValueError("Kontrolní součet souboru nesouhlasí, nahrajte ho znovu")
+
+        model_type = state['model_type']
+        if model_type not in MODEL_TYPES and detect_model_type is not None:
+            model_type = detect_model_type(part_path)
+        if model_type not in MODEL_TYPES:
+            model_type = "lora"
+
+        # Souběžné nahrávání stejného obsahu už mohlo skončit dřív - publikace
+        # pod zámkem zapisuje do indexu, takže pod zámkem stačí index
+        existing = self.find_existing(state['sha256'], state['size'])
+        with self._lock:
+            if not os.path.exists(part_path):
+                raise KeyError(f"Nahrávání {upload_id} už neexistuje, založte ho znovu")
+            existing = existing or self.find_indexed(state['sha256'], state['size'])
+            self._running.pop(upload_id, None)
+            if existing is not None:
+                for path in (part_path, self._state_path(upload_id)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return self._adopt(existing, state['filename'], state['sha256'])
+            path = self._publish(part_path, state['filename'], state['sha256'], model_type)
+            os.remove(self._state_path(upload_id))
+        return {'upload_id': upload_id, 'status': "done", 'path': path, 'model_type': model_type}
+
+    def import_file(self, fileobj, filename: str, model_type: Optional[str] = None,
+                    detect_model_type: Optional[Callable[[str], str]] = None) -> dict:
+        """
+        Publikuje model z otevřeného souboru (např. Streamlit UploadedFile, který
+        už je v RAM) - nejdřív hash, a jen nový obsah se po blocích zapíše, jednou.
+        """
+        filename = os.path.basename(filename)
+        digest = hashlib.sha256()
+        size = 0
+        fileobj.seek(0)
+        for block in iter(lambda: fileobj.read(_IO_BLOCK), b""):
+            digest.update(block)
+            size += len(block)
+        sha256 = digest.hexdigest()
+
+        existing = self.find_existing(sha256, size)
+        with self._lock:
+            existing = existing or self.find_indexed(sha256, size)
+            if existing is not None:
+                return self._adopt(existing, filename, sha256)
+
+        tmp_path = os.path.join(self.root, f"import_{threading.get_ident()}_{time.time_ns()}.part")
+        fileobj.seek(0)
+        with open(tmp_path, "wb") as f:
+            for block in iter(lambda: fileobj.read(_IO_BLOCK), b""):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if model_type not in MODEL_TYPES and detect_model_type is not None:
+            model_type = detect_model_type(tmp_path)
+        if model_type not in MODEL_TYPES:
+            model_type = "lora"
+        with self._lock:
+            path = self._publish(tmp_path, filename, sha256, model_type)
+        return {'upload_id': sha256, 'status': "done", 'path': path, 'model_type': model_type}
+
+    def _publish(self, part_path: str, filename: str, sha256: str, model_type: str) -> str:
+        """Přesun do katalogu pod volným jménem a zápis do indexu (volá se pod zámkem)."""
+        target_dir = LORA_MODELS_PATH if model_type == "lora" else FULL_MODELS_PATH
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, filename)
+        if os.path.exists(target):
+            # Jiný model se stejným jménem se nepřepisuje
+            stem, ext = os.path.splitext(filename)
+            target = os.path.join(target_dir, f"{stem}_{sha256[:8]}{ext}")
+        try:
+            os.replace(part_path, target)
+        except OSError:
+            # Katalog na jiném volume než UPLOADS_PATH - přesun kopií
+            shutil.move(part_path, target)
+
+        self._record(target, sha256, model_type)
+        print(f"✅ Model publikován: {target}")
+        return target
+
+
+def upload(path: str, url: str, model_type: Optional[str] = None, token: str = API_TOKEN, retries: int = 5) -> dict:
+    """Nahraje soubor přes HTTP API po chuncích; opakované spuštění naváže na přijaté chunky."""
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+
+    def call(method: str, endpoint: str, data: bytes = None, extra_headers: dict = None) -> dict:
+        for attempt in range(retries):
+            request = urllib.request.Request(url.rstrip("/") + endpoint, data=data, method=method,
+                                             headers=dict(headers, **(extra_headers or {})))
+            try:
+                with urllib.request.urlopen(request, timeout=300) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    raise RuntimeError(json.loads(e.read() or b"{}").get('error', str(e)))
+                error = e
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+            wait = 2 ** attempt
+            print(f"Warning: {method} {endpoint} selhal ({error}), nový pokus za {wait} s")
+            time.sleep(wait)
+        raise RuntimeError(f"{method} {endpoint} selhal i po {retries} pokusech")
+
+    size = os.path.getsize(path)
+    print(f"🔐 Počítám SHA-256 ({size / 1024 ** 3:.2f} GB)...")
+    body = {'filename': os.path.basename(path), 'size': size, 'sha256': file_sha256(path)}
+    if model_type:
+        body['model_type'] = model_type
+    status = call("POST", "/uploads", json.dumps(body).encode(), {'Content-Type': "application/json"})
+    if status['status'] == "done":
+        print(f"✅ Model už je na serveru: {status['path']}")
+        return status
+
+    upload_id, chunk_size = status['upload_id'], status['chunk_size']
+    missing = status['missing']
+    with open(path, "rb") as f:
+        for done, index in enumerate(missing, start=1):
+            f.seek(index * chunk_size)
+            chunk = f.read(chunk_size)
+            call("PUT", f"/uploads/{upload_id}/chunks/{index}", chunk,
+                 {'Content-Type': "application/octet-stream", 'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest()})
+            print(f"⬆️ Chunk {index + 1}/{status['num_chunks']} ({done}/{len(missing)} zbývajících)")
+    result = call("POST", f"/uploads/{upload_id}/complete", b"")
+    print(f"✅ Model publikován: {result['path']} ({result['model_type']})")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunkované nahrání modelu přes HTTP API s navázáním")
+    parser.add_argument("path")
+    parser.add_argument("--url", default=f"http://localhost:{API_PORT}")
+    parser.add_argument("--model-type", choices=list(MODEL_TYPES), default=None)
+    args = parser.parse_args()
+    try:
+        upload(args.path, args.url, args.model_type)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
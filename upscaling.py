@@ -0,0 +1,148 @@
+"""
+Upscaling jako samostatný stupeň pipeline - paralelně po dlaždicích
+
+Každý výstup se rozdělí na dlaždice (UPSCALE_TILE px výstupu), které se
+převzorkují přes resize(box=...) přímo z odpovídající oblasti zdroje -
+filtr vidí i okolní pixely, takže na hranách dlaždic nevznikají švy.
+Dlaždice všech variant běží současně v poolu vláken (resample v Pillow
+uvolňuje GIL). Worker inference na stupeň nečeká a pokračuje odšumováním
+další dávky; úloha se dokončí, až jsou dlaždice hotové.
+
+Místo LANCZOS může stupeň použít naučený upscaler (esrgan.py) - cesta
+k modelu v parametru upscaler; varianty pak jdou sítí jedna po druhé
+a dlaždice se dávkují uvnitř sítě.
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from PIL import Image
+
+from cancellation import Cancelled
+
+UPSCALE_WORKERS = int(os.getenv('UPSCALE_WORKERS', str(os.cpu_count() or 1)))
+# Hrana dlaždice ve výstupních pixelech
+UPSCALE_TILE = int(os.getenv('UPSCALE_TILE', '1024'))
+
+
+def tile_boxes(width: int, height: int, tile: int = UPSCALE_TILE) -> List[Tuple[int, int, int, int]]:
+    """Obdélníky dlaždic pokrývající výstup width x height."""
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in range(0, height, tile)
+        for x in range(0, width, tile)
+    ]
+
+
+def _resize_tile(image: Image.Image, factor: int, box: Tuple[int, int, int, int], cancel_token=None):
+    """Převzorkuje jednu dlaždici výstupu z odpovídající (neceločíselné) oblasti zdroje."""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    start = time.time()
+    x0, y0, x1, y1 = box
+    tile = image.resize((x1 - x0, y1 - y0), Image.Resampling.LANCZOS,
+                        box=(x0 / factor, y0 / factor, x1 / factor, y1 / factor))
+    return tile, start, time.time()
+
+
+def _lanczos(image: Image.Image, factor: int) -> Image.Image:
+    return image.resize((image.width * factor, image.height * factor), Image.Resampling.LANCZOS)
+
+
+class UpscaleStage:
+    """Pool pro dlaždice a koordinátor úloh (čeká na dlaždice mimo pool - bez deadlocku)."""
+
+    def __init__(self, workers: int = UPSCALE_WORKERS, tile: int = UPSCALE_TILE):
+        self.tile = tile
+        self._tiles = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="upscale-tile")
+        self._jobs = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upscale-stage")
+
+    def run(self, images: List[Image.Image], factor: int, cancel_token=None, progress_callback=None,
+            upscaler: str = "", device: str = "cpu") -> Tuple[List[Image.Image], List[float]]:
+        """
+        Zvětší všechny varianty najednou. Vrací obrázky a čas každé varianty
+        (od startu stupně do dokončení její poslední dlaždice). Varianta,
+        jejíž upscaling selže, zůstane v původním rozlišení.
+        """
+        if factor <= 1:
+            return images, [0.0] * len(images)
+        if upscaler:
+            return self._run_model(images, factor, cancel_token, progress_callback, upscaler, device)
+
+        start = time.time()
+        planned = []
+        for image in images:
+            size = (image.width * factor, image.height * factor)
+            boxes = tile_boxes(*size, self.tile)
+            futures = [self._tiles.submit(_resize_tile, image, factor, box, cancel_token) for box in boxes]
+            planned.append((size, boxes, futures))
+
+        total_tiles = sum(len(boxes) for _, boxes, _ in planned)
+        done_tiles = 0
+        results, timings = [], []
+        for image, (size, boxes, futures) in zip(images, planned):
+            try:
+                output = Image.new(image.mode, size)
+                finished = start
+                for box, future in zip(boxes, futures):
+                    tile, _, tile_end = future.result()
+                    output.paste(tile, box[:2])
+                    finished = max(finished, tile_end)
+                    done_tiles += 1
+                    if progress_callback:
+                        progress_callback(0.9 + 0.05 * done_tiles / total_tiles, f"Upscaling {len(results) + 1}/{len(images)}...")
+                results.append(output)
+                timings.append(finished - start)
+            except Cancelled:
+                for _, _, pending in planned:
+                    for future in pending:
+                        future.cancel()
+                raise
+            except Exception as e:
+                print(f"Warning: Upscaling varianty {len(results) + 1} selhal: {e}")
+                results.append(image)
+                timings.append(time.time() - start)
+        return results, timings
+
+    def _run_model(self, images: List[Image.Image], factor: int, cancel_token, progress_callback,
+                   upscaler: str, device: str) -> Tuple[List[Image.Image], List[float]]:
+        """Naučený upscaler - rezidentní síť, dlaždice s překryvem po dávkách."""
+        from esrgan import get_upscaler
+
+        start = time.time()
+        model = get_upscaler(upscaler, device)
+        results, timings = [], []
+        for i, image in enumerate(images):
+            variant_start = time.time()
+            try:
+                results.append(model.upscale(image, factor, cancel_token))
+            except Cancelled:
+                raise
+            except Exception as e:
+                print(f"Warning: Upscaling varianty {i + 1} modelem selhal: {e}")
+                results.append(_lanczos(image, factor))
+            timings.append(time.time() - (start if i == 0 else variant_start))
+            if progress_callback:
+                progress_callback(0.9 + 0.05 * (i + 1) / len(images), f"Upscaling {i + 1}/{len(images)}...")
+        return results, timings
+
+    def submit(self, images: List[Image.Image], factor: int, cancel_token=None, progress_callback=None,
+               upscaler: str = "", device: str = "cpu") -> Future:
+        """Spustí upscaling na pozadí - volající (worker inference) hned pokračuje."""
+        return self._jobs.submit(self.run, images, factor, cancel_token, progress_callback, upscaler, device)
+
+
+_stage = None
+_stage_lock = threading.Lock()
+
+
+def get_upscale_stage() -> UpscaleStage:
+    """Sdílený stupeň upscalingu pro celý proces."""
+    global _stage
+    with _stage_lock:
+        if _stage is None:
+            _stage = UpscaleStage()
+        return _stage
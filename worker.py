@@ -0,0 +1,510 @@
+"""
+Inference worker s frontou úloh a slučováním požadavků
+
+Jeden worker na zařízení drží rezidentní pipeline a zpracovává frontu úloh
+ze všech Streamlit sessions. Úlohy se stejným modelem, adaptérem, bucketem
+rozlišení a parametry odšumování se sloučí do jedné dávky. Sessions úlohu
+jen odešlou a čekají na její future.
+
+WorkerPool drží jeden worker (a repliku pipeline) na každé zařízení a úlohy
+směruje na zařízení, kde je jejich model už načtený.
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from admission import AdmissionController, estimate_memory
+from cancellation import BatchCancellation, CancellationToken, Cancelled
+from config import CPU_BACKENDS, DEFAULT_PARAMS, MAX_BATCH_SIZE
+from inference import (
+    get_optimal_device,
+    get_inference_devices,
+    load_pipeline,
+    free_memory,
+    set_scheduler,
+    get_resolution_bucket,
+    fit_to_bucket,
+    generate_batch,
+)
+from noise import variant_seeds
+from result_cache import model_fingerprint
+from onnx_backend import enable_onnx_backend
+from quantization import enable_int8_backend
+from upscaling import get_upscale_stage
+
+# Jak dlouho worker čeká na další slučitelné úlohy, než spustí dávku
+COALESCE_WINDOW_MS = int(os.getenv('COALESCE_WINDOW_MS', '50'))
+# Počet pipeline držených v paměti jedním workerem
+MAX_RESIDENT_PIPELINES = int(os.getenv('MAX_RESIDENT_PIPELINES', '1'))
+# Zařízení pro workery: "auto" nebo seznam, např. "cuda:0,cuda:1" či "cpu,cpu"
+INFERENCE_DEVICES = os.getenv('INFERENCE_DEVICES', 'auto')
+# Od jakého počtu čekajících vzorků se vyplatí načíst repliku na volném zařízení
+REPLICATE_AFTER_SAMPLES = int(os.getenv('REPLICATE_AFTER_SAMPLES', str(2 * MAX_BATCH_SIZE)))
+
+
+class Job:
+    """Jedna úloha - parametry, stav, progress a future s výsledkem."""
+
+    def __init__(self, input_image=None, params: Optional[dict] = None, call: Optional[Callable] = None,
+                 job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.input_image = fit_to_bucket(input_image) if input_image is not None else None
+        self.call = call
+        self.future = Future()
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.report = {}
+        self.timings = {}
+        self.created_at = time.time()
+        self.cancel_token = CancellationToken()
+        self._pipeline_key = None
+
+    def pipeline_key(self):
+        """
+        Klíč rezidentní pipeline - model, adaptér a backend (scheduler se jen přepne).
+        Model se určuje otiskem obsahu, stejný soubor pod jiným jménem sdílí pipeline.
+        """
+        if self._pipeline_key is None:
+            try:
+                model_id = model_fingerprint(self.params['model_path'])
+            except OSError:
+                model_id = self.params['model_path']
+            self._pipeline_key = (model_id, self.params['model_type'], self.params['clip_skip'], self.params['backend'])
+        return self._pipeline_key
+
+    def device_for(self, worker_device: str) -> str:
+        """ONNX Runtime a int8 backend běží na CPU bez ohledu na zařízení workeru."""
+        return "cpu" if self.params['backend'] in CPU_BACKENDS else worker_device
+
+    def batch_key(self):
+        """Úlohy se stejným klíčem lze spustit v jednom volání pipeline."""
+        if self.call is not None:
+            return ('call', self.id)
+        p = self.params
+        return self.pipeline_key() + (
+            get_resolution_bucket(*self.input_image.size) if self.input_image is not None else None,
+            p['num_inference_steps'],
+            p['strength'],
+            p['guidance_scale'],
+            p['sampler'],
+            p['guidance_mode'],
+            p['cfg_fraction'],
+            p['feature_reuse_interval'],
+            p['feature_reuse_check'],
+            p['hires_scale'],
+            p['hires_strength'],
+            p['hires_steps'],
+            # Upscaling nemění odšumování, ale mění odhad paměti dávky (admission)
+            p['upscale_factor'],
+            p['upscaler'],
+        )
+
+    def num_samples(self) -> int:
+        return 1 if self.call is not None else max(1, int(self.params['num_images']))
+
+    def set_progress(self, progress: float, text: str = ""):
+        self.progress = max(self.progress, min(1.0, progress))
+        if text:
+            self.message = text
+
+    def mark_cancelled(self):
+        """Ukončí úlohu jako zrušenou - rozpracované výsledky se zahodí."""
+        self.status = "cancelled"
+        self.message = self.cancel_token.reason or "Zrušeno"
+        if not self.future.done():
+            self.future.set_exception(Cancelled(self.message))
+
+
+class InferenceWorker:
+    """Worker pro jedno zařízení - rezidentní pipeline a fronta úloh se slučováním."""
+
+    def __init__(self, name: str = "default", device: Optional[str] = None):
+        self.name = name
+        self.device = device or get_optimal_device()[0]
+        self.admission = AdmissionController(self.device)
+        self._pending: List[Job] = []
+        self._condition = threading.Condition()
+        self._pipelines = OrderedDict()
+        self._model_names = {}
+        self._loading_key = None
+        self._running_samples = 0
+        self.batches_run = 0
+        self.jobs_done = 0
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"inference-worker-{name}")
+        self._thread.start()
+
+    def submit(self, input_image, params: dict) -> Job:
+        """Zařadí úlohu stylového přenosu do fronty."""
+        return self.enqueue(Job(input_image, params))
+
+    def submit_call(self, params: dict, call: Callable, job_id: Optional[str] = None) -> Job:
+        """
+        Zařadí vlastní funkci call(pipe, job), která poběží na vlákně workeru
+        s rezidentní pipeline (např. grid sweep).
+        """
+        return self.enqueue(Job(params=params, call=call, job_id=job_id))
+
+    def enqueue(self, job: Job) -> Job:
+        """Zařadí již vytvořenou úlohu (např. obnovenou z úložiště úloh)."""
+        if job.call is None and job.input_image is not None:
+            # Úloha, která se nevejde ani po jednom vzorku do prázdného zařízení, se nespustí nikdy
+            estimate = self._estimate([job], chunk=1, resident=job.pipeline_key() in self._pipelines)
+            if not self.admission.can_ever_fit(estimate):
+                job.status = "failed"
+                job.message = (f"Úloha se nevejde do paměti (odhad {estimate['device_gb']:.1f} GB zařízení, "
+                               f"{estimate['host_gb']:.1f} GB RAM)")
+                job.future.set_exception(MemoryError(job.message))
+                return job
+        with self._condition:
+            self._pending.append(job)
+            job.message = f"Čeká ve frontě ({len(self._pending)}.)"
+            self._condition.notify()
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        """Odebere zrušenou úlohu z fronty; běžící úloha se zastaví sama na tokenu."""
+        with self._condition:
+            if job not in self._pending:
+                return False
+            self._pending.remove(job)
+        job.mark_cancelled()
+        return True
+
+    def queue_length(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def backlog(self) -> int:
+        """Počet vzorků čekajících ve frontě a právě počítaných."""
+        with self._condition:
+            return self._running_samples + sum(job.num_samples() for job in self._pending)
+
+    def has_affinity(self, key) -> bool:
+        """Má worker model načtený, načítá ho, nebo na něj už čeká úloha ve frontě?"""
+        with self._condition:
+            return (
+                key in self._pipelines
+                or key == self._loading_key
+                or any(job.pipeline_key() == key for job in self._pending)
+            )
+
+    def resident_models(self) -> List[str]:
+        return [self._model_names.get(key, key[0]) for key in list(self._pipelines)]
+
+    def _next_batch(self) -> List[Job]:
+        """Vezme nejstarší úlohu a přibere k ní slučitelné úlohy z fronty."""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            first = self._pending[0]
+            if first.cancel_token.is_cancelled():
+                self._pending.remove(first)
+                first.mark_cancelled()
+                return []
+
+            # Krátké okno pro příchod dalších slučitelných úloh
+            deadline = time.time() + COALESCE_WINDOW_MS / 1000.0
+            while first.call is None and time.time() < deadline:
+                self._condition.wait(timeout=max(0.0, deadline - time.time()))
+
+            key = first.batch_key()
+            batch, samples = [], 0
+            for job in list(self._pending):
+                if job.batch_key() != key or job.cancel_token.is_cancelled():
+                    continue
+                if batch and samples + job.num_samples() > MAX_BATCH_SIZE:
+                    break
+                batch.append(job)
+                samples += job.num_samples()
+            for job in batch:
+                self._pending.remove(job)
+            samples_ahead = samples
+            for position, job in enumerate(self._pending):
+                wait = self.admission.estimated_wait(samples_ahead)
+                job.message = f"Čeká ve frontě ({position + 1}.)" + (f", odhad ~{wait:.0f} s" if wait is not None else "")
+                samples_ahead += job.num_samples()
+            return batch
+
+    def _estimate(self, batch: List[Job], chunk: int, resident: bool) -> dict:
+        """Odhad paměťové špičky dávky (všechny úlohy mají stejný bucket a parametry)."""
+        first = batch[0]
+        return estimate_memory(
+            first.params,
+            first.input_image.size,
+            sum(job.num_samples() for job in batch),
+            chunk,
+            first.device_for(self.device),
+            resident
+        )
+
+    def _evict_for(self, key):
+        """Uvolní nejdéle nepoužité pipeline, aby bylo místo pro novou."""
+        if key in self._pipelines:
+            return
+        while self._pipelines and len(self._pipelines) >= MAX_RESIDENT_PIPELINES:
+            old_key, (old_pipe, old_device) = self._pipelines.popitem(last=False)
+            self._model_names.pop(old_key, None)
+            del old_pipe
+            free_memory(old_device)
+
+    def _get_pipeline(self, job: Job):
+        """Vrátí rezidentní pipeline pro úlohu, případně ji načte (LRU)."""
+        key = job.pipeline_key()
+        if key in self._pipelines:
+            self._pipelines.move_to_end(key)
+            return self._pipelines[key]
+
+        self._evict_for(key)
+        start = time.time()
+        self._loading_key = key
+        try:
+            pipe, device = load_pipeline(
+                job.params['model_path'],
+                job.params['model_type'],
+                clip_skip=job.params['clip_skip'],
+                sampler=job.params['sampler'],
+                progress_callback=job.set_progress,
+                device=job.device_for(self.device)
+            )
+            if job.params['backend'] == "onnx":
+                enable_onnx_backend(pipe, job.params['model_path'], job.params['model_type'], job.set_progress)
+            elif job.params['backend'] == "int8":
+                enable_int8_backend(pipe, job.params['model_path'], job.params['model_type'], job.set_progress)
+        finally:
+            self._loading_key = None
+        job.timings['load_s'] = time.time() - start
+        self._pipelines[key] = (pipe, device)
+        self._model_names[key] = os.path.basename(job.params['model_path'])
+        return pipe, device
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            for job in batch:
+                job.status = "running"
+                job.set_progress(0.1, "Načítání modelu...")
+            with self._condition:
+                self._running_samples = sum(job.num_samples() for job in batch)
+            try:
+                self._run_batch(batch)
+                self.batches_run += 1
+            except Cancelled:
+                print(f"⏹️ Worker {self.name}: dávka zrušena")
+                for job in batch:
+                    job.mark_cancelled()
+            except Exception as e:
+                print(f"❌ Worker {self.name}: dávka selhala: {e}")
+                for job in batch:
+                    if job.cancel_token.is_cancelled():
+                        job.mark_cancelled()
+                        continue
+                    job.status = "failed"
+                    job.message = str(e)
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running_samples = 0
+
+    def _run_batch(self, batch: List[Job]):
+        first = batch[0]
+        if first.call is not None:
+            # Vlastní funkce (grid) - jen limit souběhu na zařízení
+            estimate = {'device_gb': 0.0, 'host_gb': 0.0, 'chunk': 1}
+        else:
+            resident = first.pipeline_key() in self._pipelines
+            estimate = self.admission.choose_chunk(lambda chunk: self._estimate(batch, chunk, resident), MAX_BATCH_SIZE)
+            if estimate is None:
+                raise MemoryError("Dávka se nevejde do paměti zařízení ani po jednom vzorku")
+            self._evict_for(first.pipeline_key())
+
+        def progress_all(progress: float, text: str = ""):
+            for job in batch:
+                job.set_progress(progress, text)
+
+        cancel_token = BatchCancellation([job.cancel_token for job in batch])
+
+        def on_wait():
+            # Zrušená dávka nečeká na paměť - rezervace ještě neproběhla
+            cancel_token.raise_if_cancelled()
+            progress_all(0.05, "Čeká na volnou paměť...")
+
+        self.admission.acquire(estimate, on_wait=on_wait)
+        start = time.time()
+        stage_futures = []
+        try:
+            stage_futures = self._run_admitted(batch, estimate['chunk'], progress_all, cancel_token)
+        finally:
+            samples = sum(job.num_samples() for job in batch) if first.call is None else 0
+            stage = estimate.get('stage') if stage_futures else None
+            # Slot dávky se uvolní hned, paměť výsledků upscalingu až po dokončení stupně
+            self.admission.release(estimate, samples, time.time() - start, keep=stage)
+        if stage_futures:
+            self._release_after(stage_futures, stage)
+
+    def _release_after(self, futures: List[Future], stage: dict):
+        """Uvolní rezervaci stupně upscalingu, až doběhnou všechny jeho úlohy z dávky."""
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.admission.release_stage(stage)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _run_admitted(self, batch: List[Job], chunk: int, progress_all, cancel_token):
+        first = batch[0]
+        cancel_token.raise_if_cancelled()
+        pipe, device = self._get_pipeline(first)
+        set_scheduler(pipe, first.params['sampler'])
+
+        if first.call is not None:
+            result = first.call(pipe, first)
+            self._finish(first, result)
+            return []
+
+        start = time.time()
+        inputs = []
+        for job in batch:
+            seeds = variant_seeds(job.params['seed'], job.params['variance_seed'], job.num_samples())
+            job.report['seeds'] = seeds
+            job.report['batch_size'] = sum(j.num_samples() for j in batch)
+            if getattr(pipe, 'int8_backend', None):
+                job.report['int8'] = pipe.int8_backend
+            inputs.append((job.input_image, seeds))
+
+        report = {}
+        outputs = generate_batch(pipe, inputs, first.params, progress_all, report, max_batch=chunk, cancel_token=cancel_token)
+        denoise_time = time.time() - start
+
+        stage_futures = []
+        for job, results in zip(batch, outputs):
+            job.report.update(report)
+            job.timings['denoise_s'] = denoise_time
+            if job.cancel_token.is_cancelled():
+                # Zrušená během odšumování dávky - výsledky ostatních úloh se dopočítaly, tyto se zahodí
+                job.mark_cancelled()
+                continue
+            if job.params['upscale_factor'] <= 1:
+                self._finish(job, results)
+                continue
+            # Upscaling běží ve vlastním stupni - worker mezitím odšumuje další dávku
+            job.set_progress(0.9, "Upscaling obrázků...")
+            future = get_upscale_stage().submit(results, job.params['upscale_factor'], job.cancel_token, job.set_progress,
+                                                job.params['upscaler'], device)
+            future.add_done_callback(lambda f, job=job, start=time.time(): self._finish_upscaled(job, f, start))
+            stage_futures.append(future)
+        return stage_futures
+
+    def _finish_upscaled(self, job: Job, future: Future, start: float):
+        error = future.exception()
+        if isinstance(error, Cancelled) or job.cancel_token.is_cancelled():
+            job.mark_cancelled()
+            return
+        if error is not None:
+            job.status = "failed"
+            job.message = str(error)
+            job.future.set_exception(error)
+            return
+        results, variant_times = future.result()
+        job.timings['upscale_s'] = time.time() - start
+        job.timings['upscale_variants_s'] = variant_times
+        self._finish(job, results)
+
+    def _finish(self, job: Job, result):
+        job.status = "done"
+        job.set_progress(1.0, "Hotovo")
+        job.timings['total_s'] = time.time() - job.created_at
+        with self._condition:
+            self.jobs_done += 1
+        job.future.set_result(result)
+
+
+class WorkerPool:
+    """Jeden worker na zařízení a směrování úloh podle načtených modelů."""
+
+    def __init__(self, devices: List[str]):
+        self.workers = [InferenceWorker(name=f"{device}#{i}", device=device) for i, device in enumerate(devices)]
+        self._lock = threading.Lock()
+
+    def route(self, job: Job) -> InferenceWorker:
+        """Zařízení s načteným modelem; repliku jinde jen pokud je přetížené a jiné zařízení stojí."""
+        key = job.pipeline_key()
+        workers = self.workers
+        if job.params['backend'] in CPU_BACKENDS:
+            # ONNX Runtime i int8 počítají na CPU - GPU workery nechá volné, pokud jsou CPU workery
+            workers = [worker for worker in self.workers if worker.device == "cpu"] or self.workers
+        warm = [worker for worker in workers if worker.has_affinity(key)]
+        if warm:
+            best = min(warm, key=lambda worker: worker.backlog())
+            if best.backlog() < REPLICATE_AFTER_SAMPLES:
+                return best
+            idle = [worker for worker in workers if worker not in warm and worker.backlog() == 0]
+            return idle[0] if idle else best
+        return min(workers, key=lambda worker: worker.backlog())
+
+    def enqueue(self, job: Job) -> Job:
+        # Zámek drží směrování a zařazení pohromadě - další úloha už afinitu vidí
+        with self._lock:
+            return self.route(job).enqueue(job)
+
+    def submit(self, input_image, params: dict) -> Job:
+        return self.enqueue(Job(input_image, params))
+
+    def submit_call(self, params: dict, call: Callable, job_id: Optional[str] = None) -> Job:
+        return self.enqueue(Job(params=params, call=call, job_id=job_id))
+
+    def cancel(self, job: Job, reason: str = "Zrušeno") -> bool:
+        """Zruší úlohu - čekající hned, běžící v nejbližším kroku odšumování."""
+        if job.future.done():
+            return False
+        job.cancel_token.cancel(reason)
+        for worker in self.workers:
+            if worker.cancel(job):
+                break
+        return True
+
+    def queue_length(self) -> int:
+        return sum(worker.queue_length() for worker in self.workers)
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                'name': worker.name,
+                'device': worker.device,
+                'backlog': worker.backlog(),
+                'models': worker.resident_models(),
+                'batches_run': worker.batches_run,
+                'jobs_done': worker.jobs_done,
+            }
+            for worker in self.workers
+        ]
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool() -> WorkerPool:
+    """Sdílený pool workerů pro celý proces (všechna zařízení, všechny sessions)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            devices = get_inference_devices(INFERENCE_DEVICES)
+            print(f"🧵 Inference workery: {', '.join(devices)}")
+            _pool = WorkerPool(devices)
+        return _pool